@@ -0,0 +1,321 @@
+import asyncio
+import os
+from datetime import date, datetime, time, timedelta
+from zoneinfo import ZoneInfo
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from sqlalchemy import select
+
+from db import router, Attendance
+from partitions import iter_archive_batches, naive_utc
+
+# CONFIG
+# A student missing more than this share of sessions is flagged
+CHRONIC_ABSENCE_THRESHOLD = float(os.getenv("CHRONIC_ABSENCE_THRESHOLD", "0.1"))
+# Taps more than this many minutes after start_time count as late
+LATE_AFTER_MINUTES = int(os.getenv("LATE_AFTER_MINUTES", "15"))
+# Zone of the schedules' day and HHMM times. present_time is stored in UTC
+# and converted to it before taps are matched to a slot
+SCHEDULE_TIMEZONE = os.getenv("SCHEDULE_TIMEZONE", "UTC")
+SCHEDULE_TZ = ZoneInfo(SCHEDULE_TIMEZONE)
+LOAD_BATCH_SIZE = 50_000
+
+LATENESS_BINS = np.array([-np.inf, 0, 5, 10, 15, 30, np.inf])
+LATENESS_LABELS = ["early", "0-5", "5-10", "10-15", "15-30", "30+"]
+
+ANALYTICS_COLUMNS = ["class_attendee_id", "schedule_id", "present_time"]
+
+# ---------- TIME ZONES ----------
+def schedule_time(present_times: pa.Array) -> pa.Array:
+    """Naive UTC timestamps as naive wall-clock times in SCHEDULE_TIMEZONE."""
+    if SCHEDULE_TIMEZONE == "UTC":
+        return present_times
+    aware = pc.cast(present_times, pa.timestamp(present_times.type.unit, tz="UTC"))
+    return pc.local_timestamp(pc.cast(aware, pa.timestamp(present_times.type.unit, tz=SCHEDULE_TIMEZONE)))
+
+def schedule_day_start(day: date) -> datetime:
+    """Naive UTC instant at which day starts in SCHEDULE_TIMEZONE."""
+    return naive_utc(datetime.combine(day, time.min, tzinfo=SCHEDULE_TZ))
+
+def schedule_date(value) -> np.datetime64:
+    """Day in SCHEDULE_TIMEZONE of an ISO UTC timestamp; NaT when unknown."""
+    if not value:
+        return np.datetime64("NaT", "D")
+    moment = datetime.fromisoformat(value).replace(tzinfo=ZoneInfo("UTC"))
+    return np.datetime64(moment.astimezone(SCHEDULE_TZ).date(), "D")
+
+# ---------- COLUMNAR LOADING ----------
+class AttendanceBatches:
+    """
+    Accumulates attendance batches as integer-coded NumPy columns.
+    class_attendee_id and schedule_id strings are looked up in the roster and
+    schedule lists by Arrow, so no value touches Python; rows of students no
+    longer on a roster, or of schedules deleted since, are coded -1.
+    """
+
+    def __init__(self, schedule_ids: list[str], student_ids: list[str]):
+        self.schedule_ids = pa.array(schedule_ids, pa.string())
+        self.student_ids = pa.array(student_ids, pa.string())
+        self.students = []
+        self.schedules = []
+        self.times = []
+
+    def add(self, class_attendee_ids: pa.Array, schedule_ids: pa.Array, present_times: pa.Array):
+        if len(class_attendee_ids) == 0:
+            return
+
+        student_index = pc.fill_null(pc.index_in(class_attendee_ids, value_set=self.student_ids), -1)
+        self.students.append(student_index.to_numpy(zero_copy_only=False).astype(np.int32))
+
+        schedule_index = pc.fill_null(pc.index_in(schedule_ids, value_set=self.schedule_ids), -1)
+        self.schedules.append(schedule_index.to_numpy(zero_copy_only=False).astype(np.int32))
+
+        local_times = schedule_time(present_times)
+        self.times.append(pc.cast(local_times, pa.timestamp("s"), safe=False).to_numpy(zero_copy_only=False))
+
+    def add_rows(self, rows):
+        columns = list(zip(*rows))
+        self.add(
+            pa.array(columns[0], pa.string()),
+            pa.array(columns[1], pa.string()),
+            pa.array(columns[2], pa.timestamp("us"))
+        )
+
+    def columns(self):
+        if not self.students:
+            return np.empty(0, np.int32), np.empty(0, np.int32), np.empty(0, "datetime64[s]")
+        return np.concatenate(self.students), np.concatenate(self.schedules), np.concatenate(self.times)
+
+async def load_attendance(institution_id: str, start: datetime, end: datetime, schedule_ids: list[str], student_ids: list[str]):
+    batches = AttendanceBatches(schedule_ids, student_ids)
+
+    archived = iter_archive_batches(
+        institution_id, start, end, columns=ANALYTICS_COLUMNS, batch_size=LOAD_BATCH_SIZE
+    )
+    while True:
+        batch = await asyncio.to_thread(next, archived, None)
+        if batch is None:
+            break
+        batches.add(*batch.columns)
+
+    query = select(
+        Attendance.class_attendee_id, Attendance.schedule_id, Attendance.present_time
+    ).where(
+        Attendance.institution_id == institution_id,
+        Attendance.present_time >= start,
+        Attendance.present_time < end
+    )
+    # History tolerates replica lag, so it never needs the primary
+    shard = await router.shard_for(institution_id)
+    async with shard.read_engine.connect() as conn:
+        result = await conn.stream(query.execution_options(yield_per=LOAD_BATCH_SIZE))
+        async for rows in result.partitions(LOAD_BATCH_SIZE):
+            batches.add_rows(rows)
+
+    return batches.columns()
+
+def schedule_columns(schedules: list[dict]):
+    """Split schedule-service's GET /schedules items into NumPy columns."""
+    class_ids, class_index = np.unique(
+        np.array([s["class_id"] for s in schedules], dtype=str), return_inverse=True
+    )
+    start_time = np.array([s["start_time"] for s in schedules], dtype=np.int32)
+    return {
+        "ids": [s["id"] for s in schedules],
+        "class_ids": class_ids.tolist(),
+        "class_index": class_index.astype(np.int32),
+        "day": np.array([s["day"] for s in schedules], dtype=np.int32),
+        # HHMM -> minutes since midnight
+        "start_minutes": (start_time // 100) * 60 + start_time % 100,
+        # No session before the schedule existed is expected
+        "first_day": np.array([schedule_date(s.get("created_at")) for s in schedules], dtype="datetime64[D]"),
+    }
+
+def roster_columns(rosters: dict, class_ids: list[str]):
+    """
+    Every enrollment of the scheduled classes, from class-service's
+    GET /classes/{class_id}/roster attendees per class_id.
+    """
+    class_position = {class_id: i for i, class_id in enumerate(class_ids)}
+    entries = [
+        (entry.class_attendee_id, class_position[class_id], schedule_date(entry.enrolled_at))
+        for class_id, attendees in rosters.items()
+        if class_id in class_position
+        for entry in attendees
+    ]
+    return {
+        "ids": [entry[0] for entry in entries],
+        "class_index": np.array([entry[1] for entry in entries], dtype=np.int32),
+        "first_day": np.array([entry[2] for entry in entries], dtype="datetime64[D]"),
+    }
+
+# ---------- METRICS ----------
+def weekday_occurrences(first: np.ndarray, last: np.ndarray, weekday: np.ndarray) -> np.ndarray:
+    """Days of ISO weekday (1..7) in [first, last], elementwise over datetime64[D] bounds."""
+    first_day = first.astype(np.int64)
+    last_day = last.astype(np.int64)
+    # 1970-01-01 was a Thursday (ISO 4)
+    first_weekday = (first_day + 3) % 7 + 1
+    first_match = first_day + (weekday - first_weekday) % 7
+    return np.where(first_match <= last_day, (last_day - first_match) // 7 + 1, 0)
+
+def expected_sessions(students: dict, schedules: dict, start: date, end: date) -> np.ndarray:
+    """
+    Sessions each enrollment was expected at: for every schedule of its
+    class, the slot's weekdays from the latest of start, the schedule's
+    creation and the enrollment, up to end.
+    """
+    n_students = len(students["class_index"])
+    n_classes = len(schedules["class_ids"])
+
+    # Enrollments grouped by class, so each schedule pairs with one slice
+    order = np.argsort(students["class_index"], kind="stable")
+    class_size = np.bincount(students["class_index"], minlength=n_classes)
+    class_first = np.cumsum(class_size) - class_size
+
+    per_schedule = class_size[schedules["class_index"]]
+    pair_schedule = np.repeat(np.arange(len(per_schedule)), per_schedule)
+    pair_offset = np.arange(len(pair_schedule)) - np.repeat(np.cumsum(per_schedule) - per_schedule, per_schedule)
+    pair_student = order[class_first[schedules["class_index"]][pair_schedule] + pair_offset]
+
+    # Unknown creation or enrollment days (NaT) do not narrow the range
+    first = np.full(len(pair_schedule), np.datetime64(start, "D"))
+    for bound in (schedules["first_day"][pair_schedule], students["first_day"][pair_student]):
+        first = np.where(np.isnat(bound) | (bound < first), first, bound)
+
+    occurrences = weekday_occurrences(first, np.datetime64(end, "D"), schedules["day"][pair_schedule])
+    return np.bincount(pair_student, weights=occurrences, minlength=n_students).astype(np.int64)
+
+def compute_report(
+    student_index: np.ndarray,
+    schedule_index: np.ndarray,
+    present_time: np.ndarray,
+    students: dict,
+    schedules: dict,
+    start: date,
+    end: date,
+    chronic_threshold: float = CHRONIC_ABSENCE_THRESHOLD
+) -> dict:
+    """
+    Per-student (per class enrollment) attendance metrics over [start, end].
+
+    Every enrollment on the rosters is reported, including students who
+    never tapped; taps of students no longer enrolled are left out. A
+    session is one (student, schedule, date); repeated taps collapse into
+    the earliest one, which is also the tap used for lateness. present_time
+    must already be in the schedules' zone (AttendanceBatches does this).
+    """
+    n_students = len(students["class_index"])
+    n_schedules = len(schedules["ids"])
+    n_days = (end - start).days + 1
+
+    valid = (schedule_index >= 0) & (student_index >= 0)
+    student_index = student_index[valid]
+    schedule_index = schedule_index[valid]
+    present_time = present_time[valid]
+
+    days = present_time.astype("datetime64[D]")
+    minute_of_day = ((present_time - days) // np.timedelta64(1, "m")).astype(np.int32)
+    day_offset = (days - np.datetime64(start, "D")).astype(np.int64)
+
+    # One sort on (session, minute) groups taps by session with the earliest tap first
+    session_key = (student_index.astype(np.int64) * n_schedules + schedule_index) * n_days + day_offset
+    order = np.argsort(session_key * 1440 + minute_of_day)
+    sorted_keys = session_key[order]
+    first = order[np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1]))] if len(order) else order
+
+    s_student = student_index[first]
+    s_schedule = schedule_index[first]
+    lateness = (minute_of_day[first] - schedules["start_minutes"][s_schedule]).astype(np.float64)
+
+    attended = np.bincount(s_student, minlength=n_students)
+    late_sessions = np.bincount(s_student[lateness > LATE_AFTER_MINUTES], minlength=n_students)
+    total_lateness = np.bincount(s_student, weights=np.clip(lateness, 0, None), minlength=n_students)
+    mean_lateness = np.divide(
+        total_lateness, attended, out=np.zeros(n_students), where=attended > 0
+    )
+
+    expected = expected_sessions(students, schedules, start, end)
+
+    attendance_rate = np.minimum(
+        np.divide(attended, expected, out=np.zeros(n_students), where=expected > 0), 1.0
+    )
+    chronic = (expected > 0) & (attendance_rate < 1.0 - chronic_threshold)
+
+    counts, _ = np.histogram(lateness, bins=LATENESS_BINS)
+    percentiles = np.percentile(lateness, [50, 90, 99]) if len(lateness) else np.zeros(3)
+
+    return {
+        "attended": attended,
+        "expected": expected,
+        "attendance_rate": attendance_rate,
+        "mean_lateness": mean_lateness,
+        "late_sessions": late_sessions,
+        "chronic_absence": chronic,
+        "lateness_counts": dict(zip(LATENESS_LABELS, counts.tolist())),
+        "lateness_percentiles": dict(zip(["p50", "p90", "p99"], percentiles.tolist())),
+        "sessions": int(len(first)),
+    }
+
+async def build_report(
+    institution_id: str,
+    schedules: list[dict],
+    rosters: dict,
+    start: date,
+    end: date,
+    chronic_threshold: float = CHRONIC_ABSENCE_THRESHOLD
+) -> dict:
+    """start and end are days in SCHEDULE_TIMEZONE; rosters maps class_id to its roster attendees."""
+    schedule_cols = schedule_columns(schedules)
+    roster = roster_columns(rosters, schedule_cols["class_ids"])
+    student_index, schedule_index, present_time = await load_attendance(
+        institution_id,
+        schedule_day_start(start),
+        schedule_day_start(end + timedelta(days=1)),
+        schedule_cols["ids"],
+        roster["ids"]
+    )
+
+    metrics = await asyncio.to_thread(
+        compute_report,
+        student_index, schedule_index, present_time,
+        roster, schedule_cols, start, end, chronic_threshold
+    )
+
+    class_ids = schedule_cols["class_ids"]
+    students = [
+        {
+            "class_attendee_id": student_id,
+            "class_id": class_ids[class_idx],
+            "attended": attended,
+            "expected": expected,
+            "attendance_rate": round(rate, 4),
+            "mean_lateness_minutes": round(lateness, 2),
+            "late_sessions": late,
+            "chronic_absence": chronic,
+        }
+        for student_id, class_idx, attended, expected, rate, lateness, late, chronic in zip(
+            roster["ids"],
+            roster["class_index"].tolist(),
+            metrics["attended"].tolist(),
+            metrics["expected"].tolist(),
+            metrics["attendance_rate"].tolist(),
+            metrics["mean_lateness"].tolist(),
+            metrics["late_sessions"].tolist(),
+            metrics["chronic_absence"].tolist()
+        )
+    ]
+
+    return {
+        "start": start,
+        "end": end,
+        "sessions": metrics["sessions"],
+        "students": students,
+        "chronic_absence_count": int(metrics["chronic_absence"].sum()),
+        "lateness": {
+            "buckets": metrics["lateness_counts"],
+            "percentiles": metrics["lateness_percentiles"],
+        },
+    }
@@ -0,0 +1,130 @@
+"""
+Benchmark for the attendance analytics engine on one generated year of data.
+
+    python bench_analytics.py --students 20000
+
+Generates integer-coded attendance columns directly (the shape
+AttendanceBatches produces), then times AttendanceBatches encoding on a
+sample of string batches and compute_report on the full year.
+"""
+import argparse
+import time
+from datetime import date, timedelta
+
+import numpy as np
+import pyarrow as pa
+
+from analytics import AttendanceBatches, compute_report
+
+def generate(students: int, classes_per_student: int, class_size: int, attendance_rate: float, seed: int):
+    rng = np.random.default_rng(seed)
+    start = date(2025, 8, 1)
+    end = start + timedelta(days=364)
+
+    # Every class meets twice a week at a fixed slot
+    n_classes = students * classes_per_student // class_size
+    n_schedules = n_classes * 2
+    schedule_class = np.repeat(np.arange(n_classes, dtype=np.int32), 2)
+    schedule_day = rng.integers(1, 6, n_schedules, dtype=np.int32)
+    schedule_start = rng.choice(np.array([700, 800, 1000, 1300, 1500], dtype=np.int32), n_schedules)
+    schedules = {
+        "ids": [f"sch-{i}" for i in range(n_schedules)],
+        "class_ids": [f"cls-{i}" for i in range(n_classes)],
+        "class_index": schedule_class,
+        "day": schedule_day,
+        "start_minutes": (schedule_start // 100) * 60 + schedule_start % 100,
+        # Every schedule and enrollment predates the year
+        "first_day": np.full(n_schedules, np.datetime64("NaT"), dtype="datetime64[D]"),
+    }
+
+    # One enrollment (class_attendee) per student per class
+    n_enrollments = n_classes * class_size
+    enrollments = {
+        "ids": [f"ca-{i}" for i in range(n_enrollments)],
+        "class_index": np.arange(n_enrollments, dtype=np.int32) // class_size,
+        "first_day": np.full(n_enrollments, np.datetime64("NaT"), dtype="datetime64[D]"),
+    }
+
+    days = np.arange(np.datetime64(start), np.datetime64(end) + 1)
+    iso_weekday = (days.astype(np.int64) + 3) % 7 + 1
+
+    student_parts, schedule_parts, time_parts = [], [], []
+    for schedule in range(n_schedules):
+        session_days = days[iso_weekday == schedule_day[schedule]]
+        first_member = int(schedule_class[schedule]) * class_size
+        members = np.arange(first_member, first_member + class_size)
+        present = rng.random((len(session_days), len(members))) < attendance_rate
+        day_idx, member_idx = np.nonzero(present)
+        # Lateness roughly normal around 3 minutes, in seconds
+        offsets = rng.normal(180, 420, len(day_idx)).astype(np.int64)
+        start_seconds = int(schedules["start_minutes"][schedule]) * 60
+        student_parts.append(members[member_idx].astype(np.int32))
+        schedule_parts.append(np.full(len(day_idx), schedule, dtype=np.int32))
+        time_parts.append(
+            session_days[day_idx].astype("datetime64[s]")
+            + (start_seconds + offsets).astype("timedelta64[s]")
+        )
+
+    return (
+        np.concatenate(student_parts),
+        np.concatenate(schedule_parts),
+        np.concatenate(time_parts),
+        enrollments,
+        schedules,
+        start,
+        end,
+    )
+
+def bench_encoding(student_index, schedule_index, present_time, enrollments, schedules, rows: int):
+    sample = slice(0, rows)
+    batches = AttendanceBatches(schedules["ids"], enrollments["ids"])
+    class_attendee_ids = pa.array([f"ca-{i}" for i in student_index[sample]])
+    schedule_ids = pa.array([schedules["ids"][i] for i in schedule_index[sample]])
+    times = pa.array(present_time[sample])
+
+    began = time.perf_counter()
+    for offset in range(0, rows, 50_000):
+        batches.add(
+            class_attendee_ids[offset:offset + 50_000],
+            schedule_ids[offset:offset + 50_000],
+            times[offset:offset + 50_000]
+        )
+    batches.columns()
+    return time.perf_counter() - began
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--students", type=int, default=20_000)
+    parser.add_argument("--classes-per-student", type=int, default=5)
+    parser.add_argument("--class-size", type=int, default=40)
+    parser.add_argument("--attendance-rate", type=float, default=0.88)
+    parser.add_argument("--encode-rows", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    began = time.perf_counter()
+    student_index, schedule_index, present_time, enrollments, schedules, start, end = generate(
+        args.students, args.classes_per_student, args.class_size, args.attendance_rate, args.seed
+    )
+    print(f"generated {len(student_index):,} attendances for {len(enrollments['ids']):,} enrollments "
+          f"and {len(schedules['ids']):,} schedules in {time.perf_counter() - began:.1f}s")
+
+    encode_rows = min(args.encode_rows, len(student_index))
+    elapsed = bench_encoding(student_index, schedule_index, present_time, enrollments, schedules, encode_rows)
+    print(f"encode: {encode_rows:,} rows in {elapsed:.3f}s ({encode_rows / elapsed:,.0f} rows/s)")
+
+    timings = []
+    for _ in range(args.repeat):
+        began = time.perf_counter()
+        report = compute_report(student_index, schedule_index, present_time, enrollments, schedules, start, end)
+        timings.append(time.perf_counter() - began)
+
+    best = min(timings)
+    print(f"compute_report: best {best:.3f}s of {args.repeat} ({len(student_index) / best:,.0f} rows/s)")
+    print(f"sessions={report['sessions']:,} chronic={int(report['chronic_absence'].sum()):,} "
+          f"mean_rate={report['attendance_rate'].mean():.3f}")
+    print(f"lateness buckets={report['lateness_counts']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+from collections import deque
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy import event, exc, text
+import os
+import random
+import time
+
+from tracing import trace_queries
+from querycount import count_queries
+
+# CONFIG
+# Optional Postgres schema, for when several services share one database (monolith mode)
+DB_SCHEMA = os.getenv("DB_SCHEMA")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+# Seconds to wait for a free connection before failing the request
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+# 0 disables; applied server-side to every statement on our connections
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+# Prepared statements kept per connection; set 0 behind pgbouncer in transaction mode
+DB_PREPARED_STATEMENT_CACHE_SIZE = int(os.getenv("DB_PREPARED_STATEMENT_CACHE_SIZE", "100"))
+# DB_ECHO=1 logs every statement; DB_ECHO_SAMPLE_RATE logs that fraction with timings
+DB_ECHO = os.getenv("DB_ECHO", "0") == "1"
+DB_ECHO_SAMPLE_RATE = float(os.getenv("DB_ECHO_SAMPLE_RATE", "0"))
+
+CHECKOUT_WINDOW = 1000
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """Queue pool that records how long each checkout waited and how often it timed out."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkout_seconds = deque(maxlen=CHECKOUT_WINDOW)
+        self.checkouts = 0
+        self.checkout_timeouts = 0
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            self.checkout_timeouts += 1
+            raise
+        finally:
+            self.checkouts += 1
+            self.checkout_seconds.append(time.perf_counter() - started)
+
+    def recreate(self):
+        # Keep the counters across pool resets (e.g. after a disconnect)
+        pool = super().recreate()
+        pool.checkout_seconds = self.checkout_seconds
+        pool.checkouts = self.checkouts
+        pool.checkout_timeouts = self.checkout_timeouts
+        return pool
+
+def make_engine(database_url: str) -> AsyncEngine:
+    server_settings = {}
+    if DB_SCHEMA:
+        server_settings["search_path"] = DB_SCHEMA
+    if DB_STATEMENT_TIMEOUT_MS:
+        server_settings["statement_timeout"] = str(DB_STATEMENT_TIMEOUT_MS)
+
+    engine = create_async_engine(
+        database_url,
+        echo=DB_ECHO,
+        poolclass=InstrumentedPool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        connect_args={
+            "server_settings": server_settings,
+            "prepared_statement_cache_size": DB_PREPARED_STATEMENT_CACHE_SIZE
+        }
+    )
+    if DB_ECHO_SAMPLE_RATE > 0 and not DB_ECHO:
+        install_sampled_echo(engine)
+    # A context variable lookup per statement unless the request is traced
+    trace_queries(engine)
+    # Per-request statement counts for the N+1 detector (querycount.py)
+    count_queries(engine)
+    return engine
+
+def install_sampled_echo(engine: AsyncEngine, rate: float = DB_ECHO_SAMPLE_RATE):
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def before(conn, cursor, statement, parameters, context, executemany):
+        if random.random() < rate:
+            context._echo_started = time.perf_counter()
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def after(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_echo_started", None)
+        if started is not None:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            print(f"SQL sample ({elapsed_ms:.1f} ms): {' '.join(statement.split())}")
+
+async def ensure_schema(conn):
+    if DB_SCHEMA:
+        await conn.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{DB_SCHEMA}"'))
+
+def pool_stats(engine: AsyncEngine) -> dict:
+    """Size, saturation and checkout wait percentiles of the engine's pool."""
+    pool = engine.sync_engine.pool
+    capacity = pool.size() + max(pool._max_overflow, 0)
+    waits = sorted(pool.checkout_seconds)
+
+    def percentile(q):
+        return waits[min(len(waits) - 1, int(q * len(waits)))] if waits else None
+
+    return {
+        "size": pool.size(),
+        "max_overflow": pool._max_overflow,
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "saturation": pool.checkedout() / capacity if capacity else None,
+        "checkouts": pool.checkouts,
+        "checkout_timeouts": pool.checkout_timeouts,
+        "checkout_p50_seconds": percentile(0.5),
+        "checkout_p99_seconds": percentile(0.99),
+        "checkout_max_seconds": waits[-1] if waits else None
+    }
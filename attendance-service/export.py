@@ -0,0 +1,100 @@
+import asyncio
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
+
+from sqlalchemy import select
+
+from db import router, Attendance
+from partitions import iter_archive_batches
+
+EXPORT_CHUNK_SIZE = 5000
+
+EXPORT_COLUMNS = [
+    "id", "class_attendee_id", "schedule_id", "class_name", "room_name", "present_time"
+]
+
+# ---------- ROW SOURCES ----------
+async def iter_archived_rows(institution_id: str, start: datetime = None, end: datetime = None):
+    batches = iter_archive_batches(
+        institution_id, start, end, columns=EXPORT_COLUMNS, batch_size=EXPORT_CHUNK_SIZE
+    )
+    while True:
+        # Parquet decoding blocks, keep it off the event loop
+        batch = await asyncio.to_thread(next, batches, None)
+        if batch is None:
+            return
+        columns = batch.to_pydict()
+        yield list(zip(*(columns[name] for name in EXPORT_COLUMNS)))
+
+async def iter_hot_rows(institution_id: str, start: datetime = None, end: datetime = None):
+    query = select(*(getattr(Attendance, name) for name in EXPORT_COLUMNS)).where(
+        Attendance.institution_id == institution_id
+    )
+    if start:
+        query = query.where(Attendance.present_time >= start)
+    if end:
+        query = query.where(Attendance.present_time < end)
+
+    # stream() uses a server-side cursor, so only one chunk is held at a time
+    # History tolerates replica lag, so it never needs the primary
+    shard = await router.shard_for(institution_id)
+    async with shard.read_engine.connect() as conn:
+        result = await conn.stream(query.execution_options(yield_per=EXPORT_CHUNK_SIZE))
+        async for rows in result.partitions(EXPORT_CHUNK_SIZE):
+            yield rows
+
+async def iter_export_rows(institution_id: str, start: datetime = None, end: datetime = None):
+    async for rows in iter_archived_rows(institution_id, start, end):
+        yield rows
+    async for rows in iter_hot_rows(institution_id, start, end):
+        yield rows
+
+# ---------- ENCODERS ----------
+def format_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+def encode_csv(rows, header: bool = False) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(EXPORT_COLUMNS)
+    writer.writerows([format_value(v) for v in row] for row in rows)
+    return buffer.getvalue().encode()
+
+def encode_ndjson(rows) -> bytes:
+    return "".join(
+        json.dumps(dict(zip(EXPORT_COLUMNS, (format_value(v) for v in row)))) + "\n"
+        for row in rows
+    ).encode()
+
+async def stream_export(
+    institution_id: str,
+    format: str,
+    compress: bool,
+    start: datetime = None,
+    end: datetime = None
+):
+    """
+    Yield the encoded export chunk by chunk. With compress, every chunk is
+    gzip'd and sync-flushed so the client receives data as soon as it is read.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+
+    def emit(chunk: bytes) -> bytes:
+        if compressor:
+            return compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        return chunk
+
+    if format == "csv":
+        yield emit(encode_csv([], header=True))
+
+    async for rows in iter_export_rows(institution_id, start, end):
+        yield emit(encode_csv(rows) if format == "csv" else encode_ndjson(rows))
+
+    if compressor:
+        yield compressor.flush()
@@ -1,17 +1,53 @@
-from fastapi import FastAPI, Depends, HTTPException, Header
+from fastapi import FastAPI, Depends, HTTPException, Header, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from jose import jwt, JWTError
+import asyncio
+import json
 import os
 import httpx
-from datetime import datetime
+import msgspec
+from datetime import datetime, date, timedelta
+from typing import Optional
+from functools import lru_cache
+from pydantic import ValidationError
 
-from db import SessionLocal, Attendance, init_db
+from db import router, Attendance
+from migrate import check_schema
+from background import spawn, cancel_all
+from replica import ReadYourWrites
+from admission import AdmissionControl
+from tokens import verified_claims
+from compress import Compression
+from tracing import Tracing
+from querycount import QueryCounter
+from metrics import Counter, Instrumentation, register_collector, metrics_response, pool_metrics, admission_metrics, upstream_metrics, coalescing_metrics, cache_metrics
+from http_client import close_client
+from resilience import CircuitOpenError
+import resilience
+import tracing
+from singleflight import coalesced_call, flights
+from cache import SWRCache
+from warmup import warmup_loop, WARMUP_ENABLED
+from pubsub import broker
+from partitions import ensure_partitions, maintenance_loop, read_archive, naive_utc, ARCHIVE_COLUMNS
+from export import stream_export
+from analytics import build_report, CHRONIC_ABSENCE_THRESHOLD, SCHEDULE_TZ
+from wire import accept_headers, decode
 from schemas import (
     CredentialResponse,
     SubmitPresenceRequest,
-    SubmitPresenceResponse
+    SubmitPresenceResponse,
+    AttendanceRecord,
+    AttendanceHistoryResponse,
+    AttendanceReportResponse,
+    ScheduleList,
+    Roster,
+    EnrollmentValidation,
+    SecretValidation
 )
 
 # CONFIG
@@ -23,34 +59,282 @@ ATTENDEE_SERVICE_URL = os.getenv("ATTENDEE_SERVICE_URL", "http://18.214.134.23:8
 CLASS_SERVICE_URL = os.getenv("CLASS_SERVICE_URL", "http://3.225.88.17:8000")
 SCHEDULE_SERVICE_URL = os.getenv("SCHEDULE_SERVICE_URL", "http://3.239.169.255:8000")
 
+# Reference data cache (seconds)
+SCHEDULE_CACHE_TTL = float(os.getenv("SCHEDULE_CACHE_TTL", "30"))
+SCHEDULE_CACHE_STALE = float(os.getenv("SCHEDULE_CACHE_STALE", "300"))
+SCHEDULE_CACHE_STALE_IF_ERROR = float(os.getenv("SCHEDULE_CACHE_STALE_IF_ERROR", "3600"))
+# Rosters decide who may tap, so a removed enrollment is only honoured for
+# TTL + STALE seconds (TTL + STALE_IF_ERROR while class-service is down)
+ROSTER_CACHE_TTL = float(os.getenv("ROSTER_CACHE_TTL", "60"))
+ROSTER_CACHE_STALE = float(os.getenv("ROSTER_CACHE_STALE", "30"))
+ROSTER_CACHE_STALE_IF_ERROR = float(os.getenv("ROSTER_CACHE_STALE_IF_ERROR", "600"))
+# Rosters fetched at once while building a report
+REPORT_ROSTER_CONCURRENCY = int(os.getenv("REPORT_ROSTER_CONCURRENCY", "8"))
+
+# An upstream call that gave no usable answer: transport errors, an open
+# breaker, or a body that is not the expected shape (msgspec.ValidationError
+# is a DecodeError)
+UPSTREAM_FAILURES = (httpx.HTTPError, CircuitOpenError, msgspec.DecodeError)
+
 security = HTTPBearer()
 app = FastAPI()
+app.add_middleware(
+    AdmissionControl,
+    secret=JWT_SECRET,
+    bulk=["GET /attendance/history", "GET /attendance/export", "GET /attendance/report"]
+)
+app.add_middleware(ReadYourWrites, secret=JWT_SECRET)
+# Counts each request's queries and warns when they grow with its input
+app.add_middleware(QueryCounter, service="attendance-service")
+# Counts and times every request, including any wait for admission
+app.add_middleware(Instrumentation)
+# Joins the caller's trace or samples a new one; spans cover calls and queries
+app.add_middleware(Tracing, service="attendance-service")
+# Outermost, so handlers see plain bodies and large responses leave compressed
+app.add_middleware(Compression)
 
 # ---------- DB ----------
+# Both follow the shard of the request's institution (shards.py)
 async def get_db():
-    async with SessionLocal() as session:
+    async with router.session() as session:
+        yield session
+
+async def get_read_db():
+    async with router.session(readonly=True) as session:
         yield session
 
 @app.on_event("startup")
 async def startup():
-    await init_db()
+    # Schema changes are applied by migrate.py, not by pods
+    await check_schema()
+    for shard in router.shards.values():
+        async with shard.engine.begin() as conn:
+            await ensure_partitions(conn, shard.name)
+    spawn(maintenance_loop())
+
+    if WARMUP_ENABLED:
+        # Reads every institution's upcoming slots
+        token = create_access_token({"sub": "attendance-service", "role": "sync"})
+        spawn(warmup_loop(
+            SCHEDULE_SERVICE_URL,
+            token,
+            warm_reads,
+            warm_institution
+        ))
+
+@app.on_event("shutdown")
+async def shutdown():
+    await cancel_all()
+    await close_client()
 
 # ---------- JWT HELPER ----------
 def create_access_token(data: dict):
     return jwt.encode(data, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
 def get_current_institution(
+    request: Request,
     credentials: HTTPAuthorizationCredentials = Depends(security)
 ) -> dict:
-    try:
-        payload = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        return payload
-    except JWTError:
+    # Decoded once per request and shared with the middlewares (tokens.py)
+    payload = verified_claims(request.scope, JWT_SECRET, JWT_ALGORITHM)
+    if payload is None:
         raise HTTPException(status_code=401, detail="Invalid token")
+    return payload
+
+def require_service(
+    request: Request,
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """/internal/* reports expose topology and tenant placement: service and sync tokens only."""
+    payload = verified_claims(request.scope, JWT_SECRET, JWT_ALGORITHM)
+    if payload is None:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    if payload.get("role") not in ("service", "sync"):
+        raise HTTPException(status_code=403, detail="Service token required")
 
 def get_raw_token(credentials: HTTPAuthorizationCredentials = Depends(security)) -> str:
     return credentials.credentials
 
+def retry_after(resp: httpx.Response) -> Optional[dict]:
+    """Retry-After for a 503 passed on from an upstream that sent one (admission control does)."""
+    value = resp.headers.get("retry-after")
+    return {"Retry-After": value} if value else None
+
+@lru_cache(maxsize=4096)
+def internal_headers(institution_id: str) -> dict:
+    # Internal tokens carry no expiry, so one per institution can be reused.
+    # "caller" keeps these hops out of the upstream's per-institution limit
+    internal_token = create_access_token({"sub": institution_id, "role": "admin", "caller": "attendance-service"})
+    # Upstreams answer these calls in MessagePack (wire.py)
+    return {"Authorization": f"Bearer {internal_token}", **accept_headers()}
+
+# ---------- REFERENCE DATA ----------
+# Timetables change rarely but are read on every tap; serve them from cache,
+# refresh in the background, and ride out short schedule-service outages
+schedule_cache = SWRCache(
+    "schedules",
+    ttl=SCHEDULE_CACHE_TTL,
+    stale_ttl=SCHEDULE_CACHE_STALE,
+    error_ttl=SCHEDULE_CACHE_STALE_IF_ERROR
+)
+
+async def fetch_schedules(institution_id: str) -> list:
+    try:
+        # A lecture's first taps all ask for the same list at once
+        resp = await coalesced_call(
+            "presence.schedules", institution_id,
+            "schedule-service", "GET",
+            f"{SCHEDULE_SERVICE_URL}/schedules",
+            idempotent=True,
+            hedge=True,
+            headers=internal_headers(institution_id)
+        )
+        if resp.status_code != 200:
+            raise HTTPException(status_code=503, detail="Schedule validation failed", headers=retry_after(resp))
+        return decode(resp, ScheduleList).schedules
+    except UPSTREAM_FAILURES as e:
+        print(f"Schedule Service Error: {e}")
+        raise HTTPException(status_code=503, detail="Schedule validation failed")
+
+# Enrollment per class as {attendee_code: class_attendee_id}; codes missing
+# from it are still checked with class-service, so new enrollments work at once
+roster_cache = SWRCache(
+    "rosters",
+    ttl=ROSTER_CACHE_TTL,
+    stale_ttl=ROSTER_CACHE_STALE,
+    error_ttl=ROSTER_CACHE_STALE_IF_ERROR
+)
+
+async def fetch_roster_entries(institution_id: str, class_id: str, site: str = "presence.roster"):
+    """The class's RosterEntry list, or None when the class no longer exists."""
+    resp = await coalesced_call(
+        site, institution_id,
+        "class-service", "GET",
+        f"{CLASS_SERVICE_URL}/classes/{class_id}/roster",
+        idempotent=True,
+        headers=internal_headers(institution_id)
+    )
+    if resp.status_code == 404:
+        return None
+    resp.raise_for_status()
+    return decode(resp, Roster).attendees
+
+async def fetch_roster(institution_id: str, class_id: str):
+    attendees = await fetch_roster_entries(institution_id, class_id)
+    if attendees is None:
+        return None
+    return {a.attendee_code: a.class_attendee_id for a in attendees}
+
+# Monolith mode (monolith/launcher.py) puts the siblings' own functions for
+# the two validations every tap makes here, keyed "attendee.validate_secret"
+# and "class.validate_attendee": no socket, HTTP or body encoding per tap
+local_calls = {}
+
+async def call_local(name: str, detail: str, type, *args):
+    """local_calls[name](*args) as type, a failure of the sibling as 503 detail."""
+    with tracing.span(f"local {name}"):
+        try:
+            return msgspec.convert(await local_calls[name](*args), type)
+        except Exception as e:
+            print(f"{name} error: {e}")
+            raise HTTPException(status_code=503, detail=detail)
+
+async def validate_secret(institution_id: str, code: str, secret: str) -> SecretValidation:
+    if "attendee.validate_secret" in local_calls:
+        return await call_local("attendee.validate_secret", "Attendee validation failed", SecretValidation, institution_id, code, secret)
+
+    # Admin Token (to reuse for inter-service calls)
+    # Since the machine token might not be accepted by other services if they check for "admin",
+    # We should ideally have an Admin token. 
+    # BUT, for simplicity in this system design, we assume services accept the JWT signed by the same secret.
+    # However, Attendee/Class/Schedule services specifically check for 'role': 'admin'.
+    # The 'attendance machine' token has role 'attendee'.
+    # To fix this: We need to sign a temporary ADMIN token here to talk to other services,
+    # Solution: We generate a short-lived admin token for internal calls.
+    headers = internal_headers(institution_id)
+
+    try:
+        resp = await coalesced_call(
+            "presence.validate_secret", institution_id,
+            "attendee-service", "POST",
+            f"{ATTENDEE_SERVICE_URL}/attendees/validate-secret",
+            idempotent=True,
+            json={"code": code, "secret": secret},
+            headers=headers
+        )
+    except (httpx.HTTPError, CircuitOpenError) as e:
+        print(f"Attendee Service Error: {e}")
+        raise HTTPException(status_code=503, detail="Attendee validation failed")
+
+    # Busy is not a wrong secret: a 429 tells the machine to retry
+    if resp.status_code >= 500 or resp.status_code == 429:
+        raise HTTPException(status_code=503, detail="Attendee validation failed", headers=retry_after(resp))
+    if resp.status_code != 200:
+        raise HTTPException(status_code=400, detail="Invalid attendee secret or code")
+    try:
+        return decode(resp, SecretValidation)
+    except msgspec.DecodeError as e:
+        print(f"Attendee Service Error: {e}")
+        raise HTTPException(status_code=503, detail="Attendee validation failed")
+
+async def validate_enrollment(institution_id: str, class_id: str, attendee_code: str) -> str:
+    if "class.validate_attendee" in local_calls:
+        val_data = await call_local(
+            "class.validate_attendee", "Enrollment validation failed", EnrollmentValidation,
+            institution_id, class_id, attendee_code
+        )
+        if not val_data.valid:
+            raise HTTPException(status_code=400, detail="Student is not enrolled in this class")
+        return val_data.class_attendee_id
+
+    try:
+        resp = await coalesced_call(
+            "presence.validate_attendee", institution_id,
+            "class-service", "POST",
+            f"{CLASS_SERVICE_URL}/classes/validate-attendee",
+            idempotent=True,
+            json={"class_id": class_id, "attendee_code": attendee_code},
+            headers=internal_headers(institution_id)
+        )
+    except (httpx.HTTPError, CircuitOpenError) as e:
+        print(f"Class Service Error: {e}")
+        raise HTTPException(status_code=503, detail="Enrollment validation failed")
+
+    # Only a 200 carries an answer; a 429 means class-service is busy, not
+    # that the student is unknown
+    if resp.status_code >= 500 or resp.status_code == 429:
+        raise HTTPException(status_code=503, detail="Enrollment validation failed", headers=retry_after(resp))
+    if resp.status_code != 200:
+        raise HTTPException(status_code=400, detail="Student is not enrolled in this class")
+    try:
+        val_data = decode(resp, EnrollmentValidation)
+    except msgspec.DecodeError as e:
+        print(f"Class Service Error: {e}")
+        raise HTTPException(status_code=503, detail="Enrollment validation failed")
+    if not val_data.valid:
+        raise HTTPException(status_code=400, detail="Student is not enrolled in this class")
+    
+    return val_data.class_attendee_id
+
+def warm_reads(institution_id: str, slots: list[dict]) -> list:
+    """One read per upstream of the tap path, sent concurrently by the warm-up to open connections."""
+    headers = internal_headers(institution_id)
+    return [
+        ("GET", f"{SCHEDULE_SERVICE_URL}/schedules", {"headers": headers}),
+        ("GET", f"{CLASS_SERVICE_URL}/classes/{slots[0]['class_id']}/roster", {"headers": headers}),
+        # Matches no attendee, but runs the same handler and statement as a tap
+        ("POST", f"{ATTENDEE_SERVICE_URL}/attendees/validate-secret", {"json": {"code": "", "secret": ""}, "headers": headers})
+    ]
+
+async def warm_institution(institution_id: str, slots: list[dict]):
+    """Called by the warm-up loop shortly before an institution's slots start."""
+    await schedule_cache.prime(institution_id, lambda: fetch_schedules(institution_id))
+    for class_id in {slot["class_id"] for slot in slots}:
+        await roster_cache.prime(
+            f"{institution_id}:{class_id}",
+            lambda: fetch_roster(institution_id, class_id)
+        )
+
 # ---------- API ----------
 
 # 1. GET CREDENTIAL (Admin Only)
@@ -80,89 +364,99 @@ async def submit_presence(
     # Verify this is a valid attendance token
     if payload.get("role") != "attendee" and payload.get("role") != "admin":
         raise HTTPException(status_code=403, detail="Invalid role for submission")
-        
-    institution_id = payload["sub"]
+
+    return await record_presence(data, payload["sub"], db)
+
+# Outcome of every tap, whichever way it arrived. Rejections are labelled by
+# the fixed reasons below, never by the detail text itself
+PRESENCES_ACCEPTED = Counter("attendance_presences_accepted_total", "Presence taps recorded").labels()
+PRESENCES_REJECTED = Counter(
+    "attendance_presences_rejected_total", "Presence taps refused, by reason",
+    ["reason"]
+)
+REJECTION_REASONS = {
+    "Attendee validation failed": "attendee_unavailable",
+    "Invalid attendee secret or code": "invalid_secret",
+    "No class scheduled in this room right now": "no_schedule",
+    "Enrollment validation failed": "class_unavailable",
+    "Student is not enrolled in this class": "not_enrolled"
+}
+
+async def record_presence(
+    data: SubmitPresenceRequest,
+    institution_id: str,
+    db: AsyncSession
+) -> SubmitPresenceResponse:
+    """Validate and persist one tap. Shared by POST /attendance/presence and the machine WebSocket."""
+    try:
+        result = await validate_and_store(data, institution_id, db)
+    except HTTPException as e:
+        PRESENCES_REJECTED.labels(REJECTION_REASONS.get(e.detail, "other")).inc()
+        raise
+    except Exception:
+        PRESENCES_REJECTED.labels("error").inc()
+        raise
+    PRESENCES_ACCEPTED.inc()
+    return result
+
+async def validate_and_store(
+    data: SubmitPresenceRequest,
+    institution_id: str,
+    db: AsyncSession
+) -> SubmitPresenceResponse:
+    # Validate Secret (Attendee Service)
+    # Upstream outages map to 503; a definite "no" from the upstream stays a 400
+    secret_data = await validate_secret(institution_id, data.attendee_code, data.attendee_secret)
+    if not secret_data.valid:
+        raise HTTPException(status_code=400, detail="Invalid attendee secret or code")
+
+    student_name = secret_data.name
+
+    # Validate Schedule (Schedule Service)
+    # We need to know 'current time', in the zone the schedules are written in
+    now = datetime.now(SCHEDULE_TZ)
+    day = now.isoweekday() # 1=Mon, 7=Sun
+    time_int = int(now.strftime("%H%M"))
     
-    # Admin Token (to reuse for inter-service calls)
-    # Since the machine token might not be accepted by other services if they check for "admin",
-    # We should ideally have an Admin token. 
-    # BUT, for simplicity in this system design, we assume services accept the JWT signed by the same secret.
-    # However, Attendee/Class/Schedule services specifically check for 'role': 'admin'.
-    # The 'attendance machine' token has role 'attendee'.
-    # To fix this: We need to sign a temporary ADMIN token here to talk to other services,
-    # Solution: We generate a short-lived admin token for internal calls.
-    internal_token = create_access_token({"sub": institution_id, "role": "admin"})
-    headers = {"Authorization": f"Bearer {internal_token}"}
+    # Note: In real world, we might want to check a buffer (e.g., +/- 15 mins).
+    # For this simplified assignment, we assume the validate-availability endpoint checks existence.
+    # The Schedule Service 'validate-availability' checks for CONFLICTS (creation).
+    # It does NOT check "Is there a class NOW?".
+    # We need to query GET /schedules and filter locally, OR assume Schedule Service logic.
+    # validate-availability returns 'valid: false' if there IS a schedule (conflict).
+    # We want a schedule to exist.
+    
+    # fetch all schedules and filter.
+    schedules = await schedule_cache.get(institution_id, lambda: fetch_schedules(institution_id))
+    
+    # Find matching schedule
+    # Logic: Same Room, Same Day, Current Time is within Start-End
+    active_schedule = None
+    for s in schedules:
+        if (s["room_id"] == data.room_id and 
+            s["day"] == day and 
+            s["start_time"] <= time_int <= s["end_time"]):
+            active_schedule = s
+            break
+    
+    if not active_schedule:
+        raise HTTPException(status_code=400, detail="No class scheduled in this room right now")
 
-    async with httpx.AsyncClient() as client:
-        
-        # Validate Secret (Attendee Service)
-        try:
-            resp = await client.post(
-                f"{ATTENDEE_SERVICE_URL}/attendees/validate-secret",
-                json={"code": data.attendee_code, "secret": data.attendee_secret},
-                headers=headers
-            )
-            if resp.status_code != 200 or not resp.json().get("valid"):
-                raise HTTPException(status_code=400, detail="Invalid attendee secret or code")
-            
-            student_name = resp.json().get("name")
-        except Exception as e:
-            print(f"Attendee Service Error: {e}")
-            raise HTTPException(status_code=503, detail="Attendee validation failed")
-
-        # Validate Schedule (Schedule Service)
-        # We need to know 'current time'.
-        now = datetime.now()
-        day = now.isoweekday() # 1=Mon, 7=Sun
-        time_int = int(now.strftime("%H%M"))
-        
-        # Note: In real world, we might want to check a buffer (e.g., +/- 15 mins).
-        # For this simplified assignment, we assume the validate-availability endpoint checks existence.
-        # The Schedule Service 'validate-availability' checks for CONFLICTS (creation).
-        # It does NOT check "Is there a class NOW?".
-        # We need to query GET /schedules and filter locally, OR assume Schedule Service logic.
-        # validate-availability returns 'valid: false' if there IS a schedule (conflict).
-        # We want a schedule to exist.
-        
-        # fetch all schedules and filter.
-        try:
-            resp = await client.get(f"{SCHEDULE_SERVICE_URL}/schedules", headers=headers)
-            schedules = resp.json().get("schedules", [])
-            
-            # Find matching schedule
-            # Logic: Same Room, Same Day, Current Time is within Start-End
-            active_schedule = None
-            for s in schedules:
-                if (s["room_id"] == data.room_id and 
-                    s["day"] == day and 
-                    s["start_time"] <= time_int <= s["end_time"]):
-                    active_schedule = s
-                    break
-            
-            if not active_schedule:
-                raise HTTPException(status_code=400, detail="No class scheduled in this room right now")
-                
-        except Exception as e:
-            print(f"Schedule Service Error: {e}")
-            raise HTTPException(status_code=503, detail="Schedule validation failed")
+    # Validate Enrollment (Class Service)
+    # Answered locally from the class roster when the student is on it
+    class_id = active_schedule["class_id"]
+    try:
+        roster = await roster_cache.get(
+            f"{institution_id}:{class_id}",
+            lambda: fetch_roster(institution_id, class_id)
+        )
+    except UPSTREAM_FAILURES as e:
+        print(f"Class Service Error: {e}")
+        roster = None
 
-        # Validate Enrollment (Class Service)
-        try:
-            resp = await client.post(
-                f"{CLASS_SERVICE_URL}/classes/validate-attendee",
-                json={"class_id": active_schedule["class_id"], "attendee_code": data.attendee_code},
-                headers=headers
-            )
-            val_data = resp.json()
-            if not val_data.get("valid"):
-                raise HTTPException(status_code=400, detail="Student is not enrolled in this class")
-            
-            class_attendee_id = val_data.get("class_attendee_id")
-            
-        except Exception as e:
-             print(f"Class Service Error: {e}")
-             raise HTTPException(status_code=503, detail="Enrollment validation failed")
+    class_attendee_id = (roster or {}).get(data.attendee_code)
+    if class_attendee_id is None:
+        class_attendee_id = await validate_enrollment(institution_id, class_id, data.attendee_code)
 
     # Persist Attendance
     attendance = Attendance(
@@ -175,8 +469,332 @@ async def submit_presence(
     db.add(attendance)
     await db.commit()
 
+    # Live feed for admins watching the room (GET /attendance/stream)
+    broker.publish(institution_id, {
+        "id": attendance.id,
+        "schedule_id": active_schedule["id"],
+        "room_id": active_schedule["room_id"],
+        "room_name": active_schedule["room_name"],
+        "class_id": active_schedule["class_id"],
+        "class_name": active_schedule["class_name"],
+        "attendee_code": data.attendee_code,
+        "student_name": student_name,
+        "present_time": attendance.present_time.isoformat()
+    })
+
     return SubmitPresenceResponse(
         message="successful",
         student_name=student_name,
         class_name=active_schedule["class_name"]
     )
+
+
+# 3. ATTENDANCE HISTORY (Admin Only)
+# Recent months come from the hot table, older ones from the Parquet archive
+@app.get("/attendance/history", response_model=AttendanceHistoryResponse)
+async def get_history(
+    start: datetime = Query(...),
+    end: datetime = Query(...),
+    payload: dict = Depends(get_current_institution),
+    db: AsyncSession = Depends(get_read_db)
+):
+    if payload.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    # present_time is naive UTC; "...+07:00" bounds are converted, not compared as is
+    start, end = naive_utc(start), naive_utc(end)
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end must be after start")
+
+    institution_id = payload["sub"]
+
+    archived = await asyncio.to_thread(read_archive, institution_id, start, end)
+    records = [AttendanceRecord(**row) for row in archived.select(ARCHIVE_COLUMNS).to_pylist()]
+
+    result = await db.execute(
+        select(Attendance).where(
+            Attendance.institution_id == institution_id,
+            Attendance.present_time >= start,
+            Attendance.present_time < end
+        ).order_by(Attendance.present_time)
+    )
+    records.extend(
+        AttendanceRecord(
+            id=a.id,
+            institution_id=a.institution_id,
+            class_attendee_id=a.class_attendee_id,
+            schedule_id=a.schedule_id,
+            class_name=a.class_name,
+            room_name=a.room_name,
+            present_time=a.present_time
+        )
+        for a in result.scalars().all()
+    )
+
+    return AttendanceHistoryResponse(attendances=records)
+
+
+# 4. BULK EXPORT (Admin Only)
+# Streams archived and hot rows chunk by chunk; memory stays bounded by EXPORT_CHUNK_SIZE
+EXPORT_MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+@app.get("/attendance/export")
+async def export_attendance(
+    request: Request,
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    start: Optional[datetime] = Query(None),
+    end: Optional[datetime] = Query(None),
+    payload: dict = Depends(get_current_institution)
+):
+    if payload.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+
+    compress = "gzip" in request.headers.get("accept-encoding", "")
+    headers = {"Content-Disposition": f'attachment; filename="attendance.{format}"'}
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+        headers["Vary"] = "Accept-Encoding"
+
+    return StreamingResponse(
+        stream_export(payload["sub"], format, compress, naive_utc(start), naive_utc(end)),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers=headers
+    )
+
+
+# 5. ATTENDANCE REPORT (Admin Only)
+# Vectorized per-student rates, lateness distribution and chronic-absence flags
+@app.get("/attendance/report", response_model=AttendanceReportResponse)
+async def get_report(
+    start: Optional[date] = Query(None),
+    end: Optional[date] = Query(None),
+    chronic_threshold: float = Query(CHRONIC_ABSENCE_THRESHOLD, ge=0, le=1),
+    payload: dict = Depends(get_current_institution)
+):
+    if payload.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+
+    # Sessions that have not happened yet are not expected
+    today = datetime.now(SCHEDULE_TZ).date()
+    end = min(end or today, today)
+    start = start or end - timedelta(days=364)
+    if end < start:
+        raise HTTPException(status_code=400, detail="end must not be before start")
+
+    institution_id = payload["sub"]
+
+    try:
+        resp = await coalesced_call(
+            "report.schedules", institution_id,
+            "schedule-service", "GET",
+            f"{SCHEDULE_SERVICE_URL}/schedules",
+            idempotent=True,
+            headers=internal_headers(institution_id),
+            timeout=30.0
+        )
+        resp.raise_for_status()
+        schedules = decode(resp, ScheduleList).schedules
+    except UPSTREAM_FAILURES as e:
+        print(f"Schedule Service Error: {e}")
+        raise HTTPException(status_code=503, detail="Schedule service unavailable")
+
+    # Expected enrollments come from the rosters, so students who never
+    # tapped are reported too
+    gate = asyncio.Semaphore(REPORT_ROSTER_CONCURRENCY)
+
+    async def roster_of(class_id: str):
+        async with gate:
+            return class_id, await fetch_roster_entries(institution_id, class_id, "report.roster")
+
+    try:
+        found = await asyncio.gather(*(roster_of(class_id) for class_id in {s["class_id"] for s in schedules}))
+    except UPSTREAM_FAILURES as e:
+        print(f"Class Service Error: {e}")
+        raise HTTPException(status_code=503, detail="Class service unavailable")
+    rosters = {class_id: attendees for class_id, attendees in found if attendees is not None}
+
+    return await build_report(institution_id, schedules, rosters, start, end, chronic_threshold)
+
+
+# 6. LIVE PRESENCE STREAM (Admin Only)
+# Server-sent events of presences accepted by this process, optionally filtered
+# to one room or schedule. frontend-service holds one of these per institution.
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+
+async def presence_events(institution_id: str, room_id: Optional[str], schedule_id: Optional[str]):
+    async with broker.subscribe(institution_id) as queue:
+        yield ": connected\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), SSE_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                # Keeps proxies from closing an idle stream
+                yield ": ping\n\n"
+                continue
+            if room_id and event["room_id"] != room_id:
+                continue
+            if schedule_id and event["schedule_id"] != schedule_id:
+                continue
+            yield f"event: presence\ndata: {json.dumps(event)}\n\n"
+
+@app.get("/attendance/stream")
+async def stream_presences(
+    room_id: Optional[str] = Query(None),
+    schedule_id: Optional[str] = Query(None),
+    payload: dict = Depends(get_current_institution)
+):
+    if payload.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+
+    return StreamingResponse(
+        presence_events(payload["sub"], room_id, schedule_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# 7. MACHINE WEBSOCKET
+# One authenticated connection per attendance machine, with taps multiplexed on it:
+#   -> {"id": "<correlation id>", "room_id": ..., "attendee_code": ..., "attendee_secret": ...}
+#   <- {"id": "<correlation id>", "status": 200, "data": {...}}
+#   <- {"id": "<correlation id>", "status": 400, "detail": "..."}
+# Replies come back in completion order; clients match them on "id".
+WS_MAX_INFLIGHT = int(os.getenv("WS_MAX_INFLIGHT", "32"))
+WS_AUTH_TIMEOUT = float(os.getenv("WS_AUTH_TIMEOUT", "10"))
+
+def encode_frame(message: dict) -> str:
+    return json.dumps(message, separators=(",", ":"))
+
+def decode_machine_token(token: str) -> Optional[dict]:
+    try:
+        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+    except JWTError:
+        return None
+    if payload.get("role") != "attendee" and payload.get("role") != "admin":
+        return None
+    return payload
+
+async def authenticate_socket(websocket: WebSocket) -> Optional[dict]:
+    """
+    Machines that can set headers authenticate in the handshake; the rest
+    send {"type": "auth", "token": "..."} as their first frame.
+    """
+    authorization = websocket.headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        return decode_machine_token(authorization[7:])
+
+    try:
+        message = json.loads(await asyncio.wait_for(websocket.receive_text(), WS_AUTH_TIMEOUT))
+    except (asyncio.TimeoutError, ValueError):
+        return None
+    if not isinstance(message, dict) or message.get("type") != "auth":
+        return None
+
+    payload = decode_machine_token(str(message.get("token", "")))
+    if payload is not None:
+        await websocket.send_text(encode_frame({"type": "auth", "status": 200}))
+    return payload
+
+@app.websocket("/attendance/ws")
+async def machine_channel(websocket: WebSocket):
+    await websocket.accept()
+
+    payload = await authenticate_socket(websocket)
+    if payload is None:
+        await websocket.close(code=1008, reason="Invalid token")
+        return
+    institution_id = payload["sub"]
+
+    send_lock = asyncio.Lock()
+    inflight = asyncio.Semaphore(WS_MAX_INFLIGHT)
+    tasks = set()
+
+    async def send(message: dict):
+        async with send_lock:
+            await websocket.send_text(encode_frame(message))
+
+    async def handle_tap(message: dict):
+        correlation_id = message.get("id")
+        try:
+            data = SubmitPresenceRequest(**message)
+            async with router.session(institution_id) as db:
+                result = await record_presence(data, institution_id, db)
+            reply = {"id": correlation_id, "status": 200, "data": jsonable_encoder(result)}
+        except ValidationError:
+            reply = {"id": correlation_id, "status": 422, "detail": "Invalid tap message"}
+        except HTTPException as e:
+            reply = {"id": correlation_id, "status": e.status_code, "detail": e.detail}
+        except Exception as e:
+            print(f"Machine channel error: {e}")
+            reply = {"id": correlation_id, "status": 500, "detail": "Internal error"}
+        finally:
+            inflight.release()
+
+        try:
+            await send(reply)
+        except Exception:
+            # The machine went away; it will resubmit unacknowledged taps
+            pass
+
+    try:
+        while True:
+            raw = await websocket.receive_text()
+            try:
+                message = json.loads(raw)
+            except ValueError:
+                message = None
+            if not isinstance(message, dict):
+                await send({"id": None, "status": 400, "detail": "Malformed message"})
+                continue
+
+            # Backpressure: stop reading once WS_MAX_INFLIGHT taps are pending
+            await inflight.acquire()
+            task = asyncio.create_task(handle_tap(message))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+# 8. UPSTREAM HEALTH
+# Circuit breaker state and call statistics per downstream service
+@app.get("/internal/upstreams", dependencies=[Depends(require_service)])
+async def get_upstreams():
+    return resilience.snapshot()
+
+# 9. REQUEST COALESCING
+# Per call site: calls made, upstream requests actually sent, and the ratio saved
+@app.get("/internal/coalescing", dependencies=[Depends(require_service)])
+async def get_coalescing():
+    return flights.snapshot()
+
+# 10. CACHES
+@app.get("/internal/caches", dependencies=[Depends(require_service)])
+async def get_caches():
+    return {"schedules": schedule_cache.snapshot(), "rosters": roster_cache.snapshot()}
+
+# 11. DB POOL
+# Checkout wait and saturation of this process's connection pools, per shard
+@app.get("/internal/pool", dependencies=[Depends(require_service)])
+async def get_pool():
+    return router.stats()
+
+# 12. SHARDS
+# Shard names for consumers of the change feed, and where placements live
+@app.get("/internal/shards", dependencies=[Depends(require_service)])
+async def get_shards():
+    return {"shards": list(router.shards), "directory": router.directory.name}
+
+# 13. METRICS
+# Prometheus text format, per process; the /internal/* reports as time series
+register_collector(pool_metrics(router.stats))
+register_collector(admission_metrics)
+register_collector(upstream_metrics(resilience.snapshot))
+register_collector(coalescing_metrics(flights.snapshot))
+register_collector(cache_metrics(lambda: {"schedules": schedule_cache.snapshot(), "rosters": roster_cache.snapshot()}))
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return metrics_response()
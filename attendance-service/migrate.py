@@ -0,0 +1,33 @@
+"""
+Schema migrations of attendance-service.
+
+    python migrate.py            apply pending migrations to every shard
+    python migrate.py --status   print the schema version of every shard
+
+Run before rolling out a build that adds a migration; pods only check the
+version at startup (see migrator.py).
+"""
+from db import Base, router
+from migrator import Migration, create_tables, create_index, check_version, run_cli
+from shards import DirectoryBase
+from partitions import partition_existing_table
+
+MIGRATIONS = [
+    # The placement table is only read on the directory shard, but every
+    # shard gets one so any of them can become the directory
+    Migration(1, "baseline tables", [create_tables(Base.metadata, DirectoryBase.metadata)]),
+    Migration(2, "tenant-leading indexes", [
+        create_index("ix_attendances_institution_id_present_time", "attendances", ["institution_id", "present_time"]),
+    ], transactional=False),
+    # Databases created before partitioning still have a plain attendances table
+    Migration(3, "partition attendances", [partition_existing_table()]),
+]
+
+def targets() -> dict:
+    return {name: shard.engine for name, shard in router.shards.items()}
+
+async def check_schema():
+    await check_version(MIGRATIONS, targets())
+
+if __name__ == "__main__":
+    run_cli(MIGRATIONS, targets())
@@ -0,0 +1,367 @@
+import asyncio
+import os
+import re
+from datetime import date, datetime, timezone
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from sqlalchemy import text
+
+from db import Attendance, router
+from metrics import Counter, Gauge
+
+# CONFIG
+# ARCHIVE_DIR must be a volume every replica mounts read-write
+# (ReadWriteMany, see deployment/attendance-service/archive-pvc.yaml)
+ARCHIVE_DIR = os.getenv("ATTENDANCE_ARCHIVE_DIR", "/var/lib/attendance/archive")
+ARCHIVE_AFTER_MONTHS = int(os.getenv("ATTENDANCE_ARCHIVE_AFTER_MONTHS", "6"))
+PARTITIONS_AHEAD = int(os.getenv("ATTENDANCE_PARTITIONS_AHEAD", "2"))
+MAINTENANCE_INTERVAL = int(os.getenv("ATTENDANCE_PARTITION_INTERVAL", "3600"))
+ARCHIVE_BATCH_SIZE = 50_000
+
+# Arbitrary constants: only one replica runs maintenance at a time, and only
+# one creates partitions at a time (startup runs it outside maintenance)
+MAINTENANCE_LOCK_ID = 726_001
+PARTITION_LOCK_ID = 726_002
+
+# Catches rows no monthly partition covers, so taps are never rejected
+# while partition maintenance is behind
+DEFAULT_PARTITION = "attendances_default"
+
+ARCHIVE_COLUMNS = [
+    "id", "institution_id", "class_attendee_id", "schedule_id",
+    "class_name", "room_name", "present_time"
+]
+ARCHIVE_SCHEMA = pa.schema([
+    ("id", pa.string()),
+    ("institution_id", pa.string()),
+    ("class_attendee_id", pa.string()),
+    ("schedule_id", pa.string()),
+    ("class_name", pa.string()),
+    ("room_name", pa.string()),
+    ("present_time", pa.timestamp("us")),
+])
+
+# Non-zero means taps are landing in months maintenance has not created yet
+DEFAULT_PARTITION_ROWS = Gauge(
+    "attendance_default_partition_rows", "Rows in the default partition, outside every monthly one",
+    ["shard"]
+)
+PARTITION_ROWS_MOVED = Counter(
+    "attendance_partition_rows_moved_total", "Rows moved out of the default partition into a new monthly one",
+    ["shard"]
+)
+
+# The unpartitioned table while migration 3 copies it into the partitioned one
+LEGACY_TABLE = "attendances_unpartitioned"
+TENANT_INDEX = "ix_attendances_institution_id_present_time"
+
+PARTITION_NAME = re.compile(r"^attendances_(\d{4})_(\d{2})$")
+
+# ---------- MONTH HELPERS ----------
+def month_start(value: date) -> date:
+    return date(value.year, value.month, 1)
+
+def add_months(value: date, months: int) -> date:
+    index = value.year * 12 + (value.month - 1) + months
+    return date(index // 12, index % 12 + 1, 1)
+
+def partition_name(month: date) -> str:
+    return f"attendances_{month.year:04d}_{month.month:02d}"
+
+def parse_partition_name(name: str):
+    match = PARTITION_NAME.match(name)
+    if not match:
+        return None
+    return date(int(match.group(1)), int(match.group(2)), 1)
+
+def naive_utc(value):
+    """present_time is stored as naive UTC; aware datetimes are converted to match."""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+def archive_path(month: date, shard: str = None) -> str:
+    # Every shard archives its own partitions; the directory shard keeps the
+    # unsuffixed names so single-database archives stay where they were
+    suffix = f".{shard}" if shard else ""
+    return os.path.join(ARCHIVE_DIR, f"{partition_name(month)}{suffix}.parquet")
+
+def shard_suffix(shard) -> str:
+    return None if shard is router.directory else shard.name
+
+def archive_cutoff(today: date = None) -> date:
+    """Partitions whose month starts before this date are moved to the archive."""
+    return add_months(month_start(today or datetime.utcnow().date()), -ARCHIVE_AFTER_MONTHS)
+
+# ---------- HOT PARTITIONS ----------
+async def is_partitioned(conn) -> bool:
+    result = await conn.execute(text(
+        "SELECT relkind::text FROM pg_class WHERE oid = to_regclass('attendances')"
+    ))
+    return result.scalar() == "p"
+
+async def list_partitions(conn) -> list[str]:
+    result = await conn.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE parent.relname = 'attendances'"
+    ))
+    return [row[0] for row in result]
+
+async def create_partition(conn, month: date, shard: str = ""):
+    name = partition_name(month)
+    bounds = f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+    window = {"start": month, "end": add_months(month, 1)}
+
+    # Postgres refuses a new partition while the default one holds rows in
+    # its range, so rows that landed there are moved into it first
+    stray = await conn.scalar(text(
+        f"SELECT count(*) FROM {DEFAULT_PARTITION} "
+        f"WHERE present_time >= :start AND present_time < :end"
+    ), window)
+    if not stray:
+        await conn.execute(text(f"CREATE TABLE {name} PARTITION OF attendances {bounds}"))
+        return
+
+    print(f"Moving {stray} rows from {DEFAULT_PARTITION} into new partition {name}")
+    PARTITION_ROWS_MOVED.labels(shard).inc(stray)
+    await conn.execute(text(f"CREATE TABLE {name} (LIKE attendances INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    await conn.execute(text(
+        f"INSERT INTO {name} SELECT * FROM {DEFAULT_PARTITION} "
+        f"WHERE present_time >= :start AND present_time < :end"
+    ), window)
+    await conn.execute(text(
+        f"DELETE FROM {DEFAULT_PARTITION} WHERE present_time >= :start AND present_time < :end"
+    ), window)
+    await conn.execute(text(f"ALTER TABLE attendances ATTACH PARTITION {name} {bounds}"))
+
+async def ensure_partitions(conn, shard: str = "", today: date = None):
+    """
+    Create the partitions for last month, this month and PARTITIONS_AHEAD
+    months ahead, and the default partition. Rows written while a month had
+    no partition land in the default one and are moved out once it is
+    created; until then they are left out of archiving, so this still has
+    to run before the month rolls over. How many are left is exported as
+    attendance_default_partition_rows.
+    """
+    await conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": PARTITION_LOCK_ID})
+    await conn.execute(text(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF attendances DEFAULT"))
+    existing = set(await list_partitions(conn))
+
+    current = month_start(today or datetime.utcnow().date())
+    for offset in range(-1, PARTITIONS_AHEAD + 1):
+        month = add_months(current, offset)
+        if month < archive_cutoff(today) or partition_name(month) in existing:
+            continue
+        await create_partition(conn, month, shard)
+
+    stray = await conn.scalar(text(f"SELECT count(*) FROM {DEFAULT_PARTITION}"))
+    DEFAULT_PARTITION_ROWS.labels(shard).set(stray)
+    if stray:
+        print(f"WARNING: {stray} attendances rows are in {DEFAULT_PARTITION}, outside every monthly partition")
+
+def partition_existing_table():
+    """
+    Migration step turning an attendances table created before partitioning
+    into the partitioned one: the old table is renamed, the partitioned
+    parent created with a partition for every month it has rows in, the
+    rows copied over and the old table dropped. Writes wait on its lock
+    while rows are copied. A no-op on databases created partitioned.
+    """
+    async def step(conn):
+        if await conn.scalar(text("SELECT to_regclass('attendances')")) is None or await is_partitioned(conn):
+            return
+
+        await conn.execute(text("LOCK TABLE attendances IN ACCESS EXCLUSIVE MODE"))
+        await conn.execute(text(f"ALTER TABLE attendances RENAME TO {LEGACY_TABLE}"))
+        # Index names are per schema; free the ones the new table is created with
+        await conn.execute(text(f"ALTER INDEX IF EXISTS attendances_pkey RENAME TO {LEGACY_TABLE}_pkey"))
+        await conn.execute(text(f"DROP INDEX IF EXISTS {TENANT_INDEX}"))
+
+        await conn.run_sync(Attendance.__table__.create)
+        await conn.execute(text(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF attendances DEFAULT"))
+        months = await conn.scalars(text(
+            f"SELECT DISTINCT date_trunc('month', present_time)::date FROM {LEGACY_TABLE} "
+            f"WHERE present_time IS NOT NULL"
+        ))
+        for month in months.all():
+            await create_partition(conn, month)
+
+        columns = ", ".join(ARCHIVE_COLUMNS)
+        copied = await conn.execute(text(
+            f"INSERT INTO attendances ({columns}) SELECT {columns} FROM {LEGACY_TABLE}"
+        ))
+        print(f"Copied {copied.rowcount} rows into the partitioned attendances table")
+        await conn.execute(text(f"DROP TABLE {LEGACY_TABLE}"))
+        # Migration 2 built it on the old table; on the parent it covers every partition
+        await conn.execute(text(f"CREATE INDEX {TENANT_INDEX} ON attendances (institution_id, present_time)"))
+    return step
+
+# ---------- COLD ARCHIVE ----------
+async def archive_partition(engine, month: date, shard: str = None):
+    """
+    Copy one monthly partition into a zstd-compressed Parquet file, then
+    detach and drop it. Rows are written sorted by institution_id so row
+    group statistics let tenant-scoped reads skip most of the file.
+    """
+    name = partition_name(month)
+    path = archive_path(month, shard)
+    tmp_path = f"{path}.tmp"
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+
+    writer = pq.ParquetWriter(tmp_path, ARCHIVE_SCHEMA, compression="zstd")
+    try:
+        async with engine.connect() as conn:
+            result = await conn.stream(text(
+                f"SELECT {', '.join(ARCHIVE_COLUMNS)} FROM {name} "
+                f"ORDER BY institution_id, present_time"
+            ))
+            async for rows in result.partitions(ARCHIVE_BATCH_SIZE):
+                columns = list(zip(*rows))
+                batch = pa.Table.from_arrays(
+                    [pa.array(col, type=field.type) for col, field in zip(columns, ARCHIVE_SCHEMA)],
+                    schema=ARCHIVE_SCHEMA
+                )
+                await asyncio.to_thread(writer.write_table, batch)
+    finally:
+        writer.close()
+
+    # The file is complete before the partition disappears
+    os.replace(tmp_path, path)
+
+    async with engine.begin() as conn:
+        await conn.execute(text(f"ALTER TABLE attendances DETACH PARTITION {name}"))
+        await conn.execute(text(f"DROP TABLE {name}"))
+
+async def archive_old_partitions(shard, today: date = None):
+    cutoff = archive_cutoff(today)
+    async with shard.engine.connect() as conn:
+        names = await list_partitions(conn)
+
+    for name in sorted(names):
+        month = parse_partition_name(name)
+        if month is not None and month < cutoff:
+            print(f"Archiving partition {name} ({shard.name})")
+            await archive_partition(shard.engine, month, shard_suffix(shard))
+
+async def run_maintenance(shard):
+    async with shard.engine.connect() as conn:
+        locked = await conn.scalar(
+            text("SELECT pg_try_advisory_lock(:id)"), {"id": MAINTENANCE_LOCK_ID}
+        )
+        if not locked:
+            return
+        try:
+            await ensure_partitions(conn, shard.name)
+            await conn.commit()
+            await archive_old_partitions(shard)
+        finally:
+            await conn.rollback()
+            await conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MAINTENANCE_LOCK_ID})
+            await conn.commit()
+
+async def maintenance_loop():
+    while True:
+        for shard in router.shards.values():
+            try:
+                await run_maintenance(shard)
+            except Exception as e:
+                print(f"Partition maintenance error ({shard.name}): {e}")
+        await asyncio.sleep(MAINTENANCE_INTERVAL)
+
+# ---------- HISTORICAL READS ----------
+def archived_files(start: date = None, end: date = None) -> list[str]:
+    """
+    Archive files of the months overlapping [start, end), from every shard:
+    an institution moved between shards has rows archived on both.
+    """
+    if not os.path.isdir(ARCHIVE_DIR):
+        return []
+
+    files = []
+    for filename in os.listdir(ARCHIVE_DIR):
+        if not filename.endswith(".parquet"):
+            continue
+        month = parse_partition_name(filename[:-len(".parquet")].split(".")[0])
+        if month is None:
+            continue
+        if start and add_months(month, 1) <= start:
+            continue
+        if end and month > end:
+            continue
+        files.append((month, filename))
+    return [os.path.join(ARCHIVE_DIR, filename) for month, filename in sorted(files)]
+
+def archive_filters(institution_id: str, start: datetime = None, end: datetime = None):
+    filters = [("institution_id", "=", institution_id)]
+    if start:
+        filters.append(("present_time", ">=", start))
+    if end:
+        filters.append(("present_time", "<", end))
+    return filters
+
+def read_archive(
+    institution_id: str,
+    start: datetime = None,
+    end: datetime = None,
+    columns: list[str] = None
+) -> pa.Table:
+    """
+    Scan the archived months overlapping [start, end) for one institution.
+    Files are memory-mapped and filtered by the Arrow scanner, so only the
+    matching row groups are decoded. Blocking: call via asyncio.to_thread.
+    """
+    tables = [
+        pq.read_table(
+            path,
+            columns=columns,
+            filters=archive_filters(institution_id, start, end),
+            memory_map=True
+        )
+        for path in archived_files(
+            start.date() if start else None,
+            end.date() if end else None
+        )
+    ]
+    if not tables:
+        return ARCHIVE_SCHEMA.empty_table().select(columns or ARCHIVE_COLUMNS)
+    return pa.concat_tables(tables)
+
+def iter_archive_batches(
+    institution_id: str,
+    start: datetime = None,
+    end: datetime = None,
+    columns: list[str] = None,
+    batch_size: int = ARCHIVE_BATCH_SIZE
+):
+    """
+    Same scan as read_archive, but yields RecordBatches one at a time so
+    callers streaming millions of rows never hold a whole month in memory.
+    """
+    paths = archived_files(
+        start.date() if start else None,
+        end.date() if end else None
+    )
+    if not paths:
+        return
+
+    expression = None
+    for column, op, value in archive_filters(institution_id, start, end):
+        field = ds.field(column)
+        if op == "=":
+            condition = field == value
+        elif op == ">=":
+            condition = field >= value
+        else:
+            condition = field < value
+        expression = condition if expression is None else expression & condition
+
+    dataset = ds.dataset(paths, schema=ARCHIVE_SCHEMA, format="parquet")
+    yield from dataset.to_batches(
+        columns=columns or ARCHIVE_COLUMNS,
+        filter=expression,
+        batch_size=batch_size
+    )
@@ -0,0 +1,38 @@
+import asyncio
+import os
+from collections import defaultdict
+from contextlib import asynccontextmanager
+
+# CONFIG
+SUBSCRIBER_QUEUE_SIZE = int(os.getenv("PUBSUB_QUEUE_SIZE", "1000"))
+
+class Broker:
+    """
+    In-process pub/sub keyed by topic. Each subscriber gets a bounded queue;
+    a subscriber that falls behind loses events rather than slowing down
+    publishers. Only presences accepted by this process are published.
+    """
+
+    def __init__(self, queue_size: int = SUBSCRIBER_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.subscribers = defaultdict(set)
+
+    def publish(self, topic: str, event: dict):
+        for queue in list(self.subscribers.get(topic, ())):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                pass
+
+    @asynccontextmanager
+    async def subscribe(self, topic: str):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers[topic].add(queue)
+        try:
+            yield queue
+        finally:
+            self.subscribers[topic].discard(queue)
+            if not self.subscribers[topic]:
+                del self.subscribers[topic]
+
+broker = Broker()
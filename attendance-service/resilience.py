@@ -0,0 +1,238 @@
+from collections import deque
+import asyncio
+import httpx
+import os
+import random
+import time
+
+from http_client import get_client
+from metrics import Counter, Histogram
+import tracing
+
+# CONFIG
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "10"))
+RETRY_ATTEMPTS = int(os.getenv("RETRY_ATTEMPTS", "2"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.05"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "1.0"))
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", "3.0"))
+# Hedging sends a second copy of an idempotent call once it runs past the upstream's p95
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "0") == "1"
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.05"))
+HEDGE_MIN_SAMPLES = 50
+LATENCY_WINDOW = 200
+
+# Labelled by upstream name, a literal at every call site
+UPSTREAM_LATENCY = Histogram(
+    "upstream_request_duration_seconds", "Latency of each request sent to an upstream",
+    ["upstream"]
+)
+# error: transport, status_5xx, circuit_open or other (anything else raised mid-call)
+UPSTREAM_ERRORS = Counter(
+    "upstream_errors_total", "Failed upstream calls, by upstream and kind of failure",
+    ["upstream", "error"]
+)
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose breaker is open."""
+
+    def __init__(self, upstream: str):
+        super().__init__(f"Circuit open for {upstream}")
+        self.upstream = upstream
+
+class CircuitBreaker:
+    """
+    Opens after BREAKER_FAILURE_THRESHOLD consecutive failures and fails
+    calls fast for BREAKER_RESET_TIMEOUT seconds. Then a single probe is let
+    through (half-open): success closes the breaker, failure re-opens it.
+    """
+
+    def __init__(self):
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < BREAKER_RESET_TIMEOUT:
+                return False
+            self.state = "half_open"
+            self.probing = False
+        # half_open: exactly one probe in flight
+        if self.probing:
+            return False
+        self.probing = True
+        return True
+
+    def record_success(self):
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.probing = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self.probing = False
+        if self.state == "half_open" or self.consecutive_failures >= BREAKER_FAILURE_THRESHOLD:
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def release(self):
+        """Give back a half-open probe that ended with no verdict on the upstream."""
+        self.probing = False
+
+class Upstream:
+    def __init__(self, name: str):
+        self.name = name
+        self.breaker = CircuitBreaker()
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.counters = {
+            "calls": 0, "successes": 0, "failures": 0,
+            "rejected": 0, "retries": 0, "hedges": 0, "hedge_wins": 0
+        }
+
+    def percentile(self, q: float):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def hedge_delay(self):
+        if len(self.latencies) < HEDGE_MIN_SAMPLES:
+            return None
+        return max(self.percentile(0.95), HEDGE_MIN_DELAY)
+
+_upstreams = {}
+
+def get_upstream(name: str) -> Upstream:
+    if name not in _upstreams:
+        _upstreams[name] = Upstream(name)
+    return _upstreams[name]
+
+def backoff_delay(attempt: int) -> float:
+    # Full jitter keeps retrying callers from synchronizing
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)))
+
+async def send_timed(upstream: Upstream, method: str, url: str, **kwargs) -> httpx.Response:
+    # One client span per request sent, so retries and hedges each show up
+    attributes = {"upstream": upstream.name, "http.method": method, "http.url": url}
+    with tracing.span(f"{method} {upstream.name}", "client", attributes) as span:
+        kwargs["headers"] = tracing.inject(kwargs.get("headers"))
+        started = time.monotonic()
+        resp = await get_client().request(method, url, **kwargs)
+        elapsed = time.monotonic() - started
+        span.set("http.status_code", resp.status_code)
+    UPSTREAM_LATENCY.labels(upstream.name).observe(elapsed)
+    if resp.status_code < 500:
+        upstream.latencies.append(elapsed)
+    return resp
+
+async def send_hedged(upstream: Upstream, method: str, url: str, **kwargs) -> httpx.Response:
+    delay = upstream.hedge_delay()
+    primary = asyncio.ensure_future(send_timed(upstream, method, url, **kwargs))
+    if delay is None:
+        return await primary
+
+    done, _ = await asyncio.wait({primary}, timeout=delay)
+    if done:
+        return primary.result()
+
+    upstream.counters["hedges"] += 1
+    hedge = asyncio.ensure_future(send_timed(upstream, method, url, **kwargs))
+    pending = {primary, hedge}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None and task.result().status_code < 500:
+                    if task is hedge:
+                        upstream.counters["hedge_wins"] += 1
+                    return task.result()
+        # Both failed: surface the primary's outcome
+        return primary.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def call(
+    upstream_name: str,
+    method: str,
+    url: str,
+    idempotent: bool = False,
+    hedge: bool = False,
+    **kwargs
+) -> httpx.Response:
+    """
+    Send one inter-service request through the upstream's circuit breaker.
+
+    Only idempotent calls (lookups, validate-*) are retried, with jittered
+    backoff, on transport errors and 5xx. hedge additionally races a second
+    copy past the upstream's p95 when HEDGE_ENABLED is set. 4xx responses are
+    returned as-is: they are the caller's answer, not an upstream failure.
+    Raises CircuitOpenError, or httpx.HTTPError once retries are exhausted.
+    """
+    upstream = get_upstream(upstream_name)
+    kwargs.setdefault("timeout", UPSTREAM_TIMEOUT)
+    attempts = RETRY_ATTEMPTS + 1 if idempotent else 1
+
+    for attempt in range(attempts):
+        if not upstream.breaker.allow():
+            upstream.counters["rejected"] += 1
+            UPSTREAM_ERRORS.labels(upstream_name, "circuit_open").inc()
+            raise CircuitOpenError(upstream_name)
+
+        upstream.counters["calls"] += 1
+        if attempt:
+            upstream.counters["retries"] += 1
+
+        last_attempt = attempt == attempts - 1
+        try:
+            if hedge and idempotent and HEDGE_ENABLED:
+                resp = await send_hedged(upstream, method, url, **kwargs)
+            else:
+                resp = await send_timed(upstream, method, url, **kwargs)
+        except httpx.TransportError:
+            upstream.counters["failures"] += 1
+            UPSTREAM_ERRORS.labels(upstream_name, "transport").inc()
+            upstream.breaker.record_failure()
+            if last_attempt:
+                raise
+        except asyncio.CancelledError:
+            # The caller went away (client disconnect, losing hedge); the
+            # upstream is neither healthy nor failing, but the probe is over
+            upstream.breaker.release()
+            raise
+        except BaseException:
+            # Anything else (a body that won't decode, an error raised through
+            # an in-process transport) still has to settle a half-open probe
+            upstream.counters["failures"] += 1
+            UPSTREAM_ERRORS.labels(upstream_name, "other").inc()
+            upstream.breaker.record_failure()
+            raise
+        else:
+            if resp.status_code < 500:
+                upstream.counters["successes"] += 1
+                upstream.breaker.record_success()
+                return resp
+            upstream.counters["failures"] += 1
+            UPSTREAM_ERRORS.labels(upstream_name, "status_5xx").inc()
+            upstream.breaker.record_failure()
+            if last_attempt:
+                return resp
+
+        await asyncio.sleep(backoff_delay(attempt))
+
+def snapshot() -> dict:
+    """Breaker state, counters and latency percentiles for every upstream seen so far."""
+    return {
+        name: {
+            "state": upstream.breaker.state,
+            "consecutive_failures": upstream.breaker.consecutive_failures,
+            "p50_seconds": upstream.percentile(0.5),
+            "p95_seconds": upstream.percentile(0.95),
+            **upstream.counters
+        }
+        for name, upstream in _upstreams.items()
+    }
@@ -1,5 +1,7 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import Dict, List, NotRequired, Optional, TypedDict
+import msgspec
+from datetime import date, datetime
 
 # ---------- CREDENTIAL ----------
 class CredentialResponse(BaseModel):
@@ -16,3 +18,81 @@ class SubmitPresenceResponse(BaseModel):
     message: str
     student_name: Optional[str] = None
     class_name: Optional[str] = None
+
+# ---------- HISTORY ----------
+class AttendanceRecord(BaseModel):
+    id: str
+    institution_id: str
+    class_attendee_id: str
+    schedule_id: str
+    class_name: Optional[str] = None
+    room_name: Optional[str] = None
+    present_time: datetime
+
+class AttendanceHistoryResponse(BaseModel):
+    attendances: List[AttendanceRecord]
+
+# ---------- REPORT ----------
+class StudentAttendanceStats(BaseModel):
+    class_attendee_id: str
+    class_id: Optional[str] = None
+    attended: int
+    expected: int
+    attendance_rate: float
+    mean_lateness_minutes: float
+    late_sessions: int
+    chronic_absence: bool
+
+class LatenessDistribution(BaseModel):
+    buckets: Dict[str, int]
+    percentiles: Dict[str, float]
+
+class AttendanceReportResponse(BaseModel):
+    start: date
+    end: date
+    sessions: int
+    students: List[StudentAttendanceStats]
+    chronic_absence_count: int
+    lateness: LatenessDistribution
+
+# ---------- UPSTREAM ANSWERS ----------
+# Decoded with wire.decode(); only the fields this service reads. Schedules
+# stay dicts (TypedDict) because the caches hold them, and cache values must
+# be JSON-able.
+class ScheduleSlot(TypedDict):
+    id: str
+    room_id: str
+    room_name: Optional[str]
+    class_id: str
+    class_name: Optional[str]
+    day: int
+    start_time: int
+    end_time: int
+    # ISO UTC text; absent from older schedule-service builds
+    created_at: NotRequired[Optional[str]]
+
+class UpcomingSlot(ScheduleSlot):
+    institution_id: str
+
+class ScheduleList(msgspec.Struct):
+    schedules: List[ScheduleSlot]
+
+class UpcomingList(msgspec.Struct):
+    schedules: List[UpcomingSlot]
+
+class RosterEntry(msgspec.Struct):
+    attendee_code: str
+    class_attendee_id: str
+    # ISO UTC text
+    enrolled_at: Optional[str] = None
+
+class Roster(msgspec.Struct):
+    attendees: List[RosterEntry]
+
+class EnrollmentValidation(msgspec.Struct):
+    valid: bool
+    class_attendee_id: Optional[str] = None
+
+class SecretValidation(msgspec.Struct):
+    valid: bool
+    name: Optional[str] = None
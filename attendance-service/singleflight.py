@@ -0,0 +1,68 @@
+import asyncio
+import json
+from collections import defaultdict
+
+import resilience
+
+class SingleFlight:
+    """
+    Collapses concurrent identical calls into one. The first caller for a key
+    starts the call; everyone arriving while it is in flight awaits the same
+    result (or exception). Nothing is kept once the call finishes, so this is
+    not a cache: it only removes duplicates that overlap in time.
+    """
+
+    def __init__(self):
+        self.inflight = {}
+        self.stats = defaultdict(lambda: {"calls": 0, "executions": 0})
+
+    async def do(self, site: str, key, fn):
+        stats = self.stats[site]
+        stats["calls"] += 1
+
+        future = self.inflight.get(key)
+        if future is None:
+            stats["executions"] += 1
+            future = asyncio.ensure_future(fn())
+            self.inflight[key] = future
+            future.add_done_callback(lambda f: self.finish(key, f))
+
+        # One caller being cancelled must not cancel the call the others share
+        return await asyncio.shield(future)
+
+    def finish(self, key, future):
+        if self.inflight.get(key) is future:
+            del self.inflight[key]
+        # Mark the exception retrieved even if every waiter was cancelled
+        if not future.cancelled():
+            future.exception()
+
+    def snapshot(self) -> dict:
+        return {
+            site: {
+                **stats,
+                "coalesced": stats["calls"] - stats["executions"],
+                "ratio": 1 - stats["executions"] / stats["calls"] if stats["calls"] else 0.0
+            }
+            for site, stats in self.stats.items()
+        }
+
+flights = SingleFlight()
+
+def request_key(tenant: str, method: str, url: str, params=None, json_body=None):
+    return (
+        tenant,
+        method.upper(),
+        url,
+        json.dumps(params, sort_keys=True) if params else None,
+        json.dumps(json_body, sort_keys=True) if json_body is not None else None
+    )
+
+async def coalesced_call(site: str, tenant: str, upstream: str, method: str, url: str, **kwargs):
+    """
+    resilience.call() with concurrent duplicates collapsed. The key covers
+    method, URL, query, JSON body and tenant, so tenants never share answers.
+    Per-site coalescing ratios are reported by flights.snapshot().
+    """
+    key = request_key(tenant, method, url, kwargs.get("params"), kwargs.get("json"))
+    return await flights.do(site, key, lambda: resilience.call(upstream, method, url, **kwargs))
@@ -0,0 +1,11 @@
+import os
+import sys
+
+import pytest
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVICE_DIR)
+
+@pytest.fixture(scope="session")
+def anyio_backend():
+    return "asyncio"
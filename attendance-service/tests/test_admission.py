@@ -0,0 +1,118 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI, HTTPException
+from jose import jwt
+
+import admission
+import http_client
+import resilience
+from admission import AdmissionControl
+
+pytestmark = pytest.mark.anyio
+
+SECRET = "test-secret"
+
+def bearer(institution_id: str) -> dict:
+    token = jwt.encode({"sub": institution_id, "role": "admin"}, SECRET, algorithm="HS256")
+    return {"Authorization": f"Bearer {token}"}
+
+@pytest.fixture
+def gate():
+    return asyncio.Event()
+
+@pytest.fixture
+async def client(monkeypatch, gate):
+    """4 slots: default work may hold 3, bulk 1, taps all of them."""
+    monkeypatch.setattr(admission, "ADMISSION_MAX_CONCURRENCY", 4)
+    monkeypatch.setattr(admission, "ADMISSION_CRITICAL_WAIT", 0.05)
+
+    app = FastAPI()
+
+    @app.get("/attendance/history")
+    async def history():
+        await gate.wait()
+        return {}
+
+    @app.post("/attendance/presence")
+    async def presence():
+        return {"status": "present"}
+
+    @app.get("/attendance/export")
+    async def export():
+        return {}
+
+    shielded = AdmissionControl(app, secret=SECRET, bulk=["GET /attendance/export"])
+    transport = httpx.ASGITransport(app=shielded)
+    async with httpx.AsyncClient(transport=transport, base_url="http://attendance-service") as client:
+        yield client
+
+async def fill(client, n: int) -> list:
+    # Each from its own institution, so only process capacity is in play
+    held = [
+        asyncio.ensure_future(client.get("/attendance/history", headers=bearer(f"inst-{i}")))
+        for i in range(n)
+    ]
+    while admission.controller.inflight < n:
+        await asyncio.sleep(0.001)
+    return held
+
+async def test_default_and_bulk_are_shed_before_taps(client, gate):
+    held = await fill(client, 3)
+
+    resp = await client.get("/attendance/history", headers=bearer("inst-x"))
+    assert resp.status_code == 503
+    assert resp.headers["retry-after"] == admission.ADMISSION_RETRY_AFTER
+    resp = await client.get("/attendance/export", headers=bearer("inst-x"))
+    assert resp.status_code == 503
+
+    resp = await client.post("/attendance/presence", headers=bearer("inst-x"))
+    assert resp.status_code == 200
+
+    gate.set()
+    assert [r.status_code for r in await asyncio.gather(*held)] == [200, 200, 200]
+    assert admission.controller.inflight == 0
+
+async def test_taps_wait_briefly_then_are_shed_at_full_capacity(client, gate, monkeypatch):
+    monkeypatch.setitem(admission.controller.capacity, admission.DEFAULT, 4)
+    held = await fill(client, 4)
+
+    resp = await client.post("/attendance/presence", headers=bearer("inst-x"))
+    assert resp.status_code == 503
+    assert "retry-after" in resp.headers
+
+    gate.set()
+    await asyncio.gather(*held)
+
+@pytest.fixture
+def attendee_service(monkeypatch):
+    """main.validate_secret with attendee-service giving every attempt the answer the test sets."""
+    import main
+
+    answers = []
+    monkeypatch.setattr(resilience, "_upstreams", {})
+    monkeypatch.setattr(http_client, "_mounts", {})
+    monkeypatch.setattr(http_client, "_client", None)
+    http_client.mount_transport(main.ATTENDEE_SERVICE_URL, httpx.MockTransport(lambda request: answers[0]))
+    yield main, answers
+    http_client._client = None
+
+@pytest.mark.parametrize("status", [429, 503])
+async def test_upstream_retry_after_is_passed_on(attendee_service, status):
+    main, answers = attendee_service
+    answers.append(httpx.Response(status, headers={"Retry-After": "7"}, json={"detail": "busy"}))
+
+    with pytest.raises(HTTPException) as raised:
+        await main.validate_secret("inst-a", "A1", "s3cret")
+    assert raised.value.status_code == 503
+    assert raised.value.headers == {"Retry-After": "7"}
+
+async def test_rejected_secret_is_not_retryable(attendee_service):
+    main, answers = attendee_service
+    answers.append(httpx.Response(400, json={"detail": "Invalid secret"}))
+
+    with pytest.raises(HTTPException) as raised:
+        await main.validate_secret("inst-a", "A1", "wrong")
+    assert raised.value.status_code == 400
+    assert raised.value.headers is None
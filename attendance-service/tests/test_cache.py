@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+import cache
+from cache import SWRCache, MemoryBackend, RedisBackend
+
+pytestmark = pytest.mark.anyio
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "time", clock)
+    return clock
+
+class Loader:
+    """Returns the next value on each call, or raises once failing is set."""
+
+    def __init__(self, *values):
+        self.values = list(values)
+        self.calls = 0
+        self.failing = False
+
+    async def __call__(self):
+        self.calls += 1
+        if self.failing:
+            raise ConnectionError("upstream down")
+        return self.values.pop(0)
+
+def new_cache(backend=None) -> SWRCache:
+    return SWRCache("test", ttl=10, stale_ttl=20, error_ttl=60, backend=backend or MemoryBackend())
+
+async def test_fresh_entry_is_served_without_loading(clock):
+    swr, loader = new_cache(), Loader("v1", "v2")
+    assert await swr.get("k", loader) == "v1"
+    clock.now += 9
+    assert await swr.get("k", loader) == "v1"
+    assert loader.calls == 1
+    assert swr.stats["hits"] == 1
+
+async def test_stale_entry_is_served_while_one_refresh_runs(clock):
+    swr, loader = new_cache(), Loader("v1", "v2")
+    await swr.get("k", loader)
+    clock.now += 15
+
+    assert await swr.get("k", loader) == "v1"
+    assert await swr.get("k", loader) == "v1"
+    assert len(swr.tasks) == 1
+    await asyncio.gather(*swr.tasks)
+
+    assert loader.calls == 2
+    assert swr.stats["refreshes"] == 1
+    assert not swr.tasks and not swr.refreshing
+    assert await swr.get("k", loader) == "v2"
+    assert swr.stats["hits"] == 1
+
+async def test_expired_entry_is_loaded_inline(clock):
+    swr, loader = new_cache(), Loader("v1", "v2")
+    await swr.get("k", loader)
+    clock.now += 31
+
+    assert await swr.get("k", loader) == "v2"
+    assert not swr.tasks
+    assert swr.stats["misses"] == 2
+
+async def test_failed_load_serves_stale_up_to_error_ttl(clock):
+    swr, loader = new_cache(), Loader("v1")
+    await swr.get("k", loader)
+    loader.failing = True
+
+    clock.now += 40
+    assert await swr.get("k", loader) == "v1"
+    assert swr.stats["stale_if_error"] == 1
+
+    clock.now += 31
+    with pytest.raises(ConnectionError):
+        await swr.get("k", loader)
+
+async def test_none_is_never_cached(clock):
+    swr, loader = new_cache(), Loader(None, "v1")
+    assert await swr.get("k", loader) is None
+    assert await swr.get("k", loader) == "v1"
+
+async def test_redis_backend_with_a_local_stand_in(clock):
+    fakeredis = pytest.importorskip("fakeredis")
+    client = fakeredis.FakeAsyncRedis()
+    backend = RedisBackend(client)
+    swr, loader = new_cache(backend), Loader({"A1": "ca-1"}, {"A1": "ca-2"})
+
+    assert await swr.get("class-1", loader) == {"A1": "ca-1"}
+    # One JSON entry, kept in Redis for ttl plus the longer grace period
+    assert await client.ttl("cache:test:class-1") == 70
+    assert await swr.get("class-1", loader) == {"A1": "ca-1"}
+    assert loader.calls == 1
+
+    clock.now += 15
+    assert await swr.get("class-1", loader) == {"A1": "ca-1"}
+    await asyncio.gather(*swr.tasks)
+    assert await swr.get("class-1", loader) == {"A1": "ca-2"}
+
+    await swr.invalidate("class-1")
+    assert await client.get("cache:test:class-1") is None
@@ -0,0 +1,117 @@
+import asyncio
+
+import httpx
+import pytest
+
+import http_client
+import resilience
+from resilience import CircuitOpenError
+
+pytestmark = pytest.mark.anyio
+
+URL = "http://back.internal/validate"
+
+class Upstream:
+    """Mounted transport answering with whatever the test queues up next."""
+
+    def __init__(self):
+        self.outcomes = []
+        self.calls = 0
+
+    async def __call__(self, request):
+        self.calls += 1
+        outcome = self.outcomes.pop(0) if self.outcomes else 200
+        if isinstance(outcome, BaseException):
+            raise outcome
+        if outcome == "hang":
+            await asyncio.sleep(60)
+        return httpx.Response(outcome)
+
+@pytest.fixture
+def upstream(monkeypatch):
+    upstream = Upstream()
+    monkeypatch.setattr(resilience, "_upstreams", {})
+    monkeypatch.setattr(resilience, "BREAKER_FAILURE_THRESHOLD", 2)
+    monkeypatch.setattr(resilience, "BREAKER_RESET_TIMEOUT", 60)
+    monkeypatch.setattr(http_client, "_mounts", {})
+    monkeypatch.setattr(http_client, "_client", None)
+    http_client.mount_transport("http://back.internal", httpx.MockTransport(upstream))
+    yield upstream
+    http_client._client = None
+
+def breaker():
+    return resilience.get_upstream("back").breaker
+
+def half_open():
+    """Jump the open breaker past its reset timeout."""
+    breaker().opened_at -= resilience.BREAKER_RESET_TIMEOUT
+
+async def call():
+    return await resilience.call("back", "GET", URL)
+
+async def trip(upstream):
+    upstream.outcomes += [503, 503]
+    for _ in range(2):
+        await call()
+    assert breaker().state == "open"
+
+async def test_opens_after_consecutive_failures_and_fails_fast(upstream):
+    await trip(upstream)
+
+    with pytest.raises(CircuitOpenError):
+        await call()
+    assert upstream.calls == 2
+
+async def test_half_open_probe_closes_on_success(upstream):
+    await trip(upstream)
+    half_open()
+
+    resp = await call()
+    assert resp.status_code == 200
+    assert breaker().state == "closed"
+    assert not breaker().probing
+
+async def test_half_open_probe_reopens_on_failure(upstream):
+    await trip(upstream)
+    half_open()
+
+    upstream.outcomes.append(httpx.ConnectError("refused"))
+    with pytest.raises(httpx.ConnectError):
+        await call()
+    assert breaker().state == "open"
+    with pytest.raises(CircuitOpenError):
+        await call()
+
+async def test_probe_raising_anything_else_reopens(upstream):
+    await trip(upstream)
+    half_open()
+
+    upstream.outcomes.append(httpx.DecodingError("garbled"))
+    with pytest.raises(httpx.DecodingError):
+        await call()
+    assert breaker().state == "open"
+    assert not breaker().probing
+
+    # Next probe goes through instead of being shut out for good
+    half_open()
+    resp = await call()
+    assert resp.status_code == 200
+    assert breaker().state == "closed"
+
+async def test_cancelled_probe_is_given_back(upstream):
+    await trip(upstream)
+    half_open()
+
+    upstream.outcomes.append("hang")
+    probe = asyncio.ensure_future(call())
+    await asyncio.sleep(0.01)
+    assert breaker().probing
+    probe.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await probe
+
+    assert breaker().state == "half_open"
+    assert not breaker().probing
+    resp = await call()
+    assert resp.status_code == 200
+    assert breaker().state == "closed"
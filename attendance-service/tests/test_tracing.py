@@ -0,0 +1,71 @@
+import httpx
+import pytest
+from fastapi import FastAPI, Request
+
+import http_client
+import resilience
+import tracing
+from tracing import Tracing, MemoryExporter
+
+pytestmark = pytest.mark.anyio
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+CALLER_SPAN = "00f067aa0ba902b7"
+
+@pytest.fixture
+def exporter(monkeypatch):
+    exporter = MemoryExporter()
+    monkeypatch.setattr(tracing, "exporter", exporter)
+    return exporter
+
+@pytest.fixture
+def front(monkeypatch):
+    """An app calling a second one through resilience.call(), both behind Tracing."""
+    back = FastAPI()
+    back.add_middleware(Tracing, service="back")
+
+    @back.get("/validate")
+    async def validate(request: Request):
+        return {"traceparent": request.headers.get("traceparent")}
+
+    front = FastAPI()
+    front.add_middleware(Tracing, service="front")
+
+    @front.get("/tap")
+    async def tap():
+        resp = await resilience.call("back", "GET", "http://back.internal/validate", idempotent=True)
+        return resp.json()
+
+    monkeypatch.setattr(http_client, "_mounts", {})
+    monkeypatch.setattr(http_client, "_client", None)
+    http_client.mount_transport("http://back.internal", httpx.ASGITransport(app=back))
+    yield front
+    http_client._client = None
+
+async def call(app, traceparent: str) -> httpx.Response:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://front") as client:
+        return await client.get("/tap", headers={"traceparent": traceparent})
+
+async def test_trace_continues_across_the_hop(front, exporter):
+    resp = await call(front, f"00-{TRACE_ID}-{CALLER_SPAN}-01")
+    assert resp.status_code == 200
+
+    spans = exporter.trace(TRACE_ID)
+    assert [(s["kind"], s["name"]) for s in spans] == [
+        ("server", "GET /tap"),
+        ("client", "GET back"),
+        ("server", "GET /validate")
+    ]
+    front_server, client, back_server = spans
+    assert front_server["parent_id"] == CALLER_SPAN
+    assert client["parent_id"] == front_server["span_id"]
+    assert back_server["parent_id"] == client["span_id"]
+    # What the second app received is the client span's context
+    assert resp.json()["traceparent"] == f"00-{TRACE_ID}-{client['span_id']}-01"
+
+async def test_unsampled_trace_is_passed_on_unrecorded(front, exporter):
+    resp = await call(front, f"00-{TRACE_ID}-{CALLER_SPAN}-00")
+
+    assert resp.json()["traceparent"] == f"00-{TRACE_ID}-{CALLER_SPAN}-00"
+    assert exporter.trace(TRACE_ID) == []
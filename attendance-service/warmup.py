@@ -0,0 +1,90 @@
+from datetime import datetime, timedelta
+import asyncio
+import os
+
+from http_client import get_client
+from wire import accept_headers, decode
+from schemas import UpcomingList
+from analytics import SCHEDULE_TZ
+
+# CONFIG
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "1") == "1"
+# How far ahead of start_time a slot is warmed, and how often to look ahead
+WARMUP_LEAD_MINUTES = int(os.getenv("WARMUP_LEAD_MINUTES", "10"))
+WARMUP_INTERVAL = float(os.getenv("WARMUP_INTERVAL", "60"))
+# Keep-alive connections opened per downstream service before a burst
+WARMUP_CONNECTIONS = int(os.getenv("WARMUP_CONNECTIONS", "10"))
+
+def upcoming_windows(now: datetime, lead_minutes: int) -> list[tuple[int, int, int]]:
+    """(day, start_from, start_to) ranges covering now .. now + lead, split at midnight."""
+    end = now + timedelta(minutes=lead_minutes)
+    if end.date() == now.date():
+        return [(now.isoweekday(), int(now.strftime("%H%M")), int(end.strftime("%H%M")))]
+    return [
+        (now.isoweekday(), int(now.strftime("%H%M")), 2359),
+        (end.isoweekday(), 0, int(end.strftime("%H%M")))
+    ]
+
+async def fetch_upcoming(schedule_service_url: str, token: str, now: datetime) -> list[dict]:
+    schedules = []
+    for day, start_from, start_to in upcoming_windows(now, WARMUP_LEAD_MINUTES):
+        resp = await get_client().get(
+            f"{schedule_service_url}/schedules/upcoming",
+            params={"day": day, "start_from": start_from, "start_to": start_to},
+            headers={"Authorization": f"Bearer {token}", **accept_headers()}
+        )
+        resp.raise_for_status()
+        schedules.extend(decode(resp, UpcomingList).schedules)
+    return schedules
+
+async def warm_connections(reads: list[tuple[str, str, dict]], count: int = WARMUP_CONNECTIONS):
+    """
+    Open up to count pooled keep-alive connections per service by sending
+    that many concurrent copies of each (method, url, request kwargs) read.
+    They are reads the taps make, so the upstream's handler, statements and
+    DB pool are warm too, not only the sockets.
+    """
+    client = get_client()
+    requests = [client.request(method, url, **kwargs) for method, url, kwargs in reads for _ in range(count)]
+    results = await asyncio.gather(*requests, return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            print(f"Warm-up connection error: {result}")
+            break
+
+async def warmup_loop(schedule_service_url: str, token: str, warm_reads, warm_institution):
+    """
+    Every WARMUP_INTERVAL, find slots starting within WARMUP_LEAD_MINUTES
+    across all institutions and call warm_institution(institution_id,
+    schedules) once per institution with slots not warmed yet today.
+    Connections are opened first with the reads warm_reads(institution_id,
+    schedules) returns for one of those institutions.
+    """
+    warmed = set()
+    while True:
+        try:
+            now = datetime.now(SCHEDULE_TZ)
+            schedules = await fetch_upcoming(schedule_service_url, token, now)
+
+            # Each slot is warmed once per day
+            today = now.date().isoformat()
+            warmed = {key for key in warmed if key[0] == today}
+            pending = {}
+            for schedule in schedules:
+                key = (today, schedule["id"])
+                if key not in warmed:
+                    warmed.add(key)
+                    pending.setdefault(schedule["institution_id"], []).append(schedule)
+
+            if pending:
+                await warm_connections(warm_reads(*next(iter(pending.items()))))
+                for institution_id, slots in pending.items():
+                    try:
+                        await warm_institution(institution_id, slots)
+                    except Exception as e:
+                        print(f"Warm-up error ({institution_id}): {e}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Warm-up error: {e}")
+        await asyncio.sleep(WARMUP_INTERVAL)
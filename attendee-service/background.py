@@ -0,0 +1,24 @@
+import asyncio
+
+# Loops started at startup. The event loop only keeps weak references to
+# tasks, so they are held here until they end or shutdown cancels them
+_tasks = set()
+
+def spawn(coro) -> asyncio.Task:
+    """Run coro as a background task; a crash is printed instead of lost."""
+    task = asyncio.create_task(coro, name=coro.__qualname__)
+    _tasks.add(task)
+    task.add_done_callback(finished)
+    return task
+
+def finished(task: asyncio.Task):
+    _tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Background task {task.get_name()} crashed: {task.exception()!r}")
+
+async def cancel_all():
+    """Cancel every running background task and wait for them to unwind."""
+    tasks = list(_tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,54 @@
+"""
+Benchmark of GET /attendees serialization: the model-per-row path against the
+fast path in fastjson.py, on generated rows.
+
+    python bench_serialization.py --rows 20000
+
+The old path builds a GetAttendeeResponse per row, then validates and encodes
+the list through a TypeAdapter the way FastAPI does for response_model.
+Both paths must produce the same bytes.
+"""
+import argparse
+import time
+
+from pydantic import TypeAdapter
+
+from fastjson import dumps, rows_to_dicts
+from schemas import GetAttendeeResponse, ATTENDEE_FIELDS
+
+def generate(rows: int):
+    return [(f"NPM{2100000000 + i}", f"Mahasiswa \"{i}\" Çağrı") for i in range(rows)]
+
+def model_path(adapter: TypeAdapter, rows) -> bytes:
+    content = [GetAttendeeResponse(code=code, name=name) for code, name in rows]
+    return adapter.dump_json(adapter.validate_python(content))
+
+def fast_path(rows) -> bytes:
+    return dumps(rows_to_dicts(ATTENDEE_FIELDS, rows))
+
+def best_of(repeat: int, fn, *args):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings), out
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rows = generate(args.rows)
+    adapter = TypeAdapter(list[GetAttendeeResponse])
+    old, old_body = best_of(args.repeat, model_path, adapter, rows)
+    new, new_body = best_of(args.repeat, fast_path, rows)
+    assert old_body == new_body, "fast path changed the response bytes"
+
+    print(f"GET /attendees, {args.rows} rows, {len(new_body)} bytes")
+    print(f"  model per row  {old * 1000:8.1f} ms")
+    print(f"  fast path      {new * 1000:8.1f} ms  ({old / new:.1f}x)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Benchmark of POST /attendees/validate-existence and /attendees/validate-secret:
+the ORM paths they replaced against the prebuilt Core statements in db.py,
+as p50/p99 per call.
+
+    python bench_validate.py --attendees 5000 --batch 20 --calls 2000
+    python bench_validate.py --database-url postgresql+asyncpg://...
+
+Each call produces the response bytes, as the handler does. Defaults to a
+throwaway SQLite file (needs aiosqlite); against Postgres it creates and
+fills the attendees table, so point it at a scratch database.
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from pydantic import TypeAdapter
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from db import Base, Attendee, VALIDATE_ATTENDEES, ATTENDEE_SECRET
+from fastjson import dumps, rows_to_dicts
+from schemas import ValidateResponse, GetAttendeeResponse, ATTENDEE_FIELDS
+
+INSTITUTION = "bench-institution"
+
+def hash_secret(secret: str) -> str:
+    # Same as main.hash_secret, without importing the app
+    return hashlib.sha256(secret.encode()).hexdigest()
+
+# ---------- VALIDATE EXISTENCE ----------
+async def existence_orm(db, adapter: TypeAdapter, codes: list) -> bytes:
+    result = await db.execute(
+        select(Attendee).where(
+            Attendee.institution_id == INSTITUTION,
+            Attendee.code.in_(codes)
+        )
+    )
+    found = result.scalars().all()
+    content = ValidateResponse(
+        valid=True,
+        attendees=[GetAttendeeResponse(code=a.code, name=a.name) for a in found]
+    )
+    return adapter.dump_json(adapter.validate_python(content))
+
+async def existence_core(db, codes: list) -> bytes:
+    result = await db.execute(VALIDATE_ATTENDEES, {"institution_id": INSTITUTION, "codes": codes})
+    return dumps({
+        "valid": True,
+        "attendees": rows_to_dicts(ATTENDEE_FIELDS, result.all()),
+        "code": None,
+        "name": None
+    })
+
+# ---------- VALIDATE SECRET ----------
+async def secret_orm(db, adapter: TypeAdapter, code: str) -> bytes:
+    result = await db.execute(
+        select(Attendee).where(
+            Attendee.institution_id == INSTITUTION,
+            Attendee.code == code
+        )
+    )
+    attendee = result.scalar_one_or_none()
+    assert hash_secret(f"secret-{code}") == attendee.secret_hash
+    content = ValidateResponse(valid=True, code=attendee.code, name=attendee.name)
+    return adapter.dump_json(adapter.validate_python(content))
+
+async def secret_core(db, code: str) -> bytes:
+    result = await db.execute(ATTENDEE_SECRET, {"institution_id": INSTITUTION, "code": code})
+    attendee = result.first()
+    assert hash_secret(f"secret-{code}") == attendee.secret_hash
+    return dumps({"valid": True, "attendees": None, "code": attendee.code, "name": attendee.name})
+
+def percentiles(timings: list) -> str:
+    cuts = statistics.quantiles(timings, n=100)
+    return f"p50 {cuts[49] * 1000:7.3f} ms  p99 {cuts[98] * 1000:7.3f} ms"
+
+async def compare(db, label: str, calls: list, orm, core):
+    # Warm both paths so one-off compilation is not counted
+    assert await orm(calls[0]) == await core(calls[0]), f"{label}: paths answer differently"
+    timings = {"orm": [], "core": []}
+    for arg in calls:
+        for name, path in (("orm", orm), ("core", core)):
+            start = time.perf_counter()
+            await path(arg)
+            timings[name].append(time.perf_counter() - start)
+        db.expunge_all()
+
+    print(f"{label}, {len(calls)} calls")
+    print(f"  orm entities   {percentiles(timings['orm'])}")
+    print(f"  core columns   {percentiles(timings['core'])}")
+
+async def run(args):
+    engine = create_async_engine(args.database_url)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all, tables=[Attendee.__table__])
+        await conn.execute(Attendee.__table__.delete().where(Attendee.institution_id == INSTITUTION))
+        await conn.execute(Attendee.__table__.insert(), [
+            {
+                "institution_id": INSTITUTION,
+                "code": f"NPM{i}",
+                "name": f"Mahasiswa {i}",
+                "secret_hash": hash_secret(f"secret-NPM{i}")
+            }
+            for i in range(args.attendees)
+        ])
+
+    Session = async_sessionmaker(engine, expire_on_commit=False)
+    adapter = TypeAdapter(ValidateResponse)
+    rng = random.Random(args.seed)
+    batches = [
+        list(dict.fromkeys(f"NPM{rng.randrange(args.attendees)}" for _ in range(args.batch)))
+        for _ in range(args.calls)
+    ]
+    codes = [f"NPM{rng.randrange(args.attendees)}" for _ in range(args.calls)]
+
+    async with Session() as db:
+        await compare(
+            db, f"POST /attendees/validate-existence ({args.batch} codes)", batches,
+            lambda batch: existence_orm(db, adapter, batch), lambda batch: existence_core(db, batch)
+        )
+        await compare(
+            db, "POST /attendees/validate-secret", codes,
+            lambda code: secret_orm(db, adapter, code), lambda code: secret_core(db, code)
+        )
+    await engine.dispose()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--attendees", type=int, default=5000)
+    parser.add_argument("--batch", type=int, default=20)
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.database_url is None:
+        path = os.path.join(tempfile.mkdtemp(), "bench.db")
+        args.database_url = f"sqlite+aiosqlite:///{path}"
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
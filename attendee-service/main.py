@@ -1,21 +1,43 @@
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Query, Header, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
-from jose import jwt, JWTError
+from typing import Optional
 import secrets
 import string
 import hashlib
 import os
 
-from db import SessionLocal, Attendee, init_db
+from db import router, Attendee, VALIDATE_ATTENDEES, ATTENDEE_SECRET
+from migrate import check_schema
+from background import spawn, cancel_all
+from replica import ReadYourWrites
+from admission import AdmissionControl
+from tokens import verified_claims
+from compress import Compression
+from tracing import Tracing
+from querycount import QueryCounter
+from metrics import Instrumentation, register_collector, metrics_response, pool_metrics, admission_metrics
+from outbox import (
+    record_changes,
+    notify_changes,
+    wait_for_changes,
+    serialize_change,
+    prune_changes_loop,
+    LONG_POLL_MAX
+)
+from versions import resource_etag, etag_matches, not_modified, cache_headers
+from fastjson import json_response, rows_to_dicts, fast_response
+from wire import WireRoute
 from schemas import (
     CreateAttendeesRequest,
     AttendeeCreateResponse,
     GetAttendeeResponse,
+    ATTENDEE_FIELDS,
     ValidateExistenceRequest,
     ValidateSecretRequest,
-    ValidateResponse
+    ValidateResponse,
+    ChangesResponse
 )
 
 JWT_SECRET = os.getenv("JWT_SECRET", "EfEmEitch123")
@@ -23,34 +45,79 @@ JWT_ALGORITHM = "HS256"
 
 security = HTTPBearer()
 app = FastAPI()
+# Internal callers may speak MessagePack instead of JSON (wire.py)
+app.router.route_class = WireRoute
+app.add_middleware(
+    AdmissionControl,
+    secret=JWT_SECRET,
+    bulk=["POST /attendees", "GET /attendees"]
+)
+app.add_middleware(ReadYourWrites, secret=JWT_SECRET)
+# Counts each request's queries and warns when they grow with its input
+app.add_middleware(QueryCounter, service="attendee-service")
+# Counts and times every request, including any wait for admission
+app.add_middleware(Instrumentation)
+# Joins the caller's trace or samples a new one; spans cover calls and queries
+app.add_middleware(Tracing, service="attendee-service")
+# Outermost, so handlers see plain bodies and large responses leave compressed
+app.add_middleware(Compression)
 
 # ---------- DB ----------
+# Both follow the shard of the request's institution (shards.py)
 async def get_db():
-    async with SessionLocal() as session:
+    async with router.session() as session:
+        yield session
+
+async def get_read_db():
+    async with router.session(readonly=True) as session:
+        yield session
+
+async def get_feed_db(shard: Optional[str] = Query(None)):
+    # Every shard numbers its own changes; service consumers follow each one
+    # (see /internal/shards), admins read the shard holding their institution
+    async with router.session(shard=shard) as session:
         yield session
 
 @app.on_event("startup")
 async def startup():
-    await init_db()
+    # Schema changes are applied by migrate.py, not by pods
+    await check_schema()
+    spawn(prune_changes_loop())
+
+@app.on_event("shutdown")
+async def shutdown():
+    await cancel_all()
 
 # ---------- JWT ----------
 def get_institution_id(
+    request: Request,
     credentials: HTTPAuthorizationCredentials = Depends(security)
 ) -> str:
-    try:
-        payload = jwt.decode(
-            credentials.credentials,
-            JWT_SECRET,
-            algorithms=[JWT_ALGORITHM]
-        )
-        
-        # Validasi role admin
-        if payload.get("role") != "admin":
-            raise HTTPException(status_code=403, detail="Admin access required")
-        
-        return payload["sub"]
-    except JWTError:
+    # Decoded once per request and shared with the middlewares (tokens.py)
+    payload = verified_claims(request.scope, JWT_SECRET, JWT_ALGORITHM)
+    if payload is None:
         raise HTTPException(status_code=401, detail="Invalid token")
+    if payload.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return payload["sub"]
+
+def get_change_scope(
+    request: Request,
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+) -> Optional[str]:
+    """
+    Admins, and service tokens acting for an institution, read that
+    institution's changes. Only sync workers (role "sync") read every one.
+    """
+    payload = verified_claims(request.scope, JWT_SECRET, JWT_ALGORITHM)
+    if payload is None:
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+    if payload.get("role") == "sync":
+        return None
+    if payload.get("role") not in ("admin", "service"):
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return payload["sub"]
 
 # ---------- SECRET ----------
 def generate_secret(length: int = 8) -> str:
@@ -63,6 +130,17 @@ def hash_secret(secret: str) -> str:
 def verify_secret(secret: str, secret_hash: str) -> bool:
     return hash_secret(secret) == secret_hash
 
+def require_service(
+    request: Request,
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """/internal/* reports expose topology and tenant placement: service and sync tokens only."""
+    payload = verified_claims(request.scope, JWT_SECRET, JWT_ALGORITHM)
+    if payload is None:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    if payload.get("role") not in ("service", "sync"):
+        raise HTTPException(status_code=403, detail="Service token required")
+
 # ---------- API ----------
 
 # CREATE ATTENDEES (BULK)
@@ -100,81 +178,128 @@ async def create_attendees(
             AttendeeCreateResponse(code=item.code, secret=secret)
         )
 
+    # Secrets never go into the change feed
+    await record_changes(
+        db, institution_id, "attendee", "create",
+        [{"code": item.code, "name": item.name} for item in data.attendees],
+        id_key="code"
+    )
     await db.commit()
+    notify_changes()
     return responses
 
 # GET ALL ATTENDEES
+# Conditional: If-None-Match gets a 304 from the version counter alone
 @app.get("/attendees", response_model=list[GetAttendeeResponse])
 async def get_attendees(
     institution_id: str = Depends(get_institution_id),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db),
+    if_none_match: Optional[str] = Header(None)
 ):
+    etag = await resource_etag(db, institution_id, "attendee")
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+
+    # Fast path: column tuples straight to JSON, no model per row (fastjson.py)
     result = await db.execute(
-        select(Attendee).where(
+        select(Attendee.code, Attendee.name).where(
             Attendee.institution_id == institution_id
         )
     )
-    attendees = result.scalars().all()
+    return json_response(rows_to_dicts(ATTENDEE_FIELDS, result.all()), headers=cache_headers(etag))
 
-    return [
-        GetAttendeeResponse(code=a.code, name=a.name)
-        for a in attendees
-    ]
+# ValidateResponse(valid=False) as the validate endpoints send it
+INVALID = {"valid": False, "attendees": None, "code": None, "name": None}
 
 # VALIDATE EXISTENCE (BATCH) -> RETURN LIST CODE + NAME
+# Internal: answers MessagePack to callers that accept it
 @app.post("/attendees/validate-existence", response_model=ValidateResponse)
 async def validate_existence(
     data: ValidateExistenceRequest,
     institution_id: str = Depends(get_institution_id),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db),
+    accept: Optional[str] = Header(None)
 ):
     codes = [item.code for item in data.attendees]
 
+    # Every ValidateResponse field, in order, as the model would emit them
     if not codes:
-        return ValidateResponse(valid=True, attendees=[])
+        return fast_response({"valid": True, "attendees": [], "code": None, "name": None}, accept)
 
-    result = await db.execute(
-        select(Attendee).where(
-            Attendee.institution_id == institution_id,
-            Attendee.code.in_(codes)
-        )
-    )
-    found = result.scalars().all()
+    # Lean path: prebuilt Core select, rows straight to response bytes
+    result = await db.execute(VALIDATE_ATTENDEES, {"institution_id": institution_id, "codes": codes})
+    found = result.all()
 
     if len(found) != len(set(codes)):
-        return ValidateResponse(valid=False)
-
-    return ValidateResponse(
-        valid=True,
-        attendees=[
-            {"code": a.code, "name": a.name}
-            for a in found
-        ]
-    )
+        return fast_response(INVALID, accept)
+
+    content = {
+        "valid": True,
+        "attendees": rows_to_dicts(ATTENDEE_FIELDS, found),
+        "code": None,
+        "name": None
+    }
+    return fast_response(content, accept)
 
 # VALIDATE SECRET (SINGLE) -> RETURN CODE + NAME
+# Internal: answers MessagePack to callers that accept it
 @app.post("/attendees/validate-secret", response_model=ValidateResponse)
 async def validate_secret(
     data: ValidateSecretRequest,
     institution_id: str = Depends(get_institution_id),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db),
+    accept: Optional[str] = Header(None)
 ):
-    result = await db.execute(
-        select(Attendee).where(
-            Attendee.institution_id == institution_id,
-            Attendee.code == data.code
-        )
+    # Lean path: prebuilt Core select, rows straight to response bytes
+    return fast_response(await find_secret(db, institution_id, data.code, data.secret), accept)
+
+async def find_secret(db: AsyncSession, institution_id: str, code: str, secret: str) -> dict:
+    result = await db.execute(ATTENDEE_SECRET, {"institution_id": institution_id, "code": code})
+    attendee = result.first()
+
+    if not attendee or not verify_secret(secret, attendee.secret_hash):
+        return INVALID
+    return {"valid": True, "attendees": None, "code": attendee.code, "name": attendee.name}
+
+async def check_secret(institution_id: str, code: str, secret: str) -> dict:
+    """validate-secret for callers in this process (monolith mode): the same answer, no HTTP."""
+    async with router.session(institution_id, readonly=True) as db:
+        return await find_secret(db, institution_id, code, secret)
+
+# CHANGE FEED
+# Incremental sync for consumers caching attendees: pass the last cursor as since,
+# and wait > 0 to long-poll until something changes.
+@app.get("/changes", response_model=ChangesResponse)
+async def get_changes(
+    since: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    wait: float = Query(0, ge=0, le=LONG_POLL_MAX),
+    institution_id: Optional[str] = Depends(get_change_scope),
+    db: AsyncSession = Depends(get_feed_db)
+):
+    changes = await wait_for_changes(db, institution_id, since, limit, wait)
+    return ChangesResponse(
+        changes=[serialize_change(c) for c in changes],
+        cursor=changes[-1].txid if changes else since
     )
-    attendee = result.scalar_one_or_none()
 
-    if not attendee:
-        return ValidateResponse(valid=False)
+# DB POOL
+# Checkout wait and saturation of this process's connection pools, per shard
+@app.get("/internal/pool", dependencies=[Depends(require_service)])
+async def get_pool():
+    return router.stats()
+
+# SHARDS
+# Shard names for consumers of the change feed, and where placements live
+@app.get("/internal/shards", dependencies=[Depends(require_service)])
+async def get_shards():
+    return {"shards": list(router.shards), "directory": router.directory.name}
 
-    if not verify_secret(data.secret, attendee.secret_hash):
-        return ValidateResponse(valid=False)
+# METRICS
+# Prometheus text format, per process; the /internal/* reports as time series
+register_collector(pool_metrics(router.stats))
+register_collector(admission_metrics)
 
-    return ValidateResponse(
-        valid=True,
-        code=attendee.code,
-        name=attendee.name
-    )
\ No newline at end of file
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return metrics_response()
@@ -0,0 +1,43 @@
+"""
+Schema migrations of attendee-service.
+
+    python migrate.py            apply pending migrations to every shard
+    python migrate.py --status   print the schema version of every shard
+
+Run before rolling out a build that adds a migration; pods only check the
+version at startup (see migrator.py).
+"""
+from db import Base, router
+# Registers the changes and resource_versions tables
+import outbox
+from migrator import Migration, create_tables, create_index, check_version, run_cli
+from shards import DirectoryBase
+
+MIGRATIONS = [
+    # The placement table is only read on the directory shard, but every
+    # shard gets one so any of them can become the directory
+    Migration(1, "baseline tables", [create_tables(Base.metadata, DirectoryBase.metadata)]),
+    Migration(2, "tenant-leading indexes", [
+        # attendees is keyed by (institution_id, code) already
+        create_index("ix_changes_institution_id_seq", "changes", ["institution_id", "seq"]),
+    ], transactional=False),
+    Migration(3, "resource versions for conditional GET", [create_tables(Base.metadata)]),
+    # Feed cursors count writing transactions (outbox.py). Existing changes
+    # all get this migration's id, so consumers replay them once
+    Migration(4, "change feed ordered by transaction", [
+        "ALTER TABLE changes ADD COLUMN IF NOT EXISTS txid BIGINT NOT NULL DEFAULT (pg_current_xact_id()::text::bigint)",
+    ]),
+    Migration(5, "change feed transaction indexes", [
+        create_index("ix_changes_txid_seq", "changes", ["txid", "seq"]),
+        create_index("ix_changes_institution_id_txid_seq", "changes", ["institution_id", "txid", "seq"]),
+    ], transactional=False),
+]
+
+def targets() -> dict:
+    return {name: shard.engine for name, shard in router.shards.items()}
+
+async def check_schema():
+    await check_version(MIGRATIONS, targets())
+
+if __name__ == "__main__":
+    run_cli(MIGRATIONS, targets())
@@ -0,0 +1,181 @@
+from sqlalchemy import text
+import argparse
+import asyncio
+import os
+
+from engine import ensure_schema
+
+# CONFIG
+# Apply pending migrations at startup instead of only checking (local dev, monolith)
+DB_MIGRATE_ON_STARTUP = os.getenv("DB_MIGRATE_ON_STARTUP", "0") == "1"
+
+# Arbitrary constant; one migrator per database (and schema) at a time
+MIGRATION_LOCK_ID = 742_001
+
+class Migration:
+    """
+    One schema version. Steps are SQL strings or async callables taking the
+    connection. Non-transactional migrations run in autocommit mode, which
+    CREATE INDEX CONCURRENTLY requires; their steps must be safe to re-run,
+    since a failure leaves the earlier ones applied.
+    """
+
+    def __init__(self, version: int, name: str, steps: list, transactional: bool = True):
+        self.version = version
+        self.name = name
+        self.steps = steps
+        self.transactional = transactional
+
+# ---------- STEPS ----------
+def create_tables(*metadatas):
+    """Create missing tables; a no-op on databases created before migrations existed."""
+    async def step(conn):
+        for metadata in metadatas:
+            await conn.run_sync(metadata.create_all)
+    return step
+
+async def index_state(conn, name: str):
+    """None if the index does not exist, else whether it is valid."""
+    result = await conn.execute(
+        text("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"),
+        {"name": name}
+    )
+    return result.scalar()
+
+async def build_index(conn, name: str, table: str, columns: str):
+    # A failed concurrent build leaves an invalid index behind; start over
+    if await index_state(conn, name) is False:
+        await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+    await conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({columns})"))
+
+def create_index(name: str, table: str, columns: list[str]):
+    """
+    Build an index without blocking writes. On a partitioned table the
+    parent index is created ON ONLY the parent, each partition's index is
+    built concurrently and attached, and partitions created later inherit it.
+    """
+    column_list = ", ".join(columns)
+
+    async def step(conn):
+        kind = await conn.scalar(text("SELECT relkind::text FROM pg_class WHERE oid = to_regclass(:table)"), {"table": table})
+        if kind != "p":
+            await build_index(conn, name, table, column_list)
+            return
+
+        await conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON ONLY {table} ({column_list})"))
+        partitions = await conn.execute(text(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE pg_inherits.inhparent = to_regclass(:table)"
+        ), {"table": table})
+        for partition in [row[0] for row in partitions]:
+            # Partitions created after the parent index already carry a copy
+            attached = await conn.scalar(text(
+                "SELECT 1 FROM pg_index JOIN pg_inherits ON pg_inherits.inhrelid = pg_index.indexrelid "
+                "WHERE pg_index.indrelid = to_regclass(:partition) AND pg_inherits.inhparent = to_regclass(:name)"
+            ), {"partition": partition, "name": name})
+            if attached:
+                continue
+            partition_index = f"{partition}_{'_'.join(columns)}_idx"
+            await build_index(conn, partition_index, partition, column_list)
+            await conn.execute(text(f"ALTER INDEX {name} ATTACH PARTITION {partition_index}"))
+    return step
+
+# ---------- VERSIONS ----------
+async def current_version(conn) -> int:
+    if await conn.scalar(text("SELECT to_regclass('schema_version')")) is None:
+        return 0
+    return await conn.scalar(text("SELECT coalesce(max(version), 0) FROM schema_version"))
+
+async def record_version(conn, migration: Migration):
+    await conn.execute(
+        text("INSERT INTO schema_version (version, name) VALUES (:version, :name)"),
+        {"version": migration.version, "name": migration.name}
+    )
+
+async def run_steps(conn, migration: Migration):
+    for step in migration.steps:
+        if isinstance(step, str):
+            await conn.execute(text(step))
+        else:
+            await step(conn)
+
+# ---------- APPLY ----------
+async def migrate_database(name: str, engine, migrations: list[Migration]):
+    async with engine.begin() as conn:
+        await ensure_schema(conn)
+        await conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_version ("
+            "version integer PRIMARY KEY, name text NOT NULL, "
+            "applied_at timestamp NOT NULL DEFAULT now())"
+        ))
+
+    # The lock is held by an idle autocommit session: an open transaction
+    # here would make every CREATE INDEX CONCURRENTLY wait for it
+    async with engine.connect() as lock_conn:
+        lock_conn = await lock_conn.execution_options(isolation_level="AUTOCOMMIT")
+        await lock_conn.execute(
+            text("SELECT pg_advisory_lock(:id, hashtext(current_schema()))"), {"id": MIGRATION_LOCK_ID}
+        )
+        try:
+            version = await current_version(lock_conn)
+            for migration in migrations:
+                if migration.version <= version:
+                    continue
+                print(f"{name}: applying {migration.version} {migration.name}")
+                if migration.transactional:
+                    async with engine.begin() as conn:
+                        await run_steps(conn, migration)
+                        await record_version(conn, migration)
+                else:
+                    async with engine.connect() as conn:
+                        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+                        await run_steps(conn, migration)
+                        await record_version(conn, migration)
+        finally:
+            await lock_conn.execute(
+                text("SELECT pg_advisory_unlock(:id, hashtext(current_schema()))"), {"id": MIGRATION_LOCK_ID}
+            )
+
+async def migrate_all(migrations: list[Migration], targets: dict):
+    for name, engine in targets.items():
+        await migrate_database(name, engine, migrations)
+
+async def check_version(migrations: list[Migration], targets: dict):
+    """
+    Startup check: one query per database. Newer schemas are accepted so
+    pods of the previous release keep starting during a rollout.
+    """
+    if DB_MIGRATE_ON_STARTUP:
+        await migrate_all(migrations, targets)
+        return
+
+    latest = migrations[-1].version
+    for name, engine in targets.items():
+        async with engine.connect() as conn:
+            version = await current_version(conn)
+        if version < latest:
+            raise RuntimeError(
+                f"Database {name} is at schema version {version}, this build needs {latest}: "
+                f"run python migrate.py"
+            )
+
+# ---------- CLI ----------
+def run_cli(migrations: list[Migration], targets: dict):
+    parser = argparse.ArgumentParser(description="Apply pending schema migrations")
+    parser.add_argument("--status", action="store_true", help="print each database's version and exit")
+    args = parser.parse_args()
+
+    async def status():
+        for name, engine in targets.items():
+            async with engine.connect() as conn:
+                print(f"{name}: {await current_version(conn)} (latest {migrations[-1].version})")
+
+    async def main():
+        try:
+            await (status() if args.status else migrate_all(migrations, targets))
+        finally:
+            for engine in targets.values():
+                await engine.dispose()
+
+    asyncio.run(main())
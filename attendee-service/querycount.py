@@ -0,0 +1,272 @@
+from collections import Counter as Tally
+from contextvars import ContextVar
+from sqlalchemy import event
+import json
+import math
+import os
+import time
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+from metrics import Histogram
+
+# CONFIG
+# off; warn: count queries per route, and log those growing with input size
+# on routes with a budget in QUERY_BUDGET_FILE; record: size every route's
+# input and write the observed per-route cost there; enforce: fail any
+# request over its route's budget (test runs)
+QUERY_COUNT_MODE = os.getenv("QUERY_COUNT_MODE", "warn")
+QUERY_BUDGET_FILE = os.getenv("QUERY_BUDGET_FILE", "query_budgets.json")
+# Growth is only judged across at least this many more input items
+QUERY_GROWTH_MIN_ITEMS = int(os.getenv("QUERY_GROWTH_MIN_ITEMS", "5"))
+# Extra queries per extra input item that count as growth; 1 is a textbook N+1
+QUERY_GROWTH_RATIO = float(os.getenv("QUERY_GROWTH_RATIO", "0.5"))
+# Seconds between warnings for the same route
+QUERY_WARN_INTERVAL = float(os.getenv("QUERY_WARN_INTERVAL", "60"))
+# Larger request bodies are not parsed for their item count. Only routes
+# with a budget (every route when recording) have their body kept for it
+QUERY_BODY_MAX = int(os.getenv("QUERY_BODY_MAX", str(1024 * 1024)))
+
+OFF, WARN, RECORD, ENFORCE = "off", "warn", "record", "enforce"
+BODY_METHODS = {"POST", "PUT", "PATCH"}
+
+QUERIES = Histogram(
+    "http_request_db_queries", "SQL statements run per HTTP request, by route template",
+    ["method", "route"],
+    buckets=(1, 2, 3, 5, 10, 20, 50, 100, 250, 1000)
+)
+DB_TIME = Histogram(
+    "http_request_db_seconds", "Time spent in SQL per HTTP request, by route template",
+    ["method", "route"]
+)
+
+# Queries of the request the current task is handling
+_current = ContextVar("request_queries", default=None)
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised in enforce mode instead of answering a request that ran more queries than its budget."""
+
+class RequestQueries:
+    __slots__ = ("count", "seconds", "statements")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = Tally()
+
+    def most_repeated(self) -> str:
+        if not self.statements:
+            return "none"
+        statement, times = self.statements.most_common(1)[0]
+        return f"{times}x {' '.join(statement.split())[:160]}"
+
+def current():
+    """Queries counted so far for the current request, or None outside one."""
+    return _current.get()
+
+def count_queries(engine):
+    """Count each statement run on engine, and its time, against the current request."""
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def before(conn, cursor, statement, parameters, context, executemany):
+        if _current.get() is not None:
+            context._count_started = time.perf_counter()
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def after(conn, cursor, statement, parameters, context, executemany):
+        queries = _current.get()
+        started = getattr(context, "_count_started", None)
+        if queries is not None and started is not None:
+            queries.count += 1
+            queries.seconds += time.perf_counter() - started
+            queries.statements[statement] += 1
+
+# ---------- INPUT SIZE ----------
+def input_items(content_type: str, body: bytes):
+    """
+    Size of a request's input: the length of a list body, or of the longest
+    list at the top of an object body ({"attendees": [...]}). None when the
+    body cannot be read.
+    """
+    if not body:
+        return 0
+    try:
+        if msgspec is not None and content_type.split(";")[0].strip().lower() == "application/msgpack":
+            data = msgspec.msgpack.decode(body)
+        else:
+            data = json.loads(body)
+    except Exception:
+        return None
+    if isinstance(data, list):
+        return len(data)
+    if isinstance(data, dict):
+        return max((len(value) for value in data.values() if isinstance(value, list)), default=0)
+    return 0
+
+# ---------- BUDGETS ----------
+# QUERY_BUDGET_FILE: {"room-service": {"POST /rooms": {"base": 4, "per_item": 0}}, ...}
+# A request may run base + per_item * input items statements
+def load_budgets(path: str, service: str) -> dict:
+    try:
+        with open(path) as f:
+            return json.load(f).get(service, {})
+    except FileNotFoundError:
+        return {}
+
+def fit_budget(samples: dict) -> dict:
+    """Tightest base + per_item * items covering every {items: queries} sample, the slope taken from the smallest input."""
+    smallest = min(samples)
+    per_item = max(
+        [(queries - samples[smallest]) / (items - smallest) for items, queries in samples.items() if items > smallest] + [0.0]
+    )
+    per_item = math.ceil(per_item * 100) / 100
+    base = max(math.ceil(queries - per_item * items) for items, queries in samples.items())
+    return {"base": base, "per_item": per_item}
+
+def save_budgets(path: str, service: str, budgets: dict):
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        data = {}
+    data[service] = dict(sorted(budgets.items()))
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=2, sort_keys=True)
+        f.write("\n")
+    os.replace(tmp, path)
+
+# ---------- ASGI ----------
+class QueryCounter:
+    """
+    ASGI middleware counting the SQL statements each request runs and the
+    time they take, per route template. On routes with a budget, when the
+    count grows with the size of the request body (an N+1: one query per
+    item) it logs a warning naming the most repeated statement; other
+    routes' bodies are passed through without being buffered or decoded. In enforce mode a request over its route's
+    budget fails with QueryBudgetExceeded before its response starts, so a
+    test client sees the regression; budgets come from a record-mode run.
+    Add it inside Compression, like Instrumentation, so the route is known.
+    """
+
+    def __init__(self, app, service: str, mode: str = QUERY_COUNT_MODE, budget_file: str = QUERY_BUDGET_FILE):
+        self.app = app
+        self.service = service
+        self.mode = mode
+        self.budget_file = budget_file
+        self.budgets = load_budgets(budget_file, service) if mode in (WARN, ENFORCE) else {}
+        # route -> (items, queries) of the smallest input seen
+        self.baselines = {}
+        self.warned = {}
+        # record mode: route -> {items: most queries seen}
+        self.samples = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.mode == OFF:
+            return await self.app(scope, receive, send)
+
+        queries = RequestQueries()
+        chunks = []
+        received = 0
+        read_body = scope["method"] in BODY_METHODS
+        # Decided at the first body chunk, once routing has set scope["route"]
+        sized = None
+
+        async def receive_teed():
+            nonlocal received, sized
+            message = await receive()
+            if message["type"] == "http.request":
+                if sized is None:
+                    sized = self.sizes(scope)
+                if not sized:
+                    return message
+                body = message.get("body", b"")
+                received += len(body)
+                if received <= QUERY_BODY_MAX:
+                    chunks.append(body)
+            return message
+
+        def items():
+            if not read_body:
+                return 0
+            if not sized or received > QUERY_BODY_MAX:
+                return None
+            content_type = ""
+            for name, value in scope.get("headers", ()):
+                if name == b"content-type":
+                    content_type = value.decode("latin-1")
+            return input_items(content_type, b"".join(chunks))
+
+        async def send_checked(message):
+            if message["type"] == "http.response.start" and self.mode == ENFORCE:
+                self.enforce(scope, queries, items())
+            await send(message)
+
+        token = _current.set(queries)
+        try:
+            await self.app(scope, receive_teed if read_body else receive, send_checked)
+        finally:
+            _current.reset(token)
+
+        method = scope["method"]
+        route = getattr(scope.get("route"), "path", None) or "unmatched"
+        QUERIES.labels(method, route).observe(queries.count)
+        DB_TIME.labels(method, route).observe(queries.seconds)
+        if queries.count and route != "unmatched":
+            self.observe(f"{method} {route}", items(), queries)
+
+    def sizes(self, scope) -> bool:
+        """Whether this request's body is kept to count its input items."""
+        if self.mode == RECORD:
+            return True
+        route = getattr(scope.get("route"), "path", None)
+        return f"{scope['method']} {route}" in self.budgets
+
+    def enforce(self, scope, queries: RequestQueries, n_items):
+        route = getattr(scope.get("route"), "path", None)
+        budget = self.budgets.get(f"{scope['method']} {route}")
+        if budget is None or n_items is None:
+            return
+        limit = budget["base"] + budget["per_item"] * n_items
+        if queries.count > limit:
+            raise QueryBudgetExceeded(
+                f"{scope['method']} {route} ran {queries.count} queries for {n_items} input items, "
+                f"budget {limit:g} ({budget['base']} + {budget['per_item']:g}/item); "
+                f"most repeated: {queries.most_repeated()}"
+            )
+
+    def observe(self, key: str, n_items, queries: RequestQueries):
+        if n_items is None:
+            return
+        if self.mode == RECORD:
+            samples = self.samples.setdefault(key, {})
+            if queries.count > samples.get(n_items, -1):
+                samples[n_items] = queries.count
+                save_budgets(self.budget_file, self.service, {k: fit_budget(v) for k, v in self.samples.items()})
+
+        baseline = self.baselines.get(key)
+        if baseline is None or n_items < baseline[0]:
+            self.baselines[key] = (n_items, queries.count)
+
+        if baseline is not None and n_items > baseline[0]:
+            extra_items = n_items - baseline[0]
+            grows = extra_items >= QUERY_GROWTH_MIN_ITEMS and queries.count - baseline[1] >= extra_items * QUERY_GROWTH_RATIO
+        else:
+            # Nothing smaller to compare with: at least one query per item
+            grows = n_items >= QUERY_GROWTH_MIN_ITEMS and queries.count >= n_items
+        if not grows:
+            return
+
+        now = time.monotonic()
+        if now - self.warned.get(key, -QUERY_WARN_INTERVAL) < QUERY_WARN_INTERVAL:
+            return
+        self.warned[key] = now
+        compared = f" ({baseline[1]} for {baseline[0]})" if baseline is not None and n_items > baseline[0] else ""
+        print(
+            f"Query count grows with input on {self.service} {key}: "
+            f"{queries.count} queries for {n_items} items{compared}, {queries.seconds * 1000:.1f} ms in SQL; "
+            f"most repeated: {queries.most_repeated()}"
+        )
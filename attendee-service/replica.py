@@ -0,0 +1,82 @@
+from contextvars import ContextVar
+from sqlalchemy import event
+import os
+import time
+
+from tokens import verified_claims
+
+# CONFIG
+# After an institution writes, its reads stay on the primary this long (seconds)
+READ_YOUR_WRITES_WINDOW = float(os.getenv("READ_YOUR_WRITES_WINDOW", "5"))
+# Clients that just wrote through another replica can send this to skip the replica
+READ_PRIMARY_HEADER = b"x-read-primary"
+
+MAX_TRACKED_TENANTS = 10000
+
+# Per-request {"tenant": str, "prefer_primary": bool, "wrote": bool}; a mutable dict so a
+# commit deep inside the handler is visible to the middleware afterwards
+_request_state = ContextVar("replica_request_state", default=None)
+
+# institution_id -> monotonic time of its last committed write in this process
+_recent_writes = {}
+
+def prefer_primary() -> bool:
+    """Whether reads in the current request must see the primary's latest writes."""
+    state = _request_state.get()
+    return state is not None and state["prefer_primary"]
+
+def current_tenant() -> str:
+    """Institution (verified JWT sub) of the current request, for shard routing."""
+    state = _request_state.get()
+    return state["tenant"] if state is not None else ""
+
+def mark_write(institution_id: str):
+    now = time.monotonic()
+    if len(_recent_writes) >= MAX_TRACKED_TENANTS:
+        for tenant, written_at in list(_recent_writes.items()):
+            if now - written_at >= READ_YOUR_WRITES_WINDOW:
+                del _recent_writes[tenant]
+    _recent_writes[institution_id] = now
+
+def wrote_recently(institution_id: str) -> bool:
+    written_at = _recent_writes.get(institution_id)
+    return written_at is not None and time.monotonic() - written_at < READ_YOUR_WRITES_WINDOW
+
+def track_writes(primary_engine):
+    """Flag the current request as a write whenever the primary commits."""
+    @event.listens_for(primary_engine.sync_engine, "commit")
+    def on_commit(conn):
+        state = _request_state.get()
+        if state is not None:
+            state["wrote"] = True
+
+class ReadYourWrites:
+    """
+    ASGI middleware deciding per request whether read-only handlers may use
+    the replica. Reads go to the primary when the request carries
+    X-Read-Primary, or when its institution committed a write through this
+    process within READ_YOUR_WRITES_WINDOW. The institution comes from the
+    verified token only, so a forged sub routes nowhere: requests without a
+    valid token get the directory shard and the handler turns them away.
+    """
+
+    def __init__(self, app, secret: str, algorithm: str = "HS256"):
+        self.app = app
+        self.secret = secret
+        self.algorithm = algorithm
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        claims = verified_claims(scope, self.secret, self.algorithm)
+        tenant = (claims or {}).get("sub") or ""
+        forced = any(name == READ_PRIMARY_HEADER for name, _ in scope.get("headers", ()))
+        state = {"tenant": tenant, "prefer_primary": forced or (bool(tenant) and wrote_recently(tenant)), "wrote": False}
+        token = _request_state.set(state)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _request_state.reset(token)
+            if tenant and state["wrote"]:
+                mark_write(tenant)
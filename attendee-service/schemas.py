@@ -1,5 +1,6 @@
 from pydantic import BaseModel
 from typing import List, Optional
+from datetime import datetime
 
 # ---------- CREATE ----------
 class AttendeeCreate(BaseModel):
@@ -19,6 +20,9 @@ class GetAttendeeResponse(BaseModel):
     code: str
     name: str
 
+# Key order of fast-path rows (fastjson.py)
+ATTENDEE_FIELDS = tuple(GetAttendeeResponse.model_fields)
+
 
 # ---------- VALIDATE EXISTENCE (BATCH) ----------
 class AttendeeExistenceItem(BaseModel):
@@ -40,3 +44,18 @@ class ValidateResponse(BaseModel):
     attendees: Optional[List[GetAttendeeResponse]] = None
     code: Optional[str] = None
     name: Optional[str] = None
+
+
+# ---------- CHANGE FEED ----------
+class ChangeItem(BaseModel):
+    seq: int
+    institution_id: str
+    entity: str
+    entity_id: str
+    op: str
+    data: dict
+    created_at: datetime
+
+class ChangesResponse(BaseModel):
+    changes: List[ChangeItem]
+    cursor: int
@@ -0,0 +1,27 @@
+import json
+import os
+import uuid
+
+import pytest
+
+from conftest import SERVICE, BUDGET_FILE, bearer
+
+pytestmark = pytest.mark.anyio
+
+ROUTES = ["POST /attendees"]
+
+def test_budgets_are_committed():
+    if os.getenv("QUERY_COUNT_MODE") == "record":
+        pytest.skip("recording")
+    with open(BUDGET_FILE) as f:
+        budgets = json.load(f)[SERVICE]
+    assert set(ROUTES) <= set(budgets)
+
+@pytest.mark.parametrize("count", [1, 10])
+async def test_create_attendees(client, count):
+    institution_id = str(uuid.uuid4())
+    attendees = [{"code": f"S{i}", "name": f"Student {i}"} for i in range(count)]
+
+    resp = await client.post("/attendees", json={"attendees": attendees}, headers=bearer(institution_id))
+    assert resp.status_code == 200, resp.text
+    assert len(resp.json()) == count
@@ -1,17 +1,36 @@
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Request
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from jose import jwt
 import hashlib
 import os
 
-from db import SessionLocal, Institution, init_db
+from db import SessionLocal, Institution, engine
+from engine import pool_stats
+from migrate import check_schema
+from admission import AdmissionControl
+from tokens import verified_claims
+from compress import Compression
+from tracing import Tracing
+from querycount import QueryCounter
+from metrics import Instrumentation, register_collector, metrics_response, pool_metrics, admission_metrics
 from schemas import RegisterRequest, LoginRequest, TokenResponse
 
 JWT_SECRET = os.getenv("JWT_SECRET", "EfEmEitch123")
 JWT_ALGORITHM = "HS256"
 
+security = HTTPBearer()
 app = FastAPI()
+app.add_middleware(AdmissionControl, secret=JWT_SECRET)
+# Counts each request's queries and warns when they grow with its input
+app.add_middleware(QueryCounter, service="auth-service")
+# Counts and times every request, including any wait for admission
+app.add_middleware(Instrumentation)
+# Joins the caller's trace or samples a new one; spans cover calls and queries
+app.add_middleware(Tracing, service="auth-service")
+# Outermost, so handlers see plain bodies and large responses leave compressed
+app.add_middleware(Compression)
 
 async def get_db():
     async with SessionLocal() as session:
@@ -19,7 +38,8 @@ async def get_db():
 
 @app.on_event("startup")
 async def startup():
-    await init_db()
+    # Schema changes are applied by migrate.py, not by pods
+    await check_schema()
 
 def hash_password(password: str) -> str:
     return hashlib.sha256(password.encode()).hexdigest()
@@ -34,6 +54,17 @@ def create_jwt(institution_id: str) -> str:
     }
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
+def require_service(
+    request: Request,
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """/internal/* reports expose topology and tenant placement: service and sync tokens only."""
+    payload = verified_claims(request.scope, JWT_SECRET, JWT_ALGORITHM)
+    if payload is None:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    if payload.get("role") not in ("service", "sync"):
+        raise HTTPException(status_code=403, detail="Service token required")
+
 @app.post("/register")
 async def register(
     data: RegisterRequest,
@@ -68,4 +99,19 @@ async def login(
         raise HTTPException(status_code=401, detail="invalid credentials")
 
     token = create_jwt(inst.id)
-    return TokenResponse(access_token=token)
\ No newline at end of file
+    return TokenResponse(access_token=token)
+
+# DB POOL
+# Checkout wait and saturation of this process's connection pool
+@app.get("/internal/pool", dependencies=[Depends(require_service)])
+async def get_pool():
+    return {"primary": pool_stats(engine)}
+
+# METRICS
+# Prometheus text format, per process; the /internal/* reports as time series
+register_collector(pool_metrics(lambda: {"default": {"primary": pool_stats(engine)}}))
+register_collector(admission_metrics)
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return metrics_response()
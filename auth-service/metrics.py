@@ -0,0 +1,315 @@
+from bisect import bisect_left
+from starlette.responses import Response
+import os
+import time
+
+import admission
+
+# CONFIG
+# 0 stops timing requests; /metrics still answers with everything else
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+# Upper bounds (seconds) of the latency histogram buckets
+METRICS_LATENCY_BUCKETS = tuple(sorted(float(bound) for bound in os.getenv(
+    "METRICS_LATENCY_BUCKETS", "0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10"
+).split(",")))
+# Label sets kept per metric; any further ones are counted under "other"
+METRICS_MAX_SERIES = int(os.getenv("METRICS_MAX_SERIES", "500"))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+OVERFLOW = "other"
+# Any other method a client sends is reported as "other"
+METHODS = {"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"}
+
+# Every metric declared in this process, and the callables read at scrape time
+_metrics = []
+_collectors = []
+
+# ---------- METRICS ----------
+class CounterValue:
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def samples(self, name: str, labels: dict):
+        yield name, labels, self.value
+
+class GaugeValue(CounterValue):
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+class HistogramValue:
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        # Per bucket, not cumulative; the last slot is +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self, name: str, labels: dict):
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            yield f"{name}_bucket", dict(labels, le=format_value(bound)), total
+        yield f"{name}_sum", labels, self.sum
+        yield f"{name}_count", labels, total
+
+class Metric:
+    """
+    One named metric and its series, one per label set. The number of series
+    is capped at METRICS_MAX_SERIES; past it new label sets all land on a
+    single series labelled "other", so no input can grow a scrape unbounded.
+    """
+
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.series = {}
+        _metrics.append(self)
+
+    def new_series(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        key = tuple(str(value) for value in values)
+        series = self.series.get(key)
+        if series is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}, got {values}")
+            if len(self.series) >= METRICS_MAX_SERIES:
+                key = (OVERFLOW,) * len(key)
+                series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = self.new_series()
+        return series
+
+    def samples(self):
+        for key, series in list(self.series.items()):
+            yield from series.samples(self.name, dict(zip(self.labelnames, key)))
+
+class Counter(Metric):
+    type = "counter"
+
+    def new_series(self):
+        return CounterValue()
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def new_series(self):
+        return GaugeValue()
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets: tuple = METRICS_LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def new_series(self):
+        return HistogramValue(self.buckets)
+
+def register_collector(collect):
+    """
+    collect() is called on every scrape and yields (name, type, help, samples)
+    per metric, samples being (labels dict, value) pairs. For figures other
+    modules already keep, such as pool and cache statistics.
+    """
+    _collectors.append(collect)
+
+# ---------- EXPOSITION ----------
+def format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return str(value)
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def write_family(lines: list, name: str, type: str, help: str, samples):
+    lines.append(f"# HELP {name} {help}")
+    lines.append(f"# TYPE {name} {type}")
+    for sample_name, labels, value in samples:
+        # Figures not known yet (e.g. percentiles before any sample) are left out
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            value = int(value)
+        label_text = ",".join(f"{k}=\"{escape(str(v))}\"" for k, v in labels.items())
+        lines.append(f"{sample_name}{{{label_text}}} {format_value(value)}" if label_text
+                     else f"{sample_name} {format_value(value)}")
+
+def render() -> str:
+    """Every metric of this process in the Prometheus text format."""
+    lines = []
+    for metric in _metrics:
+        write_family(lines, metric.name, metric.type, metric.help, metric.samples())
+    for collect in _collectors:
+        try:
+            for name, type, help, samples in collect():
+                write_family(lines, name, type, help, ((name, labels, value) for labels, value in samples))
+        except Exception as e:
+            # One broken report must not take the whole scrape down
+            print(f"Metrics collector error: {e}")
+    return "\n".join(lines) + "\n"
+
+def metrics_response() -> Response:
+    return Response(render(), media_type=CONTENT_TYPE)
+
+# ---------- HTTP ----------
+REQUESTS = Counter(
+    "http_requests_total", "HTTP requests handled, by route template and status",
+    ["method", "route", "status"]
+)
+LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency, by route template",
+    ["method", "route"]
+)
+IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests being handled").labels()
+
+class Instrumentation:
+    """
+    ASGI middleware counting and timing every HTTP request. Requests are
+    labelled with the matched route's template (/classes/{class_id}/roster),
+    never the raw path, so ids in URLs do not create series; paths no route
+    matches share "unmatched". Add it inside Compression: the router records
+    the matched route on the scope it is handed, and Compression may pass a
+    copy further in.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            return await self.app(scope, receive, send)
+
+        # Stays 500 if the app fails before starting a response
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            IN_FLIGHT.dec()
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            method = scope["method"] if scope["method"] in METHODS else OVERFLOW
+            REQUESTS.labels(method, route, status).inc()
+            LATENCY.labels(method, route).observe(time.perf_counter() - started)
+
+# ---------- COLLECTORS ----------
+POOL_GAUGES = (
+    ("size", "db_pool_size", "Connections the pool keeps open"),
+    ("checked_out", "db_pool_checked_out", "Connections in use"),
+    ("overflow", "db_pool_overflow", "Connections beyond the pool size; negative while the pool is still filling"),
+    ("saturation", "db_pool_saturation", "Share of pool size plus overflow in use")
+)
+POOL_WAIT_QUANTILES = (
+    ("0.5", "checkout_p50_seconds"),
+    ("0.99", "checkout_p99_seconds"),
+    ("1", "checkout_max_seconds")
+)
+
+def pool_metrics(stats):
+    """Collector for stats() shaped like ShardRouter.stats(): {shard: {"primary"/"replica": pool_stats()}}."""
+    def collect():
+        pools = [
+            ({"shard": shard, "role": role}, pool)
+            for shard, roles in stats().items()
+            for role, pool in roles.items()
+        ]
+        for key, name, help in POOL_GAUGES:
+            yield name, "gauge", help, [(labels, pool[key]) for labels, pool in pools]
+        yield "db_pool_checkouts_total", "counter", "Connection checkouts", [
+            (labels, pool["checkouts"]) for labels, pool in pools
+        ]
+        yield "db_pool_checkout_timeouts_total", "counter", "Checkouts that timed out waiting for a connection", [
+            (labels, pool["checkout_timeouts"]) for labels, pool in pools
+        ]
+        yield "db_pool_checkout_wait_seconds", "gauge", "Checkout wait over the recent checkouts", [
+            (dict(labels, quantile=quantile), pool[key])
+            for labels, pool in pools
+            for quantile, key in POOL_WAIT_QUANTILES
+        ]
+    return collect
+
+def admission_metrics():
+    """Collector for the AdmissionControl instance wrapping this process's app."""
+    controller = admission.controller
+    # The middleware stack is built on the first request
+    if controller is None:
+        return
+    yield "admission_in_flight", "gauge", "Admitted requests in flight, by priority", [
+        ({"priority": priority}, controller.inflight_by_priority.get(priority, 0))
+        for priority in controller.capacity
+    ]
+    yield "admission_capacity", "gauge", "Requests in flight each priority may reach", [
+        ({"priority": priority}, capacity) for priority, capacity in controller.capacity.items()
+    ]
+    yield "admission_requests_total", "counter", "Admission decisions, by priority and outcome", [
+        ({"priority": priority, "outcome": outcome}, count)
+        for priority, stats in list(controller.stats.items())
+        for outcome, count in stats.items()
+    ]
+
+BREAKER_STATES = ("closed", "half_open", "open")
+
+def upstream_metrics(snapshot):
+    """Collector for resilience.snapshot(): breaker state and retry/hedge counts per upstream."""
+    def collect():
+        upstreams = snapshot()
+        yield "upstream_circuit_state", "gauge", "1 for the state each upstream's circuit breaker is in", [
+            ({"upstream": name, "state": state}, int(upstream["state"] == state))
+            for name, upstream in upstreams.items()
+            for state in BREAKER_STATES
+        ]
+        for key in ("retries", "hedges", "hedge_wins"):
+            yield f"upstream_{key}_total", "counter", f"Upstream calls counted as {key}", [
+                ({"upstream": name}, upstream[key]) for name, upstream in upstreams.items()
+            ]
+    return collect
+
+def coalescing_metrics(snapshot):
+    """Collector for SingleFlight.snapshot(): calls made and upstream requests sent, per call site."""
+    def collect():
+        sites = snapshot()
+        yield "singleflight_calls_total", "counter", "Calls made, by call site", [
+            ({"site": site}, stats["calls"]) for site, stats in sites.items()
+        ]
+        yield "singleflight_executions_total", "counter", "Upstream requests actually sent, by call site", [
+            ({"site": site}, stats["executions"]) for site, stats in sites.items()
+        ]
+    return collect
+
+CACHE_SETTINGS = ("ttl", "stale_ttl", "error_ttl")
+
+def cache_metrics(snapshots):
+    """Collector for {name: SWRCache.snapshot()}: lookups and refreshes, by outcome."""
+    def collect():
+        caches = snapshots()
+        yield "cache_events_total", "counter", "Cache lookups and refreshes, by cache and outcome", [
+            ({"cache": cache, "event": event}, count)
+            for cache, stats in caches.items()
+            for event, count in stats.items()
+            if event not in CACHE_SETTINGS
+        ]
+    return collect
@@ -0,0 +1,24 @@
+"""
+Schema migrations of auth-service.
+
+    python migrate.py            apply pending migrations
+    python migrate.py --status   print the schema version
+
+Run before rolling out a build that adds a migration; pods only check the
+version at startup (see migrator.py).
+"""
+from db import Base, engine
+from migrator import Migration, create_tables, check_version, run_cli
+
+MIGRATIONS = [
+    Migration(1, "baseline tables", [create_tables(Base.metadata)]),
+]
+
+def targets() -> dict:
+    return {"default": engine}
+
+async def check_schema():
+    await check_version(MIGRATIONS, targets())
+
+if __name__ == "__main__":
+    run_cli(MIGRATIONS, targets())
@@ -0,0 +1,94 @@
+"""
+Benchmark of GET /classes and GET /classes/{class_id}/roster serialization:
+the model-per-row path against the fast path in fastjson.py, on generated
+rows.
+
+    python bench_serialization.py --rows 20000
+
+The old path builds a model per row, then validates and encodes the result
+through a TypeAdapter the way FastAPI does for response_model. Both paths
+must produce the same bytes.
+"""
+import argparse
+import time
+import uuid
+
+from pydantic import TypeAdapter
+
+from fastjson import dumps, rows_to_dicts
+from schemas import (
+    GetClassResponse,
+    CLASS_FIELDS,
+    ClassRosterResponse,
+    RosterItem,
+    ROSTER_FIELDS
+)
+
+def generate(rows: int):
+    classes = [(str(uuid.uuid4()), f"CS{1000 + i}", f"Basis Data Lanjut — {i}") for i in range(rows)]
+    roster = [
+        (f"NPM{2100000000 + i}", str(uuid.uuid4()), f"2025-08-{i % 28 + 1:02d}T09:15:00" if i % 20 else None)
+        for i in range(rows)
+    ]
+    return classes, roster
+
+def classes_model_path(adapter: TypeAdapter, rows) -> bytes:
+    content = [GetClassResponse(id=id, code=code, name=name) for id, code, name in rows]
+    return adapter.dump_json(adapter.validate_python(content))
+
+def classes_fast_path(rows) -> bytes:
+    return dumps(rows_to_dicts(CLASS_FIELDS, rows))
+
+def roster_model_path(adapter: TypeAdapter, rows) -> bytes:
+    content = ClassRosterResponse(
+        class_id="cls-1",
+        class_name="Basis Data",
+        attendees=[
+            RosterItem(attendee_code=code, class_attendee_id=class_attendee_id, enrolled_at=enrolled_at)
+            for code, class_attendee_id, enrolled_at in rows
+        ]
+    )
+    return adapter.dump_json(adapter.validate_python(content))
+
+def roster_fast_path(rows) -> bytes:
+    return dumps({
+        "class_id": "cls-1",
+        "class_name": "Basis Data",
+        "attendees": rows_to_dicts(ROSTER_FIELDS, rows)
+    })
+
+def best_of(repeat: int, fn, *args):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings), out
+
+def compare(label: str, repeat: int, model_path, adapter, fast_path, rows):
+    old, old_body = best_of(repeat, model_path, adapter, rows)
+    new, new_body = best_of(repeat, fast_path, rows)
+    assert old_body == new_body, f"fast path changed the {label} bytes"
+
+    print(f"{label}, {len(rows)} rows, {len(new_body)} bytes")
+    print(f"  model per row  {old * 1000:8.1f} ms")
+    print(f"  fast path      {new * 1000:8.1f} ms  ({old / new:.1f}x)")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    classes, roster = generate(args.rows)
+    compare(
+        "GET /classes", args.repeat,
+        classes_model_path, TypeAdapter(list[GetClassResponse]), classes_fast_path, classes
+    )
+    compare(
+        "GET /classes/{class_id}/roster", args.repeat,
+        roster_model_path, TypeAdapter(ClassRosterResponse), roster_fast_path, roster
+    )
+
+if __name__ == "__main__":
+    main()
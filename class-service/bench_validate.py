@@ -0,0 +1,148 @@
+"""
+Benchmark of POST /classes/validate-existence and /classes/validate-attendee:
+the ORM paths they replaced against the prebuilt Core statements in db.py,
+as p50/p99 per call.
+
+    python bench_validate.py --classes 500 --class-size 40 --batch 20 --calls 2000
+    python bench_validate.py --database-url postgresql+asyncpg://...
+
+Each call produces the response bytes, as the handler does. Defaults to a
+throwaway SQLite file (needs aiosqlite); against Postgres it creates and
+fills the classes and class_attendees tables, so point it at a scratch
+database.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from pydantic import TypeAdapter
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from db import Base, Class, ClassAttendee, VALIDATE_CLASSES, VALIDATE_ENROLLMENT
+from fastjson import dumps, rows_to_dicts
+from schemas import ValidateClassExistenceResponse, ValidateAttendeeResponse
+
+INSTITUTION = "bench-institution"
+
+# ---------- VALIDATE CLASS EXISTENCE ----------
+async def existence_orm(db, adapter: TypeAdapter, ids: list) -> bytes:
+    result = await db.execute(
+        select(Class).where(
+            Class.institution_id == INSTITUTION,
+            Class.id.in_(ids)
+        )
+    )
+    found = result.scalars().all()
+    content = ValidateClassExistenceResponse(valid=True, classes=[{"id": c.id, "name": c.name} for c in found])
+    return adapter.dump_json(adapter.validate_python(content))
+
+async def existence_core(db, ids: list) -> bytes:
+    result = await db.execute(VALIDATE_CLASSES, {"institution_id": INSTITUTION, "ids": ids})
+    return dumps({"valid": True, "classes": rows_to_dicts(("id", "name"), result.all())})
+
+# ---------- VALIDATE ATTENDEE IN CLASS ----------
+async def enrollment_orm(db, adapter: TypeAdapter, call: tuple) -> bytes:
+    class_id, attendee_code = call
+    result = await db.execute(
+        select(ClassAttendee, Class)
+        .join(Class, ClassAttendee.class_id == Class.id)
+        .where(
+            ClassAttendee.class_id == class_id,
+            ClassAttendee.attendee_code == attendee_code,
+            ClassAttendee.institution_id == INSTITUTION
+        )
+    )
+    class_attendee, class_obj = result.first()
+    content = ValidateAttendeeResponse(valid=True, class_attendee_id=class_attendee.id, class_name=class_obj.name)
+    return adapter.dump_json(adapter.validate_python(content))
+
+async def enrollment_core(db, call: tuple) -> bytes:
+    class_id, attendee_code = call
+    result = await db.execute(VALIDATE_ENROLLMENT, {
+        "class_id": class_id,
+        "attendee_code": attendee_code,
+        "institution_id": INSTITUTION
+    })
+    class_attendee_id, class_name = result.first()
+    return dumps({"valid": True, "class_attendee_id": class_attendee_id, "class_name": class_name})
+
+def percentiles(timings: list) -> str:
+    cuts = statistics.quantiles(timings, n=100)
+    return f"p50 {cuts[49] * 1000:7.3f} ms  p99 {cuts[98] * 1000:7.3f} ms"
+
+async def compare(db, label: str, calls: list, orm, core):
+    # Warm both paths so one-off compilation is not counted
+    assert await orm(calls[0]) == await core(calls[0]), f"{label}: paths answer differently"
+    timings = {"orm": [], "core": []}
+    for arg in calls:
+        for name, path in (("orm", orm), ("core", core)):
+            start = time.perf_counter()
+            await path(arg)
+            timings[name].append(time.perf_counter() - start)
+        db.expunge_all()
+
+    print(f"{label}, {len(calls)} calls")
+    print(f"  orm entities   {percentiles(timings['orm'])}")
+    print(f"  core columns   {percentiles(timings['core'])}")
+
+async def run(args):
+    engine = create_async_engine(args.database_url)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all, tables=[Class.__table__, ClassAttendee.__table__])
+        await conn.execute(ClassAttendee.__table__.delete().where(ClassAttendee.institution_id == INSTITUTION))
+        await conn.execute(Class.__table__.delete().where(Class.institution_id == INSTITUTION))
+        await conn.execute(Class.__table__.insert(), [
+            {"id": f"class-{i}", "institution_id": INSTITUTION, "code": f"CS{i}", "name": f"Kelas {i}"}
+            for i in range(args.classes)
+        ])
+        await conn.execute(ClassAttendee.__table__.insert(), [
+            {"id": f"ca-{i}-{j}", "institution_id": INSTITUTION, "class_id": f"class-{i}", "attendee_code": f"NPM{j}"}
+            for i in range(args.classes) for j in range(args.class_size)
+        ])
+
+    Session = async_sessionmaker(engine, expire_on_commit=False)
+    rng = random.Random(args.seed)
+    batches = [
+        list(dict.fromkeys(f"class-{rng.randrange(args.classes)}" for _ in range(args.batch)))
+        for _ in range(args.calls)
+    ]
+    enrollments = [
+        (f"class-{rng.randrange(args.classes)}", f"NPM{rng.randrange(args.class_size)}")
+        for _ in range(args.calls)
+    ]
+
+    async with Session() as db:
+        adapter = TypeAdapter(ValidateClassExistenceResponse)
+        await compare(
+            db, f"POST /classes/validate-existence ({args.batch} ids)", batches,
+            lambda batch: existence_orm(db, adapter, batch), lambda batch: existence_core(db, batch)
+        )
+        enrollment_adapter = TypeAdapter(ValidateAttendeeResponse)
+        await compare(
+            db, "POST /classes/validate-attendee", enrollments,
+            lambda call: enrollment_orm(db, enrollment_adapter, call), lambda call: enrollment_core(db, call)
+        )
+    await engine.dispose()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--classes", type=int, default=500)
+    parser.add_argument("--class-size", type=int, default=40)
+    parser.add_argument("--batch", type=int, default=20)
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.database_url is None:
+        path = os.path.join(tempfile.mkdtemp(), "bench.db")
+        args.database_url = f"sqlite+aiosqlite:///{path}"
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
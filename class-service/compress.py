@@ -0,0 +1,237 @@
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.exceptions import HTTPException
+from typing import Optional
+import asyncio
+import json
+import os
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# CONFIG
+COMPRESS_ENABLED = os.getenv("COMPRESS_ENABLED", "1") == "1"
+# Smaller responses are sent as-is: the header overhead is not worth it
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+COMPRESS_ZSTD_LEVEL = int(os.getenv("COMPRESS_ZSTD_LEVEL", "3"))
+# Bodies at least this big are compressed off the event loop
+COMPRESS_THREAD_MIN_SIZE = int(os.getenv("COMPRESS_THREAD_MIN_SIZE", str(256 * 1024)))
+# Cap on a decompressed request body; past it the request gets 413
+MAX_DECOMPRESSED_BODY = int(os.getenv("MAX_DECOMPRESSED_BODY", str(32 * 1024 * 1024)))
+DECOMPRESS_CHUNK = 64 * 1024
+
+# Best first; zstd needs the zstandard package
+CODINGS = ("zstd", "gzip") if zstandard is not None else ("gzip",)
+DECODE_ERRORS = (zlib.error, zstandard.ZstdError) if zstandard is not None else (zlib.error,)
+
+# Already compressed, or streamed event by event
+SKIP_CONTENT_TYPES = ("text/event-stream", "application/gzip", "application/zstd", "application/zip")
+
+def choose_coding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Best coding in CODINGS the Accept-Encoding header allows, or None for identity."""
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding.strip().lower()] = q
+    for coding in CODINGS:
+        if accepted.get(coding, accepted.get("*", 0.0)) > 0:
+            return coding
+    return None
+
+# ---------- CODECS ----------
+class Compressor:
+    """Incremental compressor; every chunk but the last is flushed so streams stay live."""
+
+    def __init__(self, coding: str):
+        if coding == "zstd":
+            self._obj = zstandard.ZstdCompressor(level=COMPRESS_ZSTD_LEVEL).compressobj()
+            self._sync = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        else:
+            self._obj = zlib.compressobj(COMPRESS_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            self._sync = zlib.Z_SYNC_FLUSH
+
+    def compress(self, data: bytes, final: bool) -> bytes:
+        out = self._obj.compress(data)
+        return out + (self._obj.flush() if final else self._obj.flush(self._sync))
+
+class _Sink:
+    """Write target for zstandard's stream_writer that refuses to grow past limit."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.total = 0
+        self.chunks = []
+
+    def write(self, data: bytes) -> int:
+        self.total += len(data)
+        if self.total > self.limit:
+            raise HTTPException(status_code=413, detail="Decompressed body too large")
+        self.chunks.append(data)
+        return len(data)
+
+    def take(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+class Decompressor:
+    """
+    Incremental decompressor for request bodies. Output is produced chunk by
+    chunk as input arrives and never grows past limit, so a small body
+    inflating to gigabytes is refused instead of buffered.
+    """
+
+    def __init__(self, coding: str, limit: int = MAX_DECOMPRESSED_BODY):
+        self.coding = coding
+        self.remaining = limit
+        if coding == "zstd":
+            self._sink = _Sink(limit)
+            self._obj = zstandard.ZstdDecompressor().stream_writer(
+                self._sink, write_size=DECOMPRESS_CHUNK, closefd=False
+            )
+        else:
+            self._obj = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def decompress(self, data: bytes) -> bytes:
+        try:
+            if self.coding == "zstd":
+                self._obj.write(data)
+                return self._sink.take()
+            out = self._obj.decompress(data, self.remaining + 1)
+        except DECODE_ERRORS as e:
+            raise HTTPException(status_code=400, detail=f"Invalid {self.coding} body: {e}")
+        self.remaining -= len(out)
+        if self.remaining < 0 or self._obj.unconsumed_tail:
+            raise HTTPException(status_code=413, detail="Decompressed body too large")
+        return out
+
+    def finish(self):
+        if self.coding == "gzip" and not self._obj.eof:
+            raise HTTPException(status_code=400, detail="Truncated gzip body")
+
+# ---------- ASGI ----------
+class Compression:
+    """
+    ASGI middleware for both directions. Responses of COMPRESS_MIN_SIZE bytes
+    or more are compressed with the best coding the client accepts (zstd,
+    then gzip); streamed responses are compressed chunk by chunk. Request
+    bodies sent with Content-Encoding are decompressed as they are received,
+    so handlers and request models see plain JSON or MessagePack.
+    Responses the app already encoded pass through untouched.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESS_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not COMPRESS_ENABLED:
+            return await self.app(scope, receive, send)
+
+        headers = Headers(scope=scope)
+        content_encoding = headers.get("content-encoding", "identity").strip().lower()
+        if content_encoding != "identity":
+            if content_encoding not in CODINGS:
+                return await self.reject(send, 415, f"Unsupported Content-Encoding: {content_encoding}")
+            scope = dict(scope, headers=[
+                (name, value) for name, value in scope["headers"]
+                if name not in (b"content-encoding", b"content-length")
+            ])
+            receive = self.decompressing(receive, Decompressor(content_encoding))
+
+        coding = choose_coding(headers.get("accept-encoding"))
+        if coding is None:
+            return await self.app(scope, receive, send)
+        await self.app(scope, receive, CompressingSend(send, coding, self.minimum_size))
+
+    def decompressing(self, receive, decompressor: Decompressor):
+        async def receive_plain():
+            message = await receive()
+            if message["type"] == "http.request":
+                body = decompressor.decompress(message.get("body", b""))
+                if not message.get("more_body", False):
+                    decompressor.finish()
+                message = dict(message, body=body)
+            return message
+        return receive_plain
+
+    async def reject(self, send, status: int, detail: str):
+        body = json.dumps({"detail": detail}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode())
+            ]
+        })
+        await send({"type": "http.response.body", "body": body})
+
+class CompressingSend:
+    """send() wrapper holding back the response start until the first body chunk decides."""
+
+    def __init__(self, send, coding: str, minimum_size: int):
+        self.send = send
+        self.coding = coding
+        self.minimum_size = minimum_size
+        self.start = None
+        self.compressor = None
+        self.passthrough = False
+
+    async def __call__(self, message):
+        if message["type"] == "http.response.start":
+            headers = Headers(raw=message["headers"])
+            media_type = headers.get("content-type", "").partition(";")[0].strip().lower()
+            self.passthrough = (
+                "content-encoding" in headers
+                or message["status"] in (204, 206, 304)
+                or media_type in SKIP_CONTENT_TYPES
+            )
+            if self.passthrough:
+                return await self.send(message)
+            self.start = message
+            return
+
+        if message["type"] != "http.response.body" or self.passthrough:
+            return await self.send(message)
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.start is not None:
+            start, self.start = self.start, None
+            if not more_body and len(body) < self.minimum_size:
+                self.passthrough = True
+                await self.send(start)
+                return await self.send(message)
+
+            headers = MutableHeaders(raw=start["headers"])
+            headers.add_vary_header("Accept-Encoding")
+            headers["Content-Encoding"] = self.coding
+            del headers["Content-Length"]
+            self.compressor = Compressor(self.coding)
+            body = await self.compress(body, final=not more_body)
+            if not more_body:
+                headers["Content-Length"] = str(len(body))
+            await self.send(start)
+        else:
+            body = await self.compress(body, final=not more_body)
+        await self.send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+    async def compress(self, body: bytes, final: bool) -> bytes:
+        if len(body) >= COMPRESS_THREAD_MIN_SIZE:
+            # Large lists would otherwise stall every other request on this loop
+            return await asyncio.to_thread(self.compressor.compress, body, final)
+        return self.compressor.compress(body, final)
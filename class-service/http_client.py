@@ -0,0 +1,132 @@
+from collections import OrderedDict
+import gzip
+import httpx
+import os
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+# CONFIG
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "10.0"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+# Bodies kept for conditional GETs (0 disables)
+HTTP_ETAG_CACHE_ENTRIES = int(os.getenv("HTTP_ETAG_CACHE_ENTRIES", "1000"))
+# Request bodies at least this big are sent gzip-compressed (0 disables);
+# services decompress them in compress.py. Responses are negotiated by httpx
+HTTP_COMPRESS_MIN_SIZE = int(os.getenv("HTTP_COMPRESS_MIN_SIZE", "1024"))
+
+# One pooled client per process, so inter-service calls reuse keep-alive
+# connections instead of paying a TCP handshake per request
+_client = None
+
+# Base URL -> transport; monolith mode routes sibling services in-process
+_mounts = {}
+
+# Headers that describe the bytes on the wire, not the decoded body we keep
+WIRE_HEADERS = {"content-encoding", "content-length", "transfer-encoding"}
+
+MSGPACK = "application/msgpack"
+
+class ConditionalClient(httpx.AsyncClient):
+    """
+    AsyncClient that remembers GET responses carrying an ETag, keyed by URL,
+    Authorization and Accept, and revalidates them with If-None-Match. A 304
+    is handed to the caller as the cached 200, so call sites need no changes.
+
+    Callers that accept MessagePack (wire.py) also get their json= body sent
+    as MessagePack; the key for coalescing stays the json= payload. Large
+    bodies are gzipped on the way out.
+    """
+
+    def __init__(self, *args, cache_entries: int = HTTP_ETAG_CACHE_ENTRIES, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache_entries = cache_entries
+        self.etag_cache = OrderedDict()
+        self.revalidated = 0
+
+    def build_request(self, method: str, url, **kwargs) -> httpx.Request:
+        body = kwargs.get("json")
+        if body is not None and msgspec is not None:
+            headers = httpx.Headers(kwargs.get("headers"))
+            if MSGPACK in headers.get("accept", ""):
+                headers["Content-Type"] = MSGPACK
+                kwargs["headers"] = headers
+                kwargs["content"] = msgspec.msgpack.encode(kwargs.pop("json"))
+        request = super().build_request(method, url, **kwargs)
+
+        # Only bodies already in memory; streamed uploads go out as they are
+        if (
+            HTTP_COMPRESS_MIN_SIZE
+            and isinstance(request.stream, httpx.ByteStream)
+            and "content-encoding" not in request.headers
+            and len(request.content) >= HTTP_COMPRESS_MIN_SIZE
+        ):
+            headers = request.headers.copy()
+            headers["Content-Encoding"] = "gzip"
+            del headers["Content-Length"]
+            request = httpx.Request(
+                request.method, request.url,
+                headers=headers,
+                content=gzip.compress(request.content, compresslevel=6, mtime=0),
+                extensions=request.extensions
+            )
+        return request
+
+    async def send(self, request: httpx.Request, **kwargs) -> httpx.Response:
+        # Callers managing their own validators are left alone
+        if request.method != "GET" or not self.cache_entries or "if-none-match" in request.headers:
+            return await super().send(request, **kwargs)
+
+        key = (str(request.url), request.headers.get("authorization"), request.headers.get("accept"))
+        cached = self.etag_cache.get(key)
+        if cached is not None:
+            request.headers["If-None-Match"] = cached[0]
+
+        response = await super().send(request, **kwargs)
+
+        if response.status_code == 304 and cached is not None:
+            await response.aclose()
+            self.etag_cache.move_to_end(key)
+            self.revalidated += 1
+            return httpx.Response(200, headers=cached[1], content=cached[2], request=request)
+
+        etag = response.headers.get("etag")
+        if response.status_code == 200 and etag:
+            content = await response.aread()
+            headers = [(k, v) for k, v in response.headers.items() if k.lower() not in WIRE_HEADERS]
+            self.etag_cache[key] = (etag, headers, content)
+            self.etag_cache.move_to_end(key)
+            while len(self.etag_cache) > self.cache_entries:
+                self.etag_cache.popitem(last=False)
+        elif cached is not None and response.status_code < 500:
+            # Gone, forbidden or no longer tagged; an outage keeps the entry
+            del self.etag_cache[key]
+        return response
+
+def mount_transport(base_url: str, transport: httpx.AsyncBaseTransport):
+    """Send every request for base_url through transport. Call before the first request."""
+    global _client
+    _mounts[base_url.rstrip("/")] = transport
+    _client = None
+
+def get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = ConditionalClient(
+            timeout=HTTP_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE
+            ),
+            mounts=dict(_mounts)
+        )
+    return _client
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -1,21 +1,50 @@
-from fastapi import FastAPI, Depends, HTTPException, Header
+from fastapi import FastAPI, Depends, HTTPException, Header, Query, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from jose import jwt, JWTError
+from sqlalchemy import select, func
+from typing import Optional
 import os
 import httpx
 
-from db import SessionLocal, Class, ClassAttendee, init_db
+from db import router, Class, ClassAttendee, VALIDATE_CLASSES, VALIDATE_ENROLLMENT
+from migrate import check_schema
+from background import spawn, cancel_all
+from replica import ReadYourWrites
+from admission import AdmissionControl
+from tokens import verified_claims
+from compress import Compression
+from tracing import Tracing
+from querycount import QueryCounter
+from metrics import Instrumentation, register_collector, metrics_response, pool_metrics, admission_metrics, upstream_metrics
+from http_client import close_client
+from resilience import CircuitOpenError
+import resilience
+from outbox import (
+    record_changes,
+    notify_changes,
+    wait_for_changes,
+    serialize_change,
+    prune_changes_loop,
+    LONG_POLL_MAX
+)
+from versions import resource_etag, etag_matches, not_modified, cache_headers
+from fastjson import json_response, rows_to_dicts, fast_response
+from wire import WireRoute, accept_headers, decode
 from schemas import (
     CreateClassesRequest,
     CreateClassesResponse,
     GetClassResponse,
+    CLASS_FIELDS,
+    UpdateClassRequest,
+    ClassRosterResponse,
+    ROSTER_FIELDS,
     AddAttendeesRequest,
     ValidateAttendeeRequest,
     ValidateAttendeeResponse,
     ValidateClassExistenceRequest,
-    ValidateClassExistenceResponse
+    ValidateClassExistenceResponse,
+    ChangesResponse,
+    UpstreamValidation
 )
 
 JWT_SECRET = os.getenv("JWT_SECRET", "EfEmEitch123")
@@ -24,33 +53,91 @@ ATTENDEE_SERVICE_URL = os.getenv("ATTENDEE_SERVICE_URL", "http://18.214.134.23:8
 
 security = HTTPBearer()
 app = FastAPI()
+# Internal callers may speak MessagePack instead of JSON (wire.py)
+app.router.route_class = WireRoute
+app.add_middleware(
+    AdmissionControl,
+    secret=JWT_SECRET,
+    bulk=["POST /classes/create", "POST /classes/add-attendees", "GET /classes"]
+)
+app.add_middleware(ReadYourWrites, secret=JWT_SECRET)
+# Counts each request's queries and warns when they grow with its input
+app.add_middleware(QueryCounter, service="class-service")
+# Counts and times every request, including any wait for admission
+app.add_middleware(Instrumentation)
+# Joins the caller's trace or samples a new one; spans cover calls and queries
+app.add_middleware(Tracing, service="class-service")
+# Outermost, so handlers see plain bodies and large responses leave compressed
+app.add_middleware(Compression)
 
 # ---------- DB ----------
+# Both follow the shard of the request's institution (shards.py)
 async def get_db():
-    async with SessionLocal() as session:
+    async with router.session() as session:
+        yield session
+
+async def get_read_db():
+    async with router.session(readonly=True) as session:
+        yield session
+
+async def get_feed_db(shard: Optional[str] = Query(None)):
+    # Every shard numbers its own changes; service consumers follow each one
+    # (see /internal/shards), admins read the shard holding their institution
+    async with router.session(shard=shard) as session:
         yield session
 
 @app.on_event("startup")
 async def startup():
-    await init_db()
+    # Schema changes are applied by migrate.py, not by pods
+    await check_schema()
+    spawn(prune_changes_loop())
+
+@app.on_event("shutdown")
+async def shutdown():
+    await cancel_all()
+    await close_client()
 
 # ---------- JWT ----------
 def get_institution_id(
+    request: Request,
     credentials: HTTPAuthorizationCredentials = Depends(security)
 ) -> str:
-    try:
-        payload = jwt.decode(
-            credentials.credentials,
-            JWT_SECRET,
-            algorithms=[JWT_ALGORITHM]
-        )
-        
-        if payload.get("role") != "admin":
-            raise HTTPException(status_code=403, detail="Admin access required")
-        
-        return payload["sub"]
-    except JWTError:
+    # Decoded once per request and shared with the middlewares (tokens.py)
+    payload = verified_claims(request.scope, JWT_SECRET, JWT_ALGORITHM)
+    if payload is None:
         raise HTTPException(status_code=401, detail="Invalid token")
+    if payload.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return payload["sub"]
+
+def get_change_scope(
+    request: Request,
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+) -> Optional[str]:
+    """
+    Admins, and service tokens acting for an institution, read that
+    institution's changes. Only sync workers (role "sync") read every one.
+    """
+    payload = verified_claims(request.scope, JWT_SECRET, JWT_ALGORITHM)
+    if payload is None:
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+    if payload.get("role") == "sync":
+        return None
+    if payload.get("role") not in ("admin", "service"):
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return payload["sub"]
+
+def require_service(
+    request: Request,
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """/internal/* reports expose topology and tenant placement: service and sync tokens only."""
+    payload = verified_claims(request.scope, JWT_SECRET, JWT_ALGORITHM)
+    if payload is None:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    if payload.get("role") not in ("service", "sync"):
+        raise HTTPException(status_code=403, detail="Service token required")
 
 def get_raw_token(credentials: HTTPAuthorizationCredentials = Depends(security)) -> str:
     return credentials.credentials
@@ -64,6 +151,7 @@ async def create_classes(
     institution_id: str = Depends(get_institution_id),
     db: AsyncSession = Depends(get_db)
 ):
+    created = []
     for item in data.classes:
         # Optional: Check for duplicate code within institution
         exists = await db.execute(
@@ -81,25 +169,108 @@ async def create_classes(
             name=item.name
         )
         db.add(new_class)
-    
+        created.append(new_class)
+
+    # Flush assigns the ids the change feed needs
+    await db.flush()
+    await record_changes(
+        db, institution_id, "class", "create",
+        [{"id": c.id, "code": c.code, "name": c.name} for c in created]
+    )
     await db.commit()
+    notify_changes()
     return CreateClassesResponse(message="successful")
 
 # 2. GET CLASSES
+# Conditional: If-None-Match gets a 304 from the version counter alone
 @app.get("/classes", response_model=list[GetClassResponse])
 async def get_classes(
+    institution_id: str = Depends(get_institution_id),
+    db: AsyncSession = Depends(get_read_db),
+    if_none_match: Optional[str] = Header(None)
+):
+    etag = await resource_etag(db, institution_id, "class")
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+
+    # Fast path: column tuples straight to JSON, no model per row (fastjson.py)
+    result = await db.execute(
+        select(Class.id, Class.code, Class.name).where(Class.institution_id == institution_id)
+    )
+    return json_response(rows_to_dicts(CLASS_FIELDS, result.all()), headers=cache_headers(etag))
+
+# 2b. RENAME CLASS
+# Published to the change feed so schedule-service refreshes its cached class_name
+@app.put("/classes/{class_id}", response_model=GetClassResponse)
+async def update_class(
+    class_id: str,
+    data: UpdateClassRequest,
     institution_id: str = Depends(get_institution_id),
     db: AsyncSession = Depends(get_db)
 ):
     result = await db.execute(
-        select(Class).where(Class.institution_id == institution_id)
+        select(Class).where(
+            Class.id == class_id,
+            Class.institution_id == institution_id
+        )
     )
-    classes = result.scalars().all()
-    
-    return [
-        GetClassResponse(id=c.id, code=c.code, name=c.name)
-        for c in classes
-    ]
+    class_obj = result.scalar_one_or_none()
+    if not class_obj:
+        raise HTTPException(status_code=404, detail="Class not found")
+
+    class_obj.name = data.name
+    await record_changes(
+        db, institution_id, "class", "update",
+        [{"id": class_obj.id, "code": class_obj.code, "name": class_obj.name}]
+    )
+    await db.commit()
+    notify_changes()
+    return GetClassResponse(id=class_obj.id, code=class_obj.code, name=class_obj.name)
+
+# 2c. CLASS ROSTER
+# Everyone enrolled in one class, so callers can check enrollment locally
+# Conditional: If-None-Match gets a 304 from the version counter alone
+# Internal: answers MessagePack to callers that accept it
+@app.get("/classes/{class_id}/roster", response_model=ClassRosterResponse)
+async def get_class_roster(
+    class_id: str,
+    institution_id: str = Depends(get_institution_id),
+    db: AsyncSession = Depends(get_read_db),
+    if_none_match: Optional[str] = Header(None),
+    accept: Optional[str] = Header(None)
+):
+    etag = await resource_etag(db, institution_id, "class", "class_attendee")
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+
+    result = await db.execute(
+        select(Class.id, Class.name).where(
+            Class.id == class_id,
+            Class.institution_id == institution_id
+        )
+    )
+    class_row = result.first()
+    if not class_row:
+        raise HTTPException(status_code=404, detail="Class not found")
+
+    # Fast path: column tuples straight to JSON, no model per row (fastjson.py)
+    result = await db.execute(
+        select(
+            ClassAttendee.attendee_code,
+            ClassAttendee.id,
+            # ISO text, so the fast path only carries str / None
+            func.to_char(ClassAttendee.created_at, 'YYYY-MM-DD"T"HH24:MI:SS')
+        ).where(
+            ClassAttendee.class_id == class_id,
+            ClassAttendee.institution_id == institution_id
+        )
+    )
+    content = {
+        "class_id": class_row.id,
+        "class_name": class_row.name,
+        "attendees": rows_to_dicts(ROSTER_FIELDS, result.all())
+    }
+    return fast_response(content, accept, headers=cache_headers(etag))
 
 # 3. ADD ATTENDEES TO CLASS
 @app.post("/classes/add-attendees")
@@ -127,24 +298,33 @@ async def add_attendees(
         "attendees": [{"code": code} for code in attendee_codes]
     }
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(
-                f"{ATTENDEE_SERVICE_URL}/attendees/validate-existence",
-                json=validation_payload,
-                headers={"Authorization": f"Bearer {token}"}
-            )
-            response.raise_for_status()
-            validation_data = response.json()
-        except httpx.RequestError:
-             raise HTTPException(status_code=503, detail="Attendee service unavailable")
-        except httpx.HTTPStatusError:
-             raise HTTPException(status_code=400, detail="Attendee validation failed")
-
-    if not validation_data.get("valid"):
+    try:
+        response = await resilience.call(
+            "attendee-service", "POST",
+            f"{ATTENDEE_SERVICE_URL}/attendees/validate-existence",
+            idempotent=True,
+            json=validation_payload,
+            headers={"Authorization": f"Bearer {token}", **accept_headers()}
+        )
+    except (httpx.HTTPError, CircuitOpenError):
+         raise HTTPException(status_code=503, detail="Attendee service unavailable")
+
+    # A 429 means attendee-service is busy, not that the codes are wrong
+    if response.status_code >= 500 or response.status_code == 429:
+        retry_after = response.headers.get("retry-after")
+        raise HTTPException(
+            status_code=503, detail="Attendee service unavailable",
+            headers={"Retry-After": retry_after} if retry_after else None
+        )
+    if response.status_code != 200:
+        raise HTTPException(status_code=400, detail="Attendee validation failed")
+    validation_data = decode(response, UpstreamValidation)
+
+    if not validation_data.valid:
         raise HTTPException(status_code=400, detail="One or more attendees invalid")
 
     # C. Add to Database
+    links = []
     for code in attendee_codes:
         # Check if already in class
         exists = await db.execute(
@@ -160,67 +340,113 @@ async def add_attendees(
                 attendee_code=code
             )
             db.add(link)
+            links.append(link)
 
+    await db.flush()
+    await record_changes(
+        db, institution_id, "class_attendee", "create",
+        [{"id": l.id, "class_id": l.class_id, "attendee_code": l.attendee_code} for l in links]
+    )
     await db.commit()
+    notify_changes()
     return {"message": "successful"}
 
 # 4. VALIDATE ATTENDEE IN CLASS
+# Internal: answers MessagePack to callers that accept it
 @app.post("/classes/validate-attendee", response_model=ValidateAttendeeResponse)
 async def validate_attendee(
     data: ValidateAttendeeRequest,
     institution_id: str = Depends(get_institution_id),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db),
+    accept: Optional[str] = Header(None)
 ):
-    # Join ClassAttendee with Class to get the class name
-    result = await db.execute(
-        select(ClassAttendee, Class)
-        .join(Class, ClassAttendee.class_id == Class.id)
-        .where(
-            ClassAttendee.class_id == data.class_id,
-            ClassAttendee.attendee_code == data.attendee_code,
-            ClassAttendee.institution_id == institution_id
-        )
-    )
+    # Lean path: prebuilt Core select joining in the class name, the row
+    # straight to response bytes
+    return fast_response(await find_enrollment(db, institution_id, data.class_id, data.attendee_code), accept)
+
+async def find_enrollment(db: AsyncSession, institution_id: str, class_id: str, attendee_code: str) -> dict:
+    result = await db.execute(VALIDATE_ENROLLMENT, {
+        "class_id": class_id,
+        "attendee_code": attendee_code,
+        "institution_id": institution_id
+    })
     row = result.first()
     
     if not row:
-        return ValidateAttendeeResponse(valid=False)
+        return {"valid": False, "class_attendee_id": None, "class_name": None}
     
-    class_attendee, class_obj = row
-    
-    return ValidateAttendeeResponse(
-        valid=True,
-        class_attendee_id=class_attendee.id,
-        class_name=class_obj.name
-    )
+    class_attendee_id, class_name = row
+    return {"valid": True, "class_attendee_id": class_attendee_id, "class_name": class_name}
+
+async def check_enrollment(institution_id: str, class_id: str, attendee_code: str) -> dict:
+    """validate-attendee for callers in this process (monolith mode): the same answer, no HTTP."""
+    async with router.session(institution_id, readonly=True) as db:
+        return await find_enrollment(db, institution_id, class_id, attendee_code)
 
 # 5. VALIDATE CLASS EXISTENCE
+# Internal: answers MessagePack to callers that accept it
 @app.post("/classes/validate-existence", response_model=ValidateClassExistenceResponse)
 async def validate_class_existence(
     data: ValidateClassExistenceRequest,
     institution_id: str = Depends(get_institution_id),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db),
+    accept: Optional[str] = Header(None)
 ):
     ids = [item.id for item in data.classes]
     
     if not ids:
-        return ValidateClassExistenceResponse(valid=True, classes=[])
+        return fast_response({"valid": True, "classes": []}, accept)
         
-    result = await db.execute(
-        select(Class).where(
-            Class.institution_id == institution_id,
-            Class.id.in_(ids)
-        )
-    )
-    found = result.scalars().all()
+    # Lean path: prebuilt Core select, rows straight to response bytes
+    result = await db.execute(VALIDATE_CLASSES, {"institution_id": institution_id, "ids": ids})
+    found = result.all()
     
     if len(found) != len(set(ids)):
-        return ValidateClassExistenceResponse(valid=False)
+        return fast_response({"valid": False, "classes": []}, accept)
         
-    return ValidateClassExistenceResponse(
-        valid=True,
-        classes=[
-            {"id": c.id, "name": c.name}
-            for c in found
-        ]
+    return fast_response({"valid": True, "classes": rows_to_dicts(("id", "name"), found)}, accept)
+
+# 6. CHANGE FEED
+# Incremental sync for consumers caching classes and enrollments: pass the last
+# cursor as since, and wait > 0 to long-poll until something changes.
+@app.get("/changes", response_model=ChangesResponse)
+async def get_changes(
+    since: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    wait: float = Query(0, ge=0, le=LONG_POLL_MAX),
+    institution_id: Optional[str] = Depends(get_change_scope),
+    db: AsyncSession = Depends(get_feed_db)
+):
+    changes = await wait_for_changes(db, institution_id, since, limit, wait)
+    return ChangesResponse(
+        changes=[serialize_change(c) for c in changes],
+        cursor=changes[-1].txid if changes else since
     )
+
+# 7. UPSTREAM HEALTH
+# Circuit breaker state and call statistics per downstream service
+@app.get("/internal/upstreams", dependencies=[Depends(require_service)])
+async def get_upstreams():
+    return resilience.snapshot()
+
+# 8. DB POOL
+# Checkout wait and saturation of this process's connection pools, per shard
+@app.get("/internal/pool", dependencies=[Depends(require_service)])
+async def get_pool():
+    return router.stats()
+
+# 9. SHARDS
+# Shard names for consumers of the change feed, and where placements live
+@app.get("/internal/shards", dependencies=[Depends(require_service)])
+async def get_shards():
+    return {"shards": list(router.shards), "directory": router.directory.name}
+
+# 10. METRICS
+# Prometheus text format, per process; the /internal/* reports as time series
+register_collector(pool_metrics(router.stats))
+register_collector(admission_metrics)
+register_collector(upstream_metrics(resilience.snapshot))
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return metrics_response()
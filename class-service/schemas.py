@@ -1,5 +1,7 @@
 from pydantic import BaseModel
+import msgspec
 from typing import List, Optional
+from datetime import datetime
 
 # ---------- CREATE CLASSES ----------
 class ClassCreateItem(BaseModel):
@@ -19,6 +21,26 @@ class GetClassResponse(BaseModel):
     code: str
     name: str
 
+# Key order of fast-path rows (fastjson.py)
+CLASS_FIELDS = tuple(GetClassResponse.model_fields)
+
+class UpdateClassRequest(BaseModel):
+    name: str
+
+
+# ---------- ROSTER ----------
+class RosterItem(BaseModel):
+    attendee_code: str
+    class_attendee_id: str
+    enrolled_at: Optional[datetime] = None
+
+ROSTER_FIELDS = tuple(RosterItem.model_fields)
+
+class ClassRosterResponse(BaseModel):
+    class_id: str
+    class_name: str
+    attendees: List[RosterItem]
+
 
 # ---------- ADD ATTENDEES ----------
 class AddAttendeesRequest(BaseModel):
@@ -47,3 +69,23 @@ class ValidateClassExistenceRequest(BaseModel):
 class ValidateClassExistenceResponse(BaseModel):
     valid: bool
     classes: List[dict] = []
+
+
+# ---------- CHANGE FEED ----------
+class ChangeItem(BaseModel):
+    seq: int
+    institution_id: str
+    entity: str
+    entity_id: str
+    op: str
+    data: dict
+    created_at: datetime
+
+class ChangesResponse(BaseModel):
+    changes: List[ChangeItem]
+    cursor: int
+
+# ---------- UPSTREAM ANSWERS ----------
+# Decoded with wire.decode(); only the fields this service reads
+class UpstreamValidation(msgspec.Struct):
+    valid: bool
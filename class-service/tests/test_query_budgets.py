@@ -0,0 +1,56 @@
+import json
+import os
+import uuid
+
+import httpx
+import pytest
+
+from conftest import SERVICE, BUDGET_FILE, bearer
+
+pytestmark = pytest.mark.anyio
+
+ROUTES = ["POST /classes/create", "POST /classes/add-attendees"]
+
+def test_budgets_are_committed():
+    if os.getenv("QUERY_COUNT_MODE") == "record":
+        pytest.skip("recording")
+    with open(BUDGET_FILE) as f:
+        budgets = json.load(f)[SERVICE]
+    assert set(ROUTES) <= set(budgets)
+
+@pytest.fixture
+def attendee_service(service, monkeypatch):
+    """attendee-service stand-in that knows every attendee code."""
+    import http_client
+
+    monkeypatch.setattr(http_client, "_mounts", {})
+    monkeypatch.setattr(http_client, "_client", None)
+    http_client.mount_transport(
+        service.ATTENDEE_SERVICE_URL,
+        httpx.MockTransport(lambda request: httpx.Response(200, json={"valid": True}))
+    )
+    yield
+    http_client._client = None
+
+async def create_classes(client, institution_id: str, count: int):
+    classes = [{"code": f"C{i}", "name": f"Class {i}"} for i in range(count)]
+    resp = await client.post("/classes/create", json={"classes": classes}, headers=bearer(institution_id))
+    assert resp.status_code == 200, resp.text
+
+@pytest.mark.parametrize("count", [1, 10])
+async def test_create_classes(client, count):
+    await create_classes(client, str(uuid.uuid4()), count)
+
+@pytest.mark.parametrize("count", [1, 10])
+async def test_add_attendees(client, attendee_service, count):
+    institution_id = str(uuid.uuid4())
+    await create_classes(client, institution_id, 1)
+    class_id = (await client.get("/classes", headers=bearer(institution_id))).json()[0]["id"]
+
+    attendees = [{"code": f"S{i}"} for i in range(count)]
+    resp = await client.post(
+        "/classes/add-attendees",
+        json={"class_id": class_id, "attendees": attendees},
+        headers=bearer(institution_id)
+    )
+    assert resp.status_code == 200, resp.text
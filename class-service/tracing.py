@@ -0,0 +1,294 @@
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import event
+import json
+import os
+import random
+import time
+
+# CONFIG
+# none, memory, file or log; set_exporter() installs any object with export(span)
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "none")
+# Share of requests arriving without a trace that start one. A caller's
+# decision (the traceparent sampled flag) is always kept, so a trace is
+# recorded by every service on its path or by none
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+TRACE_MEMORY_SPANS = int(os.getenv("TRACE_MEMORY_SPANS", "10000"))
+# Longer SQL is cut short in db spans; bound values are never recorded
+TRACE_STATEMENT_MAX = 500
+
+# W3C Trace Context header, version 00
+TRACEPARENT = "traceparent"
+
+# Span of the work the current task is doing, if its request is traced
+_current = ContextVar("trace_span", default=None)
+
+# Set by the Tracing middleware wrapping this process's app
+service_name = "unknown"
+
+# ---------- SPANS ----------
+class Span:
+    """
+    One timed operation of a trace. Spans of sampled traces are recorded and
+    handed to the exporter when they end. Unsampled traces arriving from a
+    caller get one Span that is never recorded; it only carries the caller's
+    context on to the upstreams this request calls.
+    """
+
+    __slots__ = (
+        "trace_id", "span_id", "parent_id", "sampled", "recording",
+        "name", "kind", "attributes", "error", "start_time", "started", "duration"
+    )
+
+    def __init__(self, trace_id: str, parent_id, sampled: bool, name: str = "", kind: str = "internal", attributes: dict = None, span_id: str = None):
+        self.trace_id = trace_id
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.recording = sampled and exporter is not None
+        self.span_id = os.urandom(8).hex() if self.recording or span_id is None else span_id
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes or {}
+        self.error = None
+        self.start_time = time.time()
+        self.started = time.perf_counter()
+        self.duration = None
+
+    def set(self, key: str, value):
+        if self.recording:
+            self.attributes[key] = value
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def end(self):
+        if not self.recording or self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self.started
+        if exporter is None:
+            return
+        try:
+            exporter.export(self.to_dict())
+        except Exception as e:
+            # Losing a span must never fail the request it describes
+            print(f"Trace export error: {e}")
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "service": service_name,
+            "name": self.name,
+            "kind": self.kind,
+            "start_time": self.start_time,
+            "duration": self.duration,
+            "attributes": self.attributes,
+            "error": self.error
+        }
+
+def current():
+    """Span of the current request, or None when it is not traced."""
+    return _current.get()
+
+def child(name: str, kind: str = "internal", attributes: dict = None):
+    """New recording span under the current one, or None when it is not recorded."""
+    parent = _current.get()
+    if parent is None or not parent.recording:
+        return None
+    return Span(parent.trace_id, parent.span_id, True, name, kind, attributes)
+
+@contextmanager
+def span(name: str, kind: str = "internal", attributes: dict = None):
+    """
+    Time the block as a child of the current span; spans started inside it
+    (HTTP hops, queries) become its children. Yields NOOP when the request is
+    not recorded, at the cost of one context variable lookup.
+    """
+    new = child(name, kind, attributes)
+    if new is None:
+        yield NOOP
+        return
+
+    token = _current.set(new)
+    try:
+        yield new
+    except BaseException as e:
+        new.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current.reset(token)
+        new.end()
+
+def inject(headers: dict = None) -> dict:
+    """headers plus the traceparent continuing the current trace, if any."""
+    current_span = _current.get()
+    if current_span is None:
+        return headers
+    headers = dict(headers or {})
+    headers[TRACEPARENT] = current_span.traceparent()
+    return headers
+
+def parse_traceparent(value: str):
+    """(trace_id, parent_id, sampled) from a traceparent header, or None if it is malformed."""
+    parts = value.strip().lower().split("-")
+    if len(parts) < 4 or len(parts[0]) != 2 or parts[0] == "ff":
+        return None
+    version, trace_id, parent_id, flags = parts[:4]
+    if len(trace_id) != 32 or len(parent_id) != 16 or len(flags) != 2:
+        return None
+    try:
+        int(trace_id, 16), int(parent_id, 16)
+        sampled = bool(int(flags, 16) & 1)
+    except ValueError:
+        return None
+    if trace_id == "0" * 32 or parent_id == "0" * 16:
+        return None
+    return trace_id, parent_id, sampled
+
+# ---------- EXPORTERS ----------
+class MemoryExporter:
+    """Keeps the last TRACE_MEMORY_SPANS spans in this process, for tests and debugging."""
+
+    def __init__(self, limit: int = TRACE_MEMORY_SPANS):
+        self.spans = deque(maxlen=limit)
+
+    def export(self, span: dict):
+        self.spans.append(span)
+
+    def trace(self, trace_id: str) -> list:
+        """Spans of one trace recorded here, in start order."""
+        return sorted((s for s in self.spans if s["trace_id"] == trace_id), key=lambda s: s["start_time"])
+
+    def clear(self):
+        self.spans.clear()
+
+class FileExporter:
+    """
+    Appends spans as JSON lines. Line-buffered, so several processes (or all
+    services in monolith mode) can share one file and a trace reads whole.
+    """
+
+    def __init__(self, path: str = TRACE_FILE):
+        self.path = path
+        self.file = open(path, "a", buffering=1)
+
+    def export(self, span: dict):
+        self.file.write(json.dumps(span, separators=(",", ":")) + "\n")
+
+class LogExporter:
+    """Prints spans as JSON lines next to the service's other output."""
+
+    def export(self, span: dict):
+        print(json.dumps(span, separators=(",", ":")))
+
+EXPORTERS = {"memory": MemoryExporter, "file": FileExporter, "log": LogExporter}
+
+exporter = EXPORTERS[TRACE_EXPORTER]() if TRACE_EXPORTER in EXPORTERS else None
+
+# Stands in for the span when nothing is traced, so call sites need no checks
+NOOP = Span("0" * 32, None, False, span_id="0" * 16)
+
+def set_exporter(new_exporter):
+    """Send spans ended from now on to new_exporter (None stops recording)."""
+    global exporter
+    exporter = new_exporter
+
+# ---------- DB ----------
+def trace_queries(engine):
+    """Record a span for each statement run on engine while a recorded request is current."""
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def before(conn, cursor, statement, parameters, context, executemany):
+        query = child("db.query", "client")
+        if query is not None:
+            query.attributes = {
+                "db.name": conn.engine.url.database,
+                "db.statement": statement[:TRACE_STATEMENT_MAX],
+                "db.executemany": executemany
+            }
+            context._trace_span = query
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def after(conn, cursor, statement, parameters, context, executemany):
+        query = getattr(context, "_trace_span", None)
+        if query is not None:
+            query.end()
+
+    @event.listens_for(engine.sync_engine, "handle_error")
+    def failed(exception_context):
+        query = getattr(exception_context.execution_context, "_trace_span", None)
+        if query is not None:
+            query.error = f"{type(exception_context.original_exception).__name__}: {exception_context.original_exception}"
+            query.end()
+
+# ---------- ASGI ----------
+class Tracing:
+    """
+    ASGI middleware opening the server span of each HTTP request. It joins
+    the caller's trace from the traceparent header, or starts one for
+    TRACE_SAMPLE_RATE of the requests that arrive without it. Calls through
+    resilience.call() and queries made while handling the request become
+    its children. Untraced requests cost a header scan and nothing else.
+    Add it inside Compression, like Instrumentation, so the route is known.
+    """
+
+    def __init__(self, app, service: str):
+        global service_name
+        service_name = service
+        self.app = app
+
+    def start(self, scope):
+        for name, value in scope.get("headers", ()):
+            if name == b"traceparent":
+                parsed = parse_traceparent(value.decode("latin-1"))
+                if parsed is not None:
+                    trace_id, parent_id, sampled = parsed
+                    # Unsampled: pass the caller's context on unchanged
+                    return Span(trace_id, parent_id, sampled, kind="server", span_id=parent_id)
+                break
+        if exporter is not None and TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE:
+            return Span(os.urandom(16).hex(), None, True, kind="server")
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        server = self.start(scope)
+        if server is None:
+            return await self.app(scope, receive, send)
+
+        token = _current.set(server)
+        if not server.recording:
+            try:
+                return await self.app(scope, receive, send)
+            finally:
+                _current.reset(token)
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        except BaseException as e:
+            server.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current.reset(token)
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            server.name = f"{scope['method']} {route}"
+            server.attributes.update({
+                "http.method": scope["method"],
+                "http.route": route,
+                "http.target": scope["path"],
+                "http.status_code": status
+            })
+            server.end()
@@ -0,0 +1,57 @@
+from fastapi import Response
+from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy import BigInteger, String, select
+from sqlalchemy.dialects.postgresql import insert
+from typing import Optional
+
+from db import Base
+
+class ResourceVersion(Base):
+    """Per-institution counter of one resource (entity), bumped by every write to it."""
+    __tablename__ = "resource_versions"
+
+    institution_id: Mapped[str] = mapped_column(String, primary_key=True)
+    resource: Mapped[str] = mapped_column(String, primary_key=True)
+    version: Mapped[int] = mapped_column(BigInteger, nullable=False)
+
+# ---------- WRITE ----------
+async def bump_versions(db, institution_id: str, *resources: str):
+    """Add the bump to the caller's transaction, so it commits with the write."""
+    stmt = insert(ResourceVersion).values([
+        {"institution_id": institution_id, "resource": resource, "version": 1}
+        for resource in resources
+    ])
+    await db.execute(stmt.on_conflict_do_update(
+        index_elements=[ResourceVersion.institution_id, ResourceVersion.resource],
+        set_={"version": ResourceVersion.version + 1}
+    ))
+
+# ---------- CONDITIONAL GET ----------
+async def resource_etag(db, institution_id: str, *resources: str) -> str:
+    """
+    ETag of a list built from resources: one primary-key read instead of
+    the rows. Read it in the same session as the rows, before them, so a
+    write in between can only make the tag stale, never the body.
+    """
+    result = await db.execute(
+        select(ResourceVersion.resource, ResourceVersion.version).where(
+            ResourceVersion.institution_id == institution_id,
+            ResourceVersion.resource.in_(resources)
+        )
+    )
+    versions = dict(result.all())
+    return '"' + ".".join(f"{resource}-{versions.get(resource, 0)}" for resource in resources) + '"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+def cache_headers(etag: str) -> dict:
+    # Clients may keep the body but must revalidate before reusing it; internal
+    # callers may hold it as JSON and as MessagePack (wire.py)
+    return {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Accept"}
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers=cache_headers(etag))
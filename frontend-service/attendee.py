@@ -1,9 +1,10 @@
 from fastapi import APIRouter, Request, Form, Cookie
 from fastapi.responses import RedirectResponse
 from fastapi.templating import Jinja2Templates
-import httpx
 import os
 
+from http_client import get_client
+
 ATTENDEE_SERVICE_URL = os.getenv("ATTENDEE_SERVICE_URL", "http://18.214.134.23:8000")
 
 router = APIRouter()
@@ -22,14 +23,14 @@ async def attendees_page(request: Request, jwt_token: str = Cookie(None)):
     error = None
     
     try:
-        async with httpx.AsyncClient() as client:
-            res = await client.get(
-                f"{ATTENDEE_SERVICE_URL}/attendees",
-                headers={"Authorization": f"Bearer {jwt_token}"}
-            )
+        client = get_client()
+        res = await client.get(
+            f"{ATTENDEE_SERVICE_URL}/attendees",
+            headers={"Authorization": f"Bearer {jwt_token}"}
+        )
             
-            if res.status_code == 200:
-                attendees = res.json()
+        if res.status_code == 200:
+            attendees = res.json()
     except Exception as e:
         error = "Gagal mengambil data attendee"
     
@@ -67,23 +68,23 @@ async def create_attendee_submit(
         return RedirectResponse(url="/login", status_code=302)
     
     try:
-        async with httpx.AsyncClient() as client:
-            res = await client.post(
-                f"{ATTENDEE_SERVICE_URL}/attendees",
-                headers={"Authorization": f"Bearer {jwt_token}"},
-                json={"attendees": [{"code": code, "name": name}]}
-            )
+        client = get_client()
+        res = await client.post(
+            f"{ATTENDEE_SERVICE_URL}/attendees",
+            headers={"Authorization": f"Bearer {jwt_token}"},
+            json={"attendees": [{"code": code, "name": name}]}
+        )
             
-            if res.status_code != 200:
-                return RedirectResponse(url="/attendees/create?error=1", status_code=302)
+        if res.status_code != 200:
+            return RedirectResponse(url="/attendees/create?error=1", status_code=302)
             
-            data = res.json()
-            result = data[0]
-            secret = result.get("secret")
+        data = res.json()
+        result = data[0]
+        secret = result.get("secret")
             
-            return RedirectResponse(
-                url=f"/attendees?secret_code={code}&secret_value={secret}",
-                status_code=302
-            )
+        return RedirectResponse(
+            url=f"/attendees?secret_code={code}&secret_value={secret}",
+            status_code=302
+        )
     except Exception:
         return RedirectResponse(url="/attendees/create?error=1", status_code=302)
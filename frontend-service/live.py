@@ -0,0 +1,150 @@
+from fastapi import APIRouter, Request, Cookie
+from fastapi.responses import RedirectResponse, StreamingResponse
+from fastapi.templating import Jinja2Templates
+import asyncio
+import httpx
+import json
+import os
+
+# No production IP is published for attendance-service yet; deployments set
+# ATTENDANCE_SERVICE_URL to its LoadBalancer address
+ATTENDANCE_SERVICE_URL = os.getenv("ATTENDANCE_SERVICE_URL", "http://127.0.0.1:8000")
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+SUBSCRIBER_QUEUE_SIZE = 200
+
+router = APIRouter()
+templates = Jinja2Templates(directory="templates")
+
+def check_auth(jwt_token: str = None):
+    """Check if user is authenticated"""
+    return jwt_token is not None
+
+# ---------- FAN-OUT HUB ----------
+class LiveHub:
+    """
+    Holds one upstream SSE subscription to attendance-service per token and
+    fans its events out to every open browser tab. Tokens are deterministic
+    per institution, so all tabs of an institution share one upstream. The
+    upstream is opened by the first tab and closed after the last one leaves.
+    """
+
+    def __init__(self):
+        self.subscribers = {}
+        self.upstreams = {}
+
+    def subscribe(self, token: str, room_id: str = None, schedule_id: str = None) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.subscribers.setdefault(token, {})[queue] = (room_id, schedule_id)
+        if token not in self.upstreams:
+            self.upstreams[token] = asyncio.create_task(self.run_upstream(token))
+        return queue
+
+    def unsubscribe(self, token: str, queue: asyncio.Queue):
+        queues = self.subscribers.get(token)
+        if queues is None:
+            return
+        queues.pop(queue, None)
+        if not queues:
+            del self.subscribers[token]
+            upstream = self.upstreams.pop(token, None)
+            if upstream:
+                upstream.cancel()
+
+    def dispatch(self, token: str, message: dict):
+        for queue, (room_id, schedule_id) in list(self.subscribers.get(token, {}).items()):
+            event = message.get("data")
+            if event is not None:
+                if room_id and event.get("room_id") != room_id:
+                    continue
+                if schedule_id and event.get("schedule_id") != schedule_id:
+                    continue
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # A stalled tab drops events instead of holding up the others
+                pass
+
+    async def run_upstream(self, token: str):
+        try:
+            await self.consume_upstream(token)
+        finally:
+            if self.upstreams.get(token) is asyncio.current_task():
+                del self.upstreams[token]
+
+    async def consume_upstream(self, token: str):
+        delay = 1.0
+        async with httpx.AsyncClient(timeout=httpx.Timeout(10.0, read=None)) as client:
+            while token in self.subscribers:
+                try:
+                    async with client.stream(
+                        "GET",
+                        f"{ATTENDANCE_SERVICE_URL}/attendance/stream",
+                        headers={"Authorization": f"Bearer {token}"}
+                    ) as res:
+                        if res.status_code in (401, 403):
+                            self.dispatch(token, {"event": "error", "data": None})
+                            return
+                        res.raise_for_status()
+                        delay = 1.0
+                        async for line in res.aiter_lines():
+                            if line.startswith("data:"):
+                                self.dispatch(token, {"event": "presence", "data": json.loads(line[5:])})
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"Live upstream error: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30.0)
+
+hub = LiveHub()
+
+async def live_events(token: str, room_id: str = None, schedule_id: str = None):
+    queue = hub.subscribe(token, room_id, schedule_id)
+    try:
+        yield ": connected\n\n"
+        while True:
+            try:
+                message = await asyncio.wait_for(queue.get(), SSE_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": ping\n\n"
+                continue
+            if message["event"] == "error":
+                yield "event: error\ndata: {}\n\n"
+                return
+            yield f"event: presence\ndata: {json.dumps(message['data'])}\n\n"
+    finally:
+        hub.unsubscribe(token, queue)
+
+def event_stream(events):
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# ---------- ROUTES ----------
+@router.get("/rooms/{room_id}/live")
+def room_live_page(request: Request, room_id: str, jwt_token: str = Cookie(None)):
+    if not check_auth(jwt_token):
+        return RedirectResponse(url="/login", status_code=302)
+
+    return templates.TemplateResponse(
+        "live.html",
+        {
+            "request": request,
+            "title": request.query_params.get("name") or room_id,
+            "stream_url": f"/rooms/{room_id}/live/events"
+        }
+    )
+
+@router.get("/rooms/{room_id}/live/events")
+async def room_live_events(room_id: str, jwt_token: str = Cookie(None)):
+    if not check_auth(jwt_token):
+        return RedirectResponse(url="/login", status_code=302)
+    return event_stream(live_events(jwt_token, room_id=room_id))
+
+@router.get("/schedules/{schedule_id}/live/events")
+async def schedule_live_events(schedule_id: str, jwt_token: str = Cookie(None)):
+    if not check_auth(jwt_token):
+        return RedirectResponse(url="/login", status_code=302)
+    return event_stream(live_events(jwt_token, schedule_id=schedule_id))
@@ -5,6 +5,8 @@ from fastapi.templating import Jinja2Templates
 from auth import router as auth_router
 from attendee import router as attendee_router
 from room import router as room_router
+from live import router as live_router
+from http_client import close_client
 
 app = FastAPI()
 templates = Jinja2Templates(directory="templates")
@@ -13,6 +15,11 @@ templates = Jinja2Templates(directory="templates")
 app.include_router(auth_router)
 app.include_router(attendee_router)
 app.include_router(room_router)
+app.include_router(live_router)
+
+@app.on_event("shutdown")
+async def shutdown():
+    await close_client()
 
 def check_auth(jwt_token: str = None):
     """Check if user is authenticated"""
@@ -1,9 +1,10 @@
 from fastapi import APIRouter, Request, Form, Cookie
 from fastapi.responses import RedirectResponse
 from fastapi.templating import Jinja2Templates
-import httpx
 import os
 
+from http_client import get_client
+
 ROOM_SERVICE_URL = os.getenv("ROOM_SERVICE_URL", "http://54.162.202.203:8000")
 
 router = APIRouter()
@@ -22,14 +23,14 @@ async def rooms_page(request: Request, jwt_token: str = Cookie(None)):
     error = None
     
     try:
-        async with httpx.AsyncClient() as client:
-            res = await client.get(
-                f"{ROOM_SERVICE_URL}/rooms",
-                headers={"Authorization": f"Bearer {jwt_token}"}
-            )
+        client = get_client()
+        res = await client.get(
+            f"{ROOM_SERVICE_URL}/rooms",
+            headers={"Authorization": f"Bearer {jwt_token}"}
+        )
             
-            if res.status_code == 200:
-                rooms = res.json()
+        if res.status_code == 200:
+            rooms = res.json()
     except Exception as e:
         error = "Gagal mengambil data room"
     
@@ -66,19 +67,19 @@ async def create_room_submit(
         return RedirectResponse(url="/login", status_code=302)
     
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            res = await client.post(
-                f"{ROOM_SERVICE_URL}/rooms",
-                headers={"Authorization": f"Bearer {jwt_token}"},
-                json={"rooms": [{"name": name}]}
-            )
+        client = get_client()
+        res = await client.post(
+            f"{ROOM_SERVICE_URL}/rooms",
+            headers={"Authorization": f"Bearer {jwt_token}"},
+            json={"rooms": [{"name": name}]}
+        )
             
-            if res.status_code != 200:
-                return RedirectResponse(url="/rooms/create?error=1", status_code=302)
+        if res.status_code != 200:
+            return RedirectResponse(url="/rooms/create?error=1", status_code=302)
             
-            return RedirectResponse(
-                url=f"/rooms?success=1&room_name={name}",
-                status_code=302
-            )
+        return RedirectResponse(
+            url=f"/rooms?success=1&room_name={name}",
+            status_code=302
+        )
     except Exception as e:
         return RedirectResponse(url="/rooms/create?error=1", status_code=302)
@@ -0,0 +1,204 @@
+from collections import defaultdict
+from fnmatch import fnmatch
+import asyncio
+import json
+import os
+
+from tokens import verified_claims
+
+# CONFIG
+# Requests in flight per process, across all institutions
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "64"))
+# Share of that capacity each priority may use; critical always gets all of it
+ADMISSION_DEFAULT_SHARE = float(os.getenv("ADMISSION_DEFAULT_SHARE", "0.75"))
+ADMISSION_BULK_SHARE = float(os.getenv("ADMISSION_BULK_SHARE", "0.25"))
+# Requests in flight per institution (JWT sub), and how many of them may be bulk
+ADMISSION_TENANT_LIMIT = int(os.getenv("ADMISSION_TENANT_LIMIT", "16"))
+ADMISSION_TENANT_BULK_LIMIT = int(os.getenv("ADMISSION_TENANT_BULK_LIMIT", "2"))
+# Critical requests may wait this long for a slot; the others are shed at once
+ADMISSION_CRITICAL_WAIT = float(os.getenv("ADMISSION_CRITICAL_WAIT", "0.2"))
+ADMISSION_MAX_WAITERS = int(os.getenv("ADMISSION_MAX_WAITERS", "256"))
+ADMISSION_RETRY_AFTER = os.getenv("ADMISSION_RETRY_AFTER", "1")
+
+CRITICAL, DEFAULT, BULK = "critical", "default", "bulk"
+
+# The instance wrapping this process's app, for reporting
+controller = None
+
+# Tokens minted by a service for its own calls: sync workers and service
+# tokens, or tokens acting for an institution that name their caller
+INTERNAL_ROLES = {"service", "sync"}
+
+# "METHOD path" glob patterns
+CRITICAL_ROUTES = ["POST /attendance/presence", "POST */validate-*"]
+# Long-lived or operational requests that must never be shed or hold a slot
+EXEMPT_ROUTES = [
+    "GET /changes", "GET /attendance/stream", "GET /internal/*", "GET /metrics",
+    "GET /docs*", "GET /redoc", "GET /openapi.json"
+]
+
+class AdmissionControl:
+    """
+    ASGI middleware bounding work in flight before it reaches the handlers
+    and their DB pools. Each request gets a priority from its route and an
+    institution from its verified JWT sub. An institution over its own limit
+    gets 429; a priority over its share of process capacity gets 503. Both carry Retry-After. Critical requests
+    (presence taps, validate-*) can use capacity that default and bulk work
+    may not touch, so one tenant's import cannot starve everyone's taps.
+    Critical requests and calls between services are not held to the
+    institution limit: a hop made for a tap was admitted where it entered,
+    and turning it away would fail a tap that is only waiting its turn.
+    """
+
+    def __init__(self, app, secret: str, bulk=(), critical=CRITICAL_ROUTES, exempt=EXEMPT_ROUTES, algorithm: str = "HS256"):
+        global controller
+        controller = self
+        self.app = app
+        self.secret = secret
+        self.algorithm = algorithm
+        self.bulk = list(bulk)
+        self.critical = list(critical)
+        self.exempt = list(exempt)
+        self.capacity = {
+            CRITICAL: ADMISSION_MAX_CONCURRENCY,
+            DEFAULT: max(1, int(ADMISSION_MAX_CONCURRENCY * ADMISSION_DEFAULT_SHARE)),
+            BULK: max(1, int(ADMISSION_MAX_CONCURRENCY * ADMISSION_BULK_SHARE))
+        }
+        self.inflight = 0
+        self.inflight_by_priority = defaultdict(int)
+        self.tenant_inflight = defaultdict(int)
+        self.tenant_bulk = defaultdict(int)
+        self.released = asyncio.Condition()
+        self.waiters = 0
+        self.stats = defaultdict(lambda: {"admitted": 0, "rejected_tenant": 0, "rejected_capacity": 0})
+
+    # ---------- CLASSIFY ----------
+    def matches(self, patterns, route: str) -> bool:
+        return any(fnmatch(route, pattern) for pattern in patterns)
+
+    def classify(self, method: str, path: str):
+        route = f"{method} {path}"
+        if self.matches(self.exempt, route):
+            return None
+        if self.matches(self.critical, route):
+            return CRITICAL
+        if self.matches(self.bulk, route):
+            return BULK
+        return DEFAULT
+
+    def tenant_of(self, scope, priority: str) -> str:
+        """Institution whose limit the request counts against, "" for none."""
+        claims = verified_claims(scope, self.secret, self.algorithm)
+        if not claims or priority == CRITICAL:
+            return ""
+        if claims.get("role") in INTERNAL_ROLES or "caller" in claims:
+            return ""
+        return claims.get("sub") or ""
+
+    # ---------- ADMIT ----------
+    def over_tenant_limit(self, priority: str, tenant: str) -> bool:
+        # Unauthenticated (login, register), critical and internal requests
+        # are bounded by capacity only
+        if not tenant:
+            return False
+        if self.tenant_inflight.get(tenant, 0) >= ADMISSION_TENANT_LIMIT:
+            return True
+        return priority == BULK and self.tenant_bulk.get(tenant, 0) >= ADMISSION_TENANT_BULK_LIMIT
+
+    def has_capacity(self, priority: str) -> bool:
+        # Every priority counts all work in flight against its own ceiling,
+        # so lower priorities leave the top of the capacity to critical
+        return self.inflight < self.capacity[priority]
+
+    async def admit(self, priority: str, tenant: str):
+        """None when admitted, else the (status, detail) to reject with."""
+        if self.over_tenant_limit(priority, tenant):
+            self.stats[priority]["rejected_tenant"] += 1
+            return 429, "Too many concurrent requests for this institution"
+
+        if not self.has_capacity(priority):
+            if priority != CRITICAL or self.waiters >= ADMISSION_MAX_WAITERS:
+                self.stats[priority]["rejected_capacity"] += 1
+                return 503, "Service overloaded"
+            self.waiters += 1
+            try:
+                async with self.released:
+                    await asyncio.wait_for(
+                        self.released.wait_for(lambda: self.has_capacity(priority)),
+                        ADMISSION_CRITICAL_WAIT
+                    )
+            except asyncio.TimeoutError:
+                self.stats[priority]["rejected_capacity"] += 1
+                return 503, "Service overloaded"
+            finally:
+                self.waiters -= 1
+
+        self.inflight += 1
+        self.inflight_by_priority[priority] += 1
+        if tenant:
+            self.tenant_inflight[tenant] += 1
+            if priority == BULK:
+                self.tenant_bulk[tenant] += 1
+        self.stats[priority]["admitted"] += 1
+        return None
+
+    async def release(self, priority: str, tenant: str):
+        self.inflight -= 1
+        self.inflight_by_priority[priority] -= 1
+        if tenant:
+            self.tenant_inflight[tenant] -= 1
+            if not self.tenant_inflight[tenant]:
+                del self.tenant_inflight[tenant]
+            if priority == BULK:
+                self.tenant_bulk[tenant] -= 1
+                if not self.tenant_bulk[tenant]:
+                    del self.tenant_bulk[tenant]
+        if self.waiters:
+            async with self.released:
+                self.released.notify_all()
+
+    # ---------- ASGI ----------
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        # Under a mount (monolith mode) path still carries the prefix
+        path = scope["path"]
+        root_path = scope.get("root_path", "")
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path):]
+
+        priority = self.classify(scope["method"], path)
+        if priority is None:
+            return await self.app(scope, receive, send)
+
+        tenant = self.tenant_of(scope, priority)
+        rejection = await self.admit(priority, tenant)
+        if rejection is not None:
+            status, detail = rejection
+            body = json.dumps({"detail": detail}).encode()
+            await send({
+                "type": "http.response.start",
+                "status": status,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", ADMISSION_RETRY_AFTER.encode())
+                ]
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            await self.release(priority, tenant)
+
+    def snapshot(self) -> dict:
+        return {
+            "inflight": self.inflight,
+            "capacity": self.capacity,
+            "inflight_by_priority": dict(self.inflight_by_priority),
+            "tenants_inflight": len(self.tenant_inflight),
+            **{priority: dict(stats) for priority, stats in self.stats.items()}
+        }
@@ -0,0 +1,104 @@
+"""
+Benchmark of POST /rooms/validate-existence: the ORM path it replaced
+against the prebuilt Core statement in db.py, as p50/p99 per call.
+
+    python bench_validate.py --rooms 5000 --batch 20 --calls 2000
+    python bench_validate.py --database-url postgresql+asyncpg://...
+
+Each call produces the response bytes, as the handler does. Defaults to a
+throwaway SQLite file (needs aiosqlite); against Postgres it creates and
+fills the rooms table, so point it at a scratch database.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from pydantic import TypeAdapter
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from db import Base, Room, VALIDATE_ROOMS
+from fastjson import dumps, rows_to_dicts
+from schemas import ValidateResponse, ROOM_FIELDS
+
+INSTITUTION = "bench-institution"
+
+async def existence_orm(db, adapter: TypeAdapter, room_ids: list) -> bytes:
+    result = await db.execute(
+        select(Room).where(
+            Room.institution_id == INSTITUTION,
+            Room.id.in_(room_ids)
+        )
+    )
+    found = result.scalars().all()
+    content = ValidateResponse(valid=True, rooms=[{"id": r.id, "name": r.room_name} for r in found])
+    return adapter.dump_json(adapter.validate_python(content))
+
+async def existence_core(db, room_ids: list) -> bytes:
+    result = await db.execute(VALIDATE_ROOMS, {"institution_id": INSTITUTION, "ids": room_ids})
+    return dumps({"valid": True, "rooms": rows_to_dicts(ROOM_FIELDS, result.all())})
+
+def percentiles(timings: list) -> str:
+    cuts = statistics.quantiles(timings, n=100)
+    return f"p50 {cuts[49] * 1000:7.3f} ms  p99 {cuts[98] * 1000:7.3f} ms"
+
+async def compare(db, label: str, calls: list, orm, core):
+    # Warm both paths so one-off compilation is not counted
+    assert await orm(calls[0]) == await core(calls[0]), f"{label}: paths answer differently"
+    timings = {"orm": [], "core": []}
+    for arg in calls:
+        for name, path in (("orm", orm), ("core", core)):
+            start = time.perf_counter()
+            await path(arg)
+            timings[name].append(time.perf_counter() - start)
+        db.expunge_all()
+
+    print(f"{label}, {len(calls)} calls")
+    print(f"  orm entities   {percentiles(timings['orm'])}")
+    print(f"  core columns   {percentiles(timings['core'])}")
+
+async def run(args):
+    engine = create_async_engine(args.database_url)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all, tables=[Room.__table__])
+        await conn.execute(Room.__table__.delete().where(Room.institution_id == INSTITUTION))
+        await conn.execute(Room.__table__.insert(), [
+            {"id": f"room-{i}", "institution_id": INSTITUTION, "room_name": f"Ruang {i}"}
+            for i in range(args.rooms)
+        ])
+
+    Session = async_sessionmaker(engine, expire_on_commit=False)
+    adapter = TypeAdapter(ValidateResponse)
+    rng = random.Random(args.seed)
+    batches = [
+        list(dict.fromkeys(f"room-{rng.randrange(args.rooms)}" for _ in range(args.batch)))
+        for _ in range(args.calls)
+    ]
+
+    async with Session() as db:
+        await compare(
+            db, f"POST /rooms/validate-existence ({args.batch} ids)", batches,
+            lambda batch: existence_orm(db, adapter, batch), lambda batch: existence_core(db, batch)
+        )
+    await engine.dispose()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database-url", default=None)
+    parser.add_argument("--rooms", type=int, default=5000)
+    parser.add_argument("--batch", type=int, default=20)
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.database_url is None:
+        path = os.path.join(tempfile.mkdtemp(), "bench.db")
+        args.database_url = f"sqlite+aiosqlite:///{path}"
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
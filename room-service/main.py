@@ -1,17 +1,40 @@
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Query, Header, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
-from jose import jwt, JWTError
+from typing import Optional
 import os
 
-from db import SessionLocal, Room, init_db
+from db import router, Room, VALIDATE_ROOMS
+from migrate import check_schema
+from background import spawn, cancel_all
+from replica import ReadYourWrites
+from admission import AdmissionControl
+from tokens import verified_claims
+from compress import Compression
+from tracing import Tracing
+from querycount import QueryCounter
+from metrics import Instrumentation, register_collector, metrics_response, pool_metrics, admission_metrics
+from outbox import (
+    record_changes,
+    notify_changes,
+    wait_for_changes,
+    serialize_change,
+    prune_changes_loop,
+    LONG_POLL_MAX
+)
+from versions import resource_etag, etag_matches, not_modified, cache_headers
+from fastjson import json_response, rows_to_dicts, fast_response
+from wire import WireRoute
 from schemas import (
     CreateRoomsRequest,
     CreateRoomsResponse,
     GetRoomResponse,
+    ROOM_FIELDS,
+    UpdateRoomRequest,
     ValidateExistenceRequest,
-    ValidateResponse
+    ValidateResponse,
+    ChangesResponse
 )
 
 JWT_SECRET = os.getenv("JWT_SECRET", "EfEmEitch123")
@@ -19,35 +42,91 @@ JWT_ALGORITHM = "HS256"
 
 security = HTTPBearer()
 app = FastAPI()
+# Internal callers may speak MessagePack instead of JSON (wire.py)
+app.router.route_class = WireRoute
+app.add_middleware(
+    AdmissionControl,
+    secret=JWT_SECRET,
+    bulk=["POST /rooms", "GET /rooms"]
+)
+app.add_middleware(ReadYourWrites, secret=JWT_SECRET)
+# Counts each request's queries and warns when they grow with its input
+app.add_middleware(QueryCounter, service="room-service")
+# Counts and times every request, including any wait for admission
+app.add_middleware(Instrumentation)
+# Joins the caller's trace or samples a new one; spans cover calls and queries
+app.add_middleware(Tracing, service="room-service")
+# Outermost, so handlers see plain bodies and large responses leave compressed
+app.add_middleware(Compression)
 
 # ---------- DB ----------
+# Both follow the shard of the request's institution (shards.py)
 async def get_db():
-    async with SessionLocal() as session:
+    async with router.session() as session:
+        yield session
+
+async def get_read_db():
+    async with router.session(readonly=True) as session:
+        yield session
+
+async def get_feed_db(shard: Optional[str] = Query(None)):
+    # Every shard numbers its own changes; service consumers follow each one
+    # (see /internal/shards), admins read the shard holding their institution
+    async with router.session(shard=shard) as session:
         yield session
 
 @app.on_event("startup")
 async def startup():
-    await init_db()
+    # Schema changes are applied by migrate.py, not by pods
+    await check_schema()
+    spawn(prune_changes_loop())
+
+@app.on_event("shutdown")
+async def shutdown():
+    await cancel_all()
 
 # ---------- JWT ----------
 def get_institution_id(
+    request: Request,
     credentials: HTTPAuthorizationCredentials = Depends(security)
 ) -> str:
-    try:
-        payload = jwt.decode(
-            credentials.credentials,
-            JWT_SECRET,
-            algorithms=[JWT_ALGORITHM]
-        )
-        
-        # Validasi role admin
-        if payload.get("role") != "admin":
-            raise HTTPException(status_code=403, detail="Admin access required")
-        
-        return payload["sub"]
-    except JWTError:
+    # Decoded once per request and shared with the middlewares (tokens.py)
+    payload = verified_claims(request.scope, JWT_SECRET, JWT_ALGORITHM)
+    if payload is None:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    if payload.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return payload["sub"]
+
+def get_change_scope(
+    request: Request,
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+) -> Optional[str]:
+    """
+    Admins, and service tokens acting for an institution, read that
+    institution's changes. Only sync workers (role "sync") read every one.
+    """
+    payload = verified_claims(request.scope, JWT_SECRET, JWT_ALGORITHM)
+    if payload is None:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+    if payload.get("role") == "sync":
+        return None
+    if payload.get("role") not in ("admin", "service"):
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return payload["sub"]
+
+def require_service(
+    request: Request,
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """/internal/* reports expose topology and tenant placement: service and sync tokens only."""
+    payload = verified_claims(request.scope, JWT_SECRET, JWT_ALGORITHM)
+    if payload is None:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    if payload.get("role") not in ("service", "sync"):
+        raise HTTPException(status_code=403, detail="Service token required")
+
 # ---------- API ----------
 
 # CREATE ROOMS (BULK)
@@ -57,61 +136,130 @@ async def create_rooms(
     institution_id: str = Depends(get_institution_id),
     db: AsyncSession = Depends(get_db)
 ):
+    rooms = []
     for item in data.rooms:
         room = Room(
             institution_id=institution_id,
             room_name=item.name
         )
         db.add(room)
-    
+        rooms.append(room)
+
+    # Flush assigns the ids the change feed needs
+    await db.flush()
+    await record_changes(
+        db, institution_id, "room", "create",
+        [{"id": r.id, "name": r.room_name} for r in rooms]
+    )
     await db.commit()
+    notify_changes()
     return CreateRoomsResponse(message="successful")
 
 # GET ALL ROOMS
+# Conditional: If-None-Match gets a 304 from the version counter alone
 @app.get("/rooms", response_model=list[GetRoomResponse])
 async def get_rooms(
+    institution_id: str = Depends(get_institution_id),
+    db: AsyncSession = Depends(get_read_db),
+    if_none_match: Optional[str] = Header(None)
+):
+    etag = await resource_etag(db, institution_id, "room")
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+
+    # Fast path: column tuples straight to JSON, no model per row (fastjson.py)
+    result = await db.execute(
+        select(Room.id, Room.room_name).where(
+            Room.institution_id == institution_id
+        )
+    )
+    return json_response(rows_to_dicts(ROOM_FIELDS, result.all()), headers=cache_headers(etag))
+
+# RENAME ROOM
+# Published to the change feed so schedule-service refreshes its cached room_name
+@app.put("/rooms/{room_id}", response_model=GetRoomResponse)
+async def update_room(
+    room_id: str,
+    data: UpdateRoomRequest,
     institution_id: str = Depends(get_institution_id),
     db: AsyncSession = Depends(get_db)
 ):
     result = await db.execute(
         select(Room).where(
+            Room.id == room_id,
             Room.institution_id == institution_id
         )
     )
-    rooms = result.scalars().all()
-    
-    return [
-        GetRoomResponse(id=r.id, name=r.room_name)
-        for r in rooms
-    ]
+    room = result.scalar_one_or_none()
+    if not room:
+        raise HTTPException(status_code=404, detail="Room not found")
+
+    room.room_name = data.name
+    await record_changes(
+        db, institution_id, "room", "update",
+        [{"id": room.id, "name": room.room_name}]
+    )
+    await db.commit()
+    notify_changes()
+    return GetRoomResponse(id=room.id, name=room.room_name)
 
 # VALIDATE EXISTENCE (BATCH)
+# Internal: answers MessagePack to callers that accept it
 @app.post("/rooms/validate-existence", response_model=ValidateResponse)
 async def validate_existence(
     data: ValidateExistenceRequest,
     institution_id: str = Depends(get_institution_id),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db),
+    accept: Optional[str] = Header(None)
 ):
     room_ids = [item.id for item in data.rooms]
     
     if not room_ids:
-        return ValidateResponse(valid=True, rooms=[])
+        return fast_response({"valid": True, "rooms": []}, accept)
     
-    result = await db.execute(
-        select(Room).where(
-            Room.institution_id == institution_id,
-            Room.id.in_(room_ids)
-        )
-    )
-    found = result.scalars().all()
+    # Lean path: prebuilt Core select, rows straight to response bytes
+    result = await db.execute(VALIDATE_ROOMS, {"institution_id": institution_id, "ids": room_ids})
+    found = result.all()
     
     if len(found) != len(set(room_ids)):
-        return ValidateResponse(valid=False)
+        return fast_response({"valid": False, "rooms": []}, accept)
     
-    return ValidateResponse(
-        valid=True,
-        rooms=[
-            {"id": r.id, "name": r.room_name}
-            for r in found
-        ]
-    )
\ No newline at end of file
+    return fast_response({"valid": True, "rooms": rows_to_dicts(ROOM_FIELDS, found)}, accept)
+
+# CHANGE FEED
+# Incremental sync for consumers caching rooms: pass the last cursor as since,
+# and wait > 0 to long-poll until something changes.
+@app.get("/changes", response_model=ChangesResponse)
+async def get_changes(
+    since: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    wait: float = Query(0, ge=0, le=LONG_POLL_MAX),
+    institution_id: Optional[str] = Depends(get_change_scope),
+    db: AsyncSession = Depends(get_feed_db)
+):
+    changes = await wait_for_changes(db, institution_id, since, limit, wait)
+    return ChangesResponse(
+        changes=[serialize_change(c) for c in changes],
+        cursor=changes[-1].txid if changes else since
+    )
+
+# DB POOL
+# Checkout wait and saturation of this process's connection pools, per shard
+@app.get("/internal/pool", dependencies=[Depends(require_service)])
+async def get_pool():
+    return router.stats()
+
+# SHARDS
+# Shard names for consumers of the change feed, and where placements live
+@app.get("/internal/shards", dependencies=[Depends(require_service)])
+async def get_shards():
+    return {"shards": list(router.shards), "directory": router.directory.name}
+
+# METRICS
+# Prometheus text format, per process; the /internal/* reports as time series
+register_collector(pool_metrics(router.stats))
+register_collector(admission_metrics)
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return metrics_response()
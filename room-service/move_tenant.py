@@ -0,0 +1,140 @@
+"""
+Move one institution's rows to another shard while the service keeps running.
+
+    python move_tenant.py <institution_id> <shard>
+    python move_tenant.py <institution_id> --purge <shard>
+
+Run it with the service's own environment (DATABASE_URL / DB_SHARDS). The
+institution is marked "moving", which makes every replica refuse its writes
+with 503 once their cached placement expires, while reads keep working. Its
+rows are then copied in one transaction, the placement is switched, and the
+source rows are deleted once no replica can still be reading them. Other
+institutions are never paused. --purge deletes leftovers from a shard the
+institution no longer lives on, e.g. after a move interrupted at that step.
+"""
+import argparse
+import asyncio
+import os
+
+from sqlalchemy import select, insert, delete
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from db import Base, router
+from shards import TenantShard, SHARD_MAP_TTL, ACTIVE, MOVING
+try:
+    # Registers the changes table in services that publish a change feed
+    from outbox import Change
+except ImportError:
+    Change = None
+
+# CONFIG
+# Extra wait on top of SHARD_MAP_TTL for requests already past the placement check
+MOVE_GRACE_SECONDS = float(os.getenv("MOVE_GRACE_SECONDS", "5"))
+COPY_BATCH_SIZE = 5_000
+
+def tenant_tables() -> list:
+    """Tables holding per-institution rows, parents before children."""
+    return [table for table in Base.metadata.sorted_tables if "institution_id" in table.c]
+
+async def set_placement(institution_id: str, shard: str, state: str):
+    stmt = pg_insert(TenantShard).values(institution_id=institution_id, shard=shard, state=state)
+    async with router.directory.Session() as db:
+        await db.execute(stmt.on_conflict_do_update(
+            index_elements=[TenantShard.institution_id],
+            set_={"shard": shard, "state": state}
+        ))
+        await db.commit()
+
+async def delete_rows(conn, institution_id: str):
+    for table in reversed(tenant_tables()):
+        await conn.execute(delete(table).where(table.c.institution_id == institution_id))
+
+async def copy_rows(source, dest, institution_id: str) -> dict:
+    counts = {}
+    async with source.engine.connect() as src, dest.engine.begin() as dst:
+        # Leftovers of an earlier, interrupted attempt
+        await delete_rows(dst, institution_id)
+
+        for table in tenant_tables():
+            query = select(table).where(table.c.institution_id == institution_id)
+            is_feed = Change is not None and table is Change.__table__
+            if is_feed:
+                # The destination numbers them after its own changes, under
+                # this transaction's id, so feed consumers there see them once
+                query = query.order_by(table.c.seq)
+
+            counts[table.name] = 0
+            result = await src.stream(query.execution_options(yield_per=COPY_BATCH_SIZE))
+            async for rows in result.partitions(COPY_BATCH_SIZE):
+                values = [dict(row._mapping) for row in rows]
+                if is_feed:
+                    for value in values:
+                        del value["seq"], value["txid"]
+                await dst.execute(insert(table), values)
+                counts[table.name] += len(values)
+    return counts
+
+async def purge(institution_id: str, shard_name: str):
+    current, _ = await router.placement(institution_id, fresh=True)
+    if shard_name == current:
+        raise SystemExit(f"{institution_id} lives on {shard_name}; refusing to purge it")
+    async with router.shards[shard_name].engine.begin() as conn:
+        await delete_rows(conn, institution_id)
+    print(f"Purged {institution_id} from {shard_name}")
+
+async def move(institution_id: str, dest_name: str):
+    current, state = await router.placement(institution_id, fresh=True)
+    if state == MOVING:
+        print(f"{institution_id} was left moving by an earlier run; resuming")
+    if current == dest_name:
+        await set_placement(institution_id, current, ACTIVE)
+        print(f"{institution_id} already lives on {dest_name}")
+        return
+    source, dest = router.shards[current], router.shards[dest_name]
+
+    await set_placement(institution_id, current, MOVING)
+    print(f"Pausing writes for {institution_id} on {current}")
+    await asyncio.sleep(SHARD_MAP_TTL + MOVE_GRACE_SECONDS)
+
+    try:
+        counts = await copy_rows(source, dest, institution_id)
+    except BaseException:
+        await set_placement(institution_id, current, ACTIVE)
+        raise
+    for table, count in counts.items():
+        print(f"  copied {count} {table} rows")
+
+    await set_placement(institution_id, dest_name, ACTIVE)
+    print(f"{institution_id} now lives on {dest_name}; waiting for replicas to notice")
+    await asyncio.sleep(SHARD_MAP_TTL + MOVE_GRACE_SECONDS)
+
+    async with source.engine.begin() as conn:
+        await delete_rows(conn, institution_id)
+    print(f"Removed {institution_id} from {current}")
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("institution_id")
+    parser.add_argument("shard", nargs="?")
+    parser.add_argument("--purge", metavar="SHARD")
+    args = parser.parse_args()
+
+    shard = args.purge or args.shard
+    if shard is None:
+        parser.error("a destination shard or --purge SHARD is required")
+    if shard not in router.shards:
+        parser.error(f"unknown shard {shard}; configured: {', '.join(router.shards)}")
+
+    try:
+        if args.purge:
+            await purge(args.institution_id, args.purge)
+        else:
+            await move(args.institution_id, args.shard)
+    finally:
+        for each in router.shards.values():
+            await each.engine.dispose()
+            if each.read_engine is not each.engine:
+                await each.read_engine.dispose()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,4 +1,5 @@
 from pydantic import BaseModel
+from datetime import datetime
 
 class RoomItem(BaseModel):
     name: str
@@ -13,6 +14,12 @@ class GetRoomResponse(BaseModel):
     id: str
     name: str
 
+# Key order of fast-path rows (fastjson.py)
+ROOM_FIELDS = tuple(GetRoomResponse.model_fields)
+
+class UpdateRoomRequest(BaseModel):
+    name: str
+
 class ValidateRoomItem(BaseModel):
     id: str
 
@@ -21,4 +28,17 @@ class ValidateExistenceRequest(BaseModel):
 
 class ValidateResponse(BaseModel):
     valid: bool
-    rooms: list[dict] = []
\ No newline at end of file
+    rooms: list[dict] = []
+
+class ChangeItem(BaseModel):
+    seq: int
+    institution_id: str
+    entity: str
+    entity_id: str
+    op: str
+    data: dict
+    created_at: datetime
+
+class ChangesResponse(BaseModel):
+    changes: list[ChangeItem]
+    cursor: int
@@ -0,0 +1,81 @@
+"""
+Tests run against real Postgres: TEST_DATABASE_URL names a server on which
+they may create and drop databases, otherwise pgserver (pip install
+pgserver) starts a throwaway one. Without either they are skipped.
+
+    cd room-service && python -m pytest tests
+"""
+import asyncio
+import importlib
+import json
+import os
+import sys
+import tempfile
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVICE_DIR)
+
+# Two databases, so shard routing has somewhere to go wrong
+SHARDS = {"a": "room_test_a", "b": "room_test_b"}
+JWT_SECRET = "test-secret"
+
+@pytest.fixture(scope="session")
+def anyio_backend():
+    return "asyncio"
+
+@pytest.fixture(scope="session")
+def server_url():
+    url = os.getenv("TEST_DATABASE_URL")
+    if url:
+        yield url
+        return
+    try:
+        import pgserver
+    except ImportError:
+        pytest.skip("Set TEST_DATABASE_URL or pip install pgserver")
+    with tempfile.TemporaryDirectory() as data:
+        server = pgserver.get_server(data, cleanup_mode="stop")
+        yield f"postgresql+asyncpg://postgres:@/postgres?host={data}"
+        server.cleanup()
+
+def recreate_database(server_url: str, name: str) -> str:
+    """Drop and create database name on the server; its URL."""
+    async def run():
+        engine = create_async_engine(server_url, isolation_level="AUTOCOMMIT")
+        async with engine.connect() as conn:
+            await conn.execute(text(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)'))
+            await conn.execute(text(f'CREATE DATABASE "{name}"'))
+        await engine.dispose()
+
+    asyncio.run(run())
+    return make_url(server_url).set(database=name).render_as_string(hide_password=False)
+
+@pytest.fixture(scope="session")
+def shard_urls(server_url):
+    return {shard: recreate_database(server_url, name) for shard, name in SHARDS.items()}
+
+@pytest.fixture(scope="session")
+def service(shard_urls):
+    """room-service's main module, configured for the test shards before it is imported."""
+    os.environ["JWT_SECRET"] = JWT_SECRET
+    os.environ["DATABASE_URL"] = shard_urls["a"]
+    os.environ["DB_SHARDS"] = json.dumps(shard_urls)
+    os.environ["DB_DIRECTORY_SHARD"] = "a"
+    return importlib.import_module("main")
+
+@pytest.fixture
+async def router(service):
+    """The service's shard router on migrated databases; pools are closed after each test."""
+    import migrate
+    from migrator import migrate_all
+
+    await migrate_all(migrate.MIGRATIONS, migrate.targets())
+    service.router.placements.clear()
+    yield service.router
+    for shard in service.router.shards.values():
+        await shard.engine.dispose()
@@ -0,0 +1,58 @@
+import gzip
+
+import httpx
+import pytest
+from fastapi import FastAPI, Request
+
+import compress
+from compress import Compression
+
+pytestmark = pytest.mark.anyio
+
+# Inflates past MAX_DECOMPRESSED_BODY from a few tens of KB on the wire
+BOMB = b"\0" * (compress.MAX_DECOMPRESSED_BODY + 1)
+
+@pytest.fixture
+async def client():
+    app = FastAPI()
+
+    @app.post("/rooms")
+    async def create(request: Request):
+        return {"received": len(await request.body())}
+
+    transport = httpx.ASGITransport(app=Compression(app))
+    async with httpx.AsyncClient(transport=transport, base_url="http://room-service") as client:
+        yield client
+
+async def post(client, body: bytes, encoding: str) -> httpx.Response:
+    return await client.post(
+        "/rooms", content=body,
+        headers={"Content-Encoding": encoding, "Content-Type": "application/json"}
+    )
+
+async def test_compressed_body_is_decompressed(client):
+    resp = await post(client, gzip.compress(b'{"rooms": []}'), "gzip")
+    assert resp.status_code == 200
+    assert resp.json() == {"received": len(b'{"rooms": []}')}
+
+async def test_gzip_bomb_is_refused(client):
+    body = gzip.compress(BOMB)
+    assert len(body) < 1024 * 1024
+    resp = await post(client, body, "gzip")
+    assert resp.status_code == 413
+
+async def test_zstd_bomb_is_refused(client):
+    zstandard = pytest.importorskip("zstandard")
+    body = zstandard.ZstdCompressor().compress(BOMB)
+    assert len(body) < 1024 * 1024
+    resp = await post(client, body, "zstd")
+    assert resp.status_code == 413
+
+async def test_unsupported_encoding_is_refused(client):
+    resp = await post(client, b"BZh91AY&SY", "br")
+    assert resp.status_code == 415
+    assert resp.json() == {"detail": "Unsupported Content-Encoding: br"}
+
+async def test_corrupt_body_is_refused(client):
+    resp = await post(client, b"not gzip at all", "gzip")
+    assert resp.status_code == 400
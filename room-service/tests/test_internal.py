@@ -0,0 +1,22 @@
+import httpx
+import pytest
+from jose import jwt
+
+from conftest import JWT_SECRET
+
+pytestmark = pytest.mark.anyio
+
+def bearer(claims: dict) -> dict:
+    return {"Authorization": f"Bearer {jwt.encode(claims, JWT_SECRET, algorithm='HS256')}"}
+
+async def test_internal_reports_need_a_service_token(service):
+    transport = httpx.ASGITransport(app=service.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://room-service") as client:
+        # 401 or 403 without credentials, depending on the FastAPI version
+        assert (await client.get("/internal/shards")).status_code in (401, 403)
+        resp = await client.get("/internal/shards", headers=bearer({"sub": "inst-a", "role": "admin"}))
+        assert resp.status_code == 403
+
+        resp = await client.get("/internal/shards", headers=bearer({"sub": "schedule-service", "role": "sync"}))
+        assert resp.status_code == 200
+        assert resp.json() == {"shards": ["a", "b"], "directory": "a"}
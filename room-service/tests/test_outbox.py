@@ -0,0 +1,78 @@
+import json
+
+import pytest
+from sqlalchemy import text
+
+pytestmark = pytest.mark.anyio
+
+@pytest.fixture
+async def shard(router):
+    shard = router.shards["a"]
+    async with shard.engine.begin() as conn:
+        await conn.execute(text("DELETE FROM changes"))
+    return shard
+
+def add_changes(db, institution_id: str, *entity_ids: str):
+    from outbox import Change
+
+    db.add_all([
+        Change(institution_id=institution_id, entity="room", entity_id=entity_id, op="create", data=json.dumps({}))
+        for entity_id in entity_ids
+    ])
+
+async def read(shard, since: int, limit: int = 100, institution_id=None) -> list:
+    from outbox import changes_since
+
+    async with shard.Session() as db:
+        return await changes_since(db, institution_id, since, limit)
+
+async def test_late_commit_is_not_skipped(shard):
+    # first gets the older transaction id but commits after second
+    async with shard.Session() as first, shard.Session() as second:
+        add_changes(first, "inst-a", "r1")
+        await first.flush()
+        add_changes(second, "inst-a", "r2")
+        await second.commit()
+
+        # Handing out r2 now would move the cursor past r1 for good
+        assert await read(shard, 0) == []
+
+        await first.commit()
+
+    changes = await read(shard, 0)
+    assert [c.entity_id for c in changes] == ["r1", "r2"]
+    assert changes[0].txid < changes[1].txid
+    assert await read(shard, changes[-1].txid) == []
+
+async def test_paging_never_skips_or_repeats(shard):
+    # Transactions of 1, 3 and 2 changes, the middle one larger than a page
+    batches = [["r1"], ["r2", "r3", "r4"], ["r5", "r6"]]
+    for ids in batches:
+        async with shard.Session() as db:
+            add_changes(db, "inst-a", *ids)
+            await db.commit()
+
+    seen, cursor, pages = [], 0, []
+    while True:
+        changes = await read(shard, cursor, limit=2)
+        if not changes:
+            break
+        pages.append([c.entity_id for c in changes])
+        seen += pages[-1]
+        cursor = changes[-1].txid
+
+    assert seen == ["r1", "r2", "r3", "r4", "r5", "r6"]
+    # A transaction is never split across pages
+    assert pages == [["r1", "r2", "r3", "r4"], ["r5", "r6"]]
+
+async def test_tenant_feed_pages_only_its_own_changes(shard):
+    for institution_id, ids in (("inst-a", ["a1"]), ("inst-b", ["b1"]), ("inst-a", ["a2"])):
+        async with shard.Session() as db:
+            add_changes(db, institution_id, *ids)
+            await db.commit()
+
+    first = await read(shard, 0, limit=1, institution_id="inst-a")
+    assert [c.entity_id for c in first] == ["a1"]
+    rest = await read(shard, first[-1].txid, limit=1, institution_id="inst-a")
+    assert [c.entity_id for c in rest] == ["a2"]
+    assert [c.entity_id for c in await read(shard, 0)] == ["a1", "b1", "a2"]
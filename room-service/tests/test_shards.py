@@ -0,0 +1,75 @@
+import httpx
+import pytest
+from jose import jwt
+from sqlalchemy import text
+
+from conftest import JWT_SECRET
+
+pytestmark = pytest.mark.anyio
+
+def bearer(institution_id: str, secret: str = JWT_SECRET) -> dict:
+    token = jwt.encode({"sub": institution_id, "role": "admin"}, secret, algorithm="HS256")
+    return {"Authorization": f"Bearer {token}"}
+
+async def rooms_on(router, shard: str) -> set:
+    async with router.shards[shard].engine.connect() as conn:
+        rows = await conn.execute(text("SELECT institution_id, room_name FROM rooms"))
+        return set(rows.all())
+
+@pytest.fixture
+async def client(service, router):
+    from shards import TenantShard
+
+    # inst-b lives on shard b; everyone else on the directory shard a
+    async with router.directory.Session() as db:
+        await db.merge(TenantShard(institution_id="inst-b", shard="b"))
+        await db.commit()
+    for shard in router.shards.values():
+        async with shard.engine.begin() as conn:
+            await conn.execute(text("DELETE FROM rooms"))
+
+    transport = httpx.ASGITransport(app=service.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://room-service") as client:
+        yield client
+
+async def test_requests_use_their_institutions_shard(client, router):
+    for institution_id, name in (("inst-a", "A-101"), ("inst-b", "B-201")):
+        resp = await client.post("/rooms", json={"rooms": [{"name": name}]}, headers=bearer(institution_id))
+        assert resp.status_code == 200, resp.text
+
+    assert await rooms_on(router, "a") == {("inst-a", "A-101")}
+    assert await rooms_on(router, "b") == {("inst-b", "B-201")}
+
+    resp = await client.get("/rooms", headers=bearer("inst-b"))
+    assert [room["name"] for room in resp.json()] == ["B-201"]
+
+async def test_forged_token_routes_nowhere(client, router):
+    forged = bearer("inst-b", secret="not-the-secret")
+
+    resp = await client.post("/rooms", json={"rooms": [{"name": "forged"}]}, headers=forged)
+    assert resp.status_code == 401
+    resp = await client.get("/rooms", headers=forged)
+    assert resp.status_code == 401
+
+    # Never looked up, so the forged sub chose no shard
+    assert "inst-b" not in router.placements
+    assert await rooms_on(router, "a") == set()
+    assert await rooms_on(router, "b") == set()
+
+async def test_tenant_comes_from_the_verified_token():
+    from replica import ReadYourWrites, current_tenant
+
+    seen = []
+
+    async def app(scope, receive, send):
+        seen.append(current_tenant())
+
+    middleware = ReadYourWrites(app, secret=JWT_SECRET)
+    for headers in (bearer("inst-b"), bearer("inst-b", secret="not-the-secret"), {}):
+        scope = {
+            "type": "http",
+            "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()]
+        }
+        await middleware(scope, None, None)
+
+    assert seen == ["inst-b", "", ""]
@@ -0,0 +1,97 @@
+from fastapi import Request, Response
+from fastapi.routing import APIRoute
+from starlette.datastructures import Headers
+from pydantic import BaseModel
+from typing import Any, Callable, Optional
+import msgspec
+import os
+
+# CONFIG
+# 0 keeps this service's own upstream calls on JSON; it still answers
+# MessagePack to callers that ask for it
+WIRE_MSGPACK = os.getenv("WIRE_MSGPACK", "1") == "1"
+
+MSGPACK = "application/msgpack"
+
+def is_msgpack(content_type: Optional[str]) -> bool:
+    return bool(content_type) and content_type.split(";")[0].strip().lower() == MSGPACK
+
+def wants_msgpack(accept: Optional[str]) -> bool:
+    return bool(accept) and any(is_msgpack(media_range) for media_range in accept.split(","))
+
+# ---------- SERVER ----------
+def _encode_model(obj):
+    if isinstance(obj, BaseModel):
+        return obj.model_dump(mode="json")
+    raise NotImplementedError(f"Cannot encode {type(obj).__name__} as MessagePack")
+
+_encoder = msgspec.msgpack.Encoder(enc_hook=_encode_model)
+
+def encode(content) -> bytes:
+    """content (dicts, lists, scalars or response models) as MessagePack."""
+    return _encoder.encode(content)
+
+def msgpack_response(content, headers: dict = None) -> Response:
+    return Response(encode(content), media_type=MSGPACK, headers=headers)
+
+def negotiate(content, accept: Optional[str]):
+    """
+    content as MessagePack when the caller's Accept asks for it, otherwise
+    unchanged, so FastAPI answers with the usual JSON through response_model.
+    """
+    if wants_msgpack(accept):
+        return msgpack_response(content)
+    return content
+
+class MessagePackRequest(Request):
+    """
+    FastAPI only parses bodies it takes for JSON, so this request reports a
+    JSON Content-Type and decodes the MessagePack body in json() instead.
+    """
+
+    @property
+    def headers(self) -> Headers:
+        if not hasattr(self, "_headers"):
+            raw = [(k, v) for k, v in self.scope["headers"] if k != b"content-type"]
+            self._headers = Headers(raw=raw + [(b"content-type", b"application/json")])
+        return self._headers
+
+    async def json(self) -> Any:
+        if not hasattr(self, "_json"):
+            self._json = msgspec.msgpack.decode(await self.body())
+        return self._json
+
+class WireRoute(APIRoute):
+    """
+    Route that also takes MessagePack request bodies; the endpoint's request
+    model validates them exactly like JSON. Install it before the routes are
+    declared: app.router.route_class = WireRoute.
+    """
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def route_handler(request: Request) -> Response:
+            if is_msgpack(request.headers.get("content-type")):
+                request = MessagePackRequest(request.scope, request.receive)
+            return await handler(request)
+
+        return route_handler
+
+# ---------- CLIENT ----------
+def accept_headers() -> dict:
+    """
+    Headers asking an internal endpoint for MessagePack. With them the shared
+    client (http_client.py) also sends json= bodies as MessagePack.
+    """
+    return {"Accept": MSGPACK} if WIRE_MSGPACK else {}
+
+def decode(resp, type: Any = Any):
+    """
+    Body of an upstream response decoded and checked against type (a
+    msgspec Struct, TypedDict, list of them...), whichever encoding it came in.
+    Raises msgspec.ValidationError when the body does not match type.
+    """
+    if is_msgpack(resp.headers.get("content-type")):
+        return msgspec.msgpack.decode(resp.content, type=type)
+    return msgspec.json.decode(resp.content, type=type)
@@ -0,0 +1,84 @@
+"""
+Benchmark of GET /schedules serialization: the model-per-row path against
+the fast path in fastjson.py, on generated rows.
+
+    python bench_serialization.py --rows 20000
+
+The old path builds a ScheduleResponseItem per row, then validates and
+encodes the response through a TypeAdapter the way FastAPI does for
+response_model. Both paths must produce the same bytes.
+"""
+import argparse
+import time
+import uuid
+
+from pydantic import TypeAdapter
+
+from fastjson import dumps, rows_to_dicts
+from schemas import GetScheduleResponse, ScheduleResponseItem, SCHEDULE_FIELDS
+
+def generate(rows: int):
+    # room_name / class_name stay None until the change feed fills them in
+    return [
+        (
+            str(uuid.uuid4()),
+            str(uuid.uuid4()),
+            f"Ruang {i % 300}" if i % 10 else None,
+            str(uuid.uuid4()),
+            f"Kelas {i % 500}" if i % 10 else None,
+            i % 7,
+            700 + (i % 10) * 100,
+            800 + (i % 10) * 100,
+            f"2025-{i % 12 + 1:02d}-0{i % 9 + 1}T08:30:00" if i % 20 else None
+        )
+        for i in range(rows)
+    ]
+
+def model_path(adapter: TypeAdapter, rows) -> bytes:
+    content = GetScheduleResponse(
+        schedules=[
+            ScheduleResponseItem(
+                id=id,
+                room_id=room_id,
+                room_name=room_name,
+                class_id=class_id,
+                class_name=class_name,
+                day=day,
+                start_time=start_time,
+                end_time=end_time,
+                created_at=created_at
+            )
+            for id, room_id, room_name, class_id, class_name, day, start_time, end_time, created_at in rows
+        ]
+    )
+    return adapter.dump_json(adapter.validate_python(content))
+
+def fast_path(rows) -> bytes:
+    return dumps({"schedules": rows_to_dicts(SCHEDULE_FIELDS, rows)})
+
+def best_of(repeat: int, fn, *args):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings), out
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rows = generate(args.rows)
+    adapter = TypeAdapter(GetScheduleResponse)
+    old, old_body = best_of(args.repeat, model_path, adapter, rows)
+    new, new_body = best_of(args.repeat, fast_path, rows)
+    assert old_body == new_body, "fast path changed the response bytes"
+
+    print(f"GET /schedules, {args.rows} rows, {len(new_body)} bytes")
+    print(f"  model per row  {old * 1000:8.1f} ms")
+    print(f"  fast path      {new * 1000:8.1f} ms  ({old / new:.1f}x)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Benchmark of one GET /schedules hop: JSON against MessagePack (wire.py),
+on generated rows.
+
+    python bench_wire.py --rows 20000
+
+Times what each side spends: the server encoding (the fast path for JSON)
+and the caller decoding, json.loads into dicts as resp.json() did against
+schema-typed decoding like attendance-service's ScheduleList. Both must
+decode to the same data.
+"""
+import argparse
+import json
+from typing import List, Optional, TypedDict
+
+import msgspec
+
+from bench_serialization import generate, best_of
+from fastjson import dumps, rows_to_dicts
+from schemas import SCHEDULE_FIELDS
+from wire import encode
+
+class ScheduleSlot(TypedDict):
+    id: str
+    room_id: str
+    room_name: Optional[str]
+    class_id: str
+    class_name: Optional[str]
+    day: int
+    start_time: int
+    end_time: int
+    created_at: Optional[str]
+
+class ScheduleList(msgspec.Struct):
+    schedules: List[ScheduleSlot]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    content = {"schedules": rows_to_dicts(SCHEDULE_FIELDS, generate(args.rows))}
+    json_encode, json_body = best_of(args.repeat, dumps, content)
+    json_decode, json_data = best_of(args.repeat, json.loads, json_body)
+    msgpack_encode, msgpack_body = best_of(args.repeat, encode, content)
+    decoder = msgspec.msgpack.Decoder(ScheduleList)
+    msgpack_decode, msgpack_data = best_of(args.repeat, decoder.decode, msgpack_body)
+    assert msgpack_data.schedules == json_data["schedules"], "encodings decoded differently"
+
+    print(f"GET /schedules hop, {args.rows} rows")
+    print(f"  json     {len(json_body):>9} bytes  encode {json_encode * 1000:6.1f} ms  decode {json_decode * 1000:6.1f} ms")
+    print(f"  msgpack  {len(msgpack_body):>9} bytes  encode {msgpack_encode * 1000:6.1f} ms  decode {msgpack_decode * 1000:6.1f} ms")
+    print(f"  size {len(msgpack_body) / len(json_body):.0%} of json, "
+          f"cpu {(msgpack_encode + msgpack_decode) / (json_encode + json_decode):.0%} of json")
+
+if __name__ == "__main__":
+    main()
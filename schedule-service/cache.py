@@ -0,0 +1,152 @@
+from collections import OrderedDict
+import asyncio
+import json
+import os
+import time
+
+# CONFIG
+# "memory" (per-process LRU) or "redis" (shared by all replicas; needs the redis package)
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+
+# ---------- BACKENDS ----------
+# Entries are {"value": ..., "fetched_at": epoch seconds}; values must be JSON-able
+class MemoryBackend:
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    async def get(self, key: str):
+        item = self.entries.get(key)
+        if item is None:
+            return None
+        entry, expires_at = item
+        if time.time() >= expires_at:
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    async def set(self, key: str, entry: dict, ttl: float):
+        self.entries[key] = (entry, time.time() + ttl)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def delete(self, key: str):
+        self.entries.pop(key, None)
+
+class RedisBackend:
+    """Any client with redis.asyncio's get/set/delete works, e.g. a local stand-in."""
+
+    def __init__(self, client=None, url: str = CACHE_REDIS_URL):
+        if client is None:
+            try:
+                import redis.asyncio as redis
+            except ImportError:
+                raise RuntimeError("CACHE_BACKEND=redis requires the redis package")
+            client = redis.from_url(url)
+        self.client = client
+
+    async def get(self, key: str):
+        raw = await self.client.get(key)
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, key: str, entry: dict, ttl: float):
+        await self.client.set(key, json.dumps(entry), ex=max(1, int(ttl)))
+
+    async def delete(self, key: str):
+        await self.client.delete(key)
+
+_backend = None
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        _backend = RedisBackend() if CACHE_BACKEND == "redis" else MemoryBackend()
+    return _backend
+
+# ---------- CACHE ----------
+class SWRCache:
+    """
+    TTL cache with stale-while-revalidate and stale-if-error.
+
+    Younger than ttl: served as-is. Up to stale_ttl past that: served at
+    once while one background refresh runs. Older or missing: loaded inline,
+    and if the loader fails an entry up to error_ttl past ttl is served
+    instead. None is never cached, so "not found" is always re-asked.
+    """
+
+    def __init__(self, name: str, ttl: float, stale_ttl: float, error_ttl: float, backend=None):
+        self.name = name
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.error_ttl = error_ttl
+        self.backend = backend
+        self.refreshing = set()
+        # The loop only holds weak references to tasks; keep refreshes alive until done
+        self.tasks = set()
+        self.stats = {"hits": 0, "stale_hits": 0, "misses": 0, "refreshes": 0, "stale_if_error": 0, "errors": 0}
+
+    def full_key(self, key: str) -> str:
+        return f"cache:{self.name}:{key}"
+
+    async def get(self, key: str, loader):
+        backend = self.backend or get_backend()
+        full_key = self.full_key(key)
+        entry = await backend.get(full_key)
+        age = time.time() - entry["fetched_at"] if entry else None
+
+        if entry and age < self.ttl:
+            self.stats["hits"] += 1
+            return entry["value"]
+
+        if entry and age < self.ttl + self.stale_ttl:
+            self.stats["stale_hits"] += 1
+            if full_key not in self.refreshing:
+                self.refreshing.add(full_key)
+                task = asyncio.create_task(self.refresh(full_key, loader))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+            return entry["value"]
+
+        self.stats["misses"] += 1
+        try:
+            return await self.load(full_key, loader)
+        except Exception:
+            if entry and age < self.ttl + self.error_ttl:
+                self.stats["stale_if_error"] += 1
+                return entry["value"]
+            raise
+
+    async def load(self, full_key: str, loader):
+        value = await loader()
+        if value is not None:
+            await (self.backend or get_backend()).set(
+                full_key,
+                {"value": value, "fetched_at": time.time()},
+                self.ttl + max(self.stale_ttl, self.error_ttl)
+            )
+        return value
+
+    async def refresh(self, full_key: str, loader):
+        self.stats["refreshes"] += 1
+        try:
+            await self.load(full_key, loader)
+        except Exception as e:
+            # Keep serving the stale entry; the next read past stale_ttl retries inline
+            self.stats["errors"] += 1
+            print(f"Cache refresh error ({full_key}): {e}")
+        finally:
+            self.refreshing.discard(full_key)
+
+    async def prime(self, key: str, loader):
+        """Load key now regardless of age, e.g. ahead of a known burst."""
+        return await self.load(self.full_key(key), loader)
+
+    async def invalidate(self, key: str):
+        await (self.backend or get_backend()).delete(self.full_key(key))
+
+    def snapshot(self) -> dict:
+        return {"ttl": self.ttl, "stale_ttl": self.stale_ttl, "error_ttl": self.error_ttl, **self.stats}
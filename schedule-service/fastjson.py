@@ -0,0 +1,43 @@
+from fastapi import Response
+import json
+import os
+
+from wire import wants_msgpack, msgpack_response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# CONFIG
+# 0 encodes the fast path with the json module instead of orjson (same bytes, slower)
+FAST_JSON = os.getenv("FAST_JSON", "1") == "1"
+
+def dumps(content) -> bytes:
+    """
+    Compact UTF-8 JSON, byte-identical to what FastAPI sends for the same
+    data through a response_model (and to Starlette's JSONResponse) for
+    the str / int / bool / None values the fast path carries.
+    """
+    if orjson is not None and FAST_JSON:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+def rows_to_dicts(keys: tuple, rows) -> list[dict]:
+    """Plain column tuples (result.all()) as dicts with keys in response-model field order."""
+    return [dict(zip(keys, row)) for row in rows]
+
+def json_response(content, headers: dict = None) -> Response:
+    """
+    Response with content already encoded. Skips per-row model instances and
+    FastAPI's response_model validation, so content must match that model:
+    same keys, same order, every field present. Keep response_model on the
+    route for the OpenAPI schema.
+    """
+    return Response(dumps(content), media_type="application/json", headers=headers)
+
+def fast_response(content, accept: str = None, headers: dict = None) -> Response:
+    """json_response, or MessagePack for internal callers whose Accept asks for it (wire.py)."""
+    if wants_msgpack(accept):
+        return msgpack_response(content, headers=headers)
+    return json_response(content, headers=headers)
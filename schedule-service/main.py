@@ -1,19 +1,50 @@
-from fastapi import FastAPI, Depends, HTTPException, Header
+from fastapi import FastAPI, Depends, HTTPException, Header, Query, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_, or_
-from jose import jwt, JWTError
+from sqlalchemy import select, func, and_
+from jose import jwt
+from typing import Optional
 import os
 import httpx
 
-from db import SessionLocal, Schedule, init_db
+from db import router, Schedule
+from migrate import check_schema
+from background import spawn, cancel_all
+from replica import ReadYourWrites
+from admission import AdmissionControl
+from tokens import verified_claims
+from compress import Compression
+from tracing import Tracing
+from querycount import QueryCounter
+from metrics import Instrumentation, register_collector, metrics_response, pool_metrics, admission_metrics, upstream_metrics, coalescing_metrics, cache_metrics
+from outbox import (
+    record_changes,
+    notify_changes,
+    wait_for_changes,
+    serialize_change,
+    prune_changes_loop,
+    LONG_POLL_MAX
+)
+from versions import resource_etag, etag_matches, not_modified, cache_headers
+from fastjson import rows_to_dicts, fast_response
+from wire import WireRoute, negotiate, accept_headers, decode
+from sync import follow_service
+from http_client import close_client
+from resilience import CircuitOpenError
+import resilience
+from singleflight import coalesced_call, flights
+from cache import SWRCache
 from schemas import (
     CreateScheduleRequest,
     CreateScheduleResponse,
     GetScheduleResponse,
-    ScheduleResponseItem,
+    SCHEDULE_FIELDS,
+    UpcomingScheduleItem,
+    UpcomingSchedulesResponse,
     ValidateAvailabilityRequest,
-    ValidateAvailabilityResponse
+    ValidateAvailabilityResponse,
+    ChangesResponse,
+    ExistenceValidation
 )
 
 # CONFIG
@@ -24,39 +55,124 @@ JWT_ALGORITHM = "HS256"
 ROOM_SERVICE_URL = os.getenv("ROOM_SERVICE_URL", "http://54.162.202.203:8000")
 CLASS_SERVICE_URL = os.getenv("CLASS_SERVICE_URL", "http://3.225.88.17:8000")
 
+# Follow room/class change feeds to keep room_name/class_name fresh
+NAME_SYNC_ENABLED = os.getenv("NAME_SYNC_ENABLED", "1") == "1"
+
+# Room/class name cache (seconds)
+NAME_CACHE_TTL = float(os.getenv("NAME_CACHE_TTL", "60"))
+NAME_CACHE_STALE = float(os.getenv("NAME_CACHE_STALE", "600"))
+NAME_CACHE_STALE_IF_ERROR = float(os.getenv("NAME_CACHE_STALE_IF_ERROR", "3600"))
+
 security = HTTPBearer()
 app = FastAPI()
+# Internal callers may speak MessagePack instead of JSON (wire.py)
+app.router.route_class = WireRoute
+app.add_middleware(
+    AdmissionControl,
+    secret=JWT_SECRET,
+    # GET /schedules is not bulk: attendance-service resolves taps from it
+    bulk=["POST /schedules/create"]
+)
+app.add_middleware(ReadYourWrites, secret=JWT_SECRET)
+# Counts each request's queries and warns when they grow with its input
+app.add_middleware(QueryCounter, service="schedule-service")
+# Counts and times every request, including any wait for admission
+app.add_middleware(Instrumentation)
+# Joins the caller's trace or samples a new one; spans cover calls and queries
+app.add_middleware(Tracing, service="schedule-service")
+# Outermost, so handlers see plain bodies and large responses leave compressed
+app.add_middleware(Compression)
 
 # ---------- DB ----------
+# Both follow the shard of the request's institution (shards.py)
 async def get_db():
-    async with SessionLocal() as session:
+    async with router.session() as session:
+        yield session
+
+async def get_read_db():
+    async with router.session(readonly=True) as session:
+        yield session
+
+async def get_feed_db(shard: Optional[str] = Query(None)):
+    # Every shard numbers its own changes; service consumers follow each one
+    # (see /internal/shards), admins read the shard holding their institution
+    async with router.session(shard=shard) as session:
         yield session
 
 @app.on_event("startup")
 async def startup():
-    await init_db()
+    # Schema changes are applied by migrate.py, not by pods
+    await check_schema()
+    spawn(prune_changes_loop())
+
+    if NAME_SYNC_ENABLED:
+        token = jwt.encode({"sub": "schedule-service", "role": "sync"}, JWT_SECRET, algorithm=JWT_ALGORITHM)
+        spawn(follow_service("room-service", ROOM_SERVICE_URL, token, "room", "room_id", "room_name", name_cache))
+        spawn(follow_service("class-service", CLASS_SERVICE_URL, token, "class", "class_id", "class_name", name_cache))
+
+@app.on_event("shutdown")
+async def shutdown():
+    await cancel_all()
+    await close_client()
 
 # ---------- JWT ----------
 def get_institution_id(
+    request: Request,
     credentials: HTTPAuthorizationCredentials = Depends(security)
 ) -> str:
-    try:
-        payload = jwt.decode(
-            credentials.credentials,
-            JWT_SECRET,
-            algorithms=[JWT_ALGORITHM]
-        )
-        if payload.get("role") != "admin":
-            raise HTTPException(status_code=403, detail="Admin access required")
-        return payload["sub"]
-    except JWTError:
+    # Decoded once per request and shared with the middlewares (tokens.py)
+    payload = verified_claims(request.scope, JWT_SECRET, JWT_ALGORITHM)
+    if payload is None:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    if payload.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return payload["sub"]
+
+def get_change_scope(
+    request: Request,
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+) -> Optional[str]:
+    """
+    Admins, and service tokens acting for an institution, read that
+    institution's changes. Only sync workers (role "sync") read every one.
+    """
+    payload = verified_claims(request.scope, JWT_SECRET, JWT_ALGORITHM)
+    if payload is None:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+    if payload.get("role") == "sync":
+        return None
+    if payload.get("role") not in ("admin", "service"):
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return payload["sub"]
+
+def require_service(
+    request: Request,
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+):
+    """/internal/* reports expose topology and tenant placement: service and sync tokens only."""
+    payload = verified_claims(request.scope, JWT_SECRET, JWT_ALGORITHM)
+    if payload is None:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    if payload.get("role") not in ("service", "sync"):
+        raise HTTPException(status_code=403, detail="Service token required")
+
 def get_raw_token(credentials: HTTPAuthorizationCredentials = Depends(security)) -> str:
     return credentials.credentials
 
 # ---------- HELPER ----------
+# Room and class names rarely change; found names are cached with
+# stale-while-revalidate and served stale through short upstream outages
+name_cache = SWRCache(
+    "names",
+    ttl=NAME_CACHE_TTL,
+    stale_ttl=NAME_CACHE_STALE,
+    error_ttl=NAME_CACHE_STALE_IF_ERROR
+)
+
 async def validate_external_id(
+    institution_id: str,
+    upstream: str,
     service_url: str, 
     endpoint: str, 
     payload_key: str, 
@@ -66,33 +182,61 @@ async def validate_external_id(
 ):
     """
     Generic helper to call validate-existence endpoints of other services.
-    Returns the object name if found, None otherwise.
+    Returns the object name if found, None otherwise. Raises 503 when the
+    upstream cannot answer and nothing usable is cached, so an outage is not
+    reported as an invalid id.
     """
-    async with httpx.AsyncClient() as client:
-        try:
-            payload = {payload_key: [{id_key: id_val}]}
-            resp = await client.post(
-                f"{service_url}/{endpoint}",
-                json=payload,
-                headers={"Authorization": f"Bearer {token}"},
-                timeout=10.0
-            )
-            if resp.status_code != 200:
-                return None
-            
-            data = resp.json()
-            if not data.get("valid"):
-                return None
-            
-            # Extract name (assuming structure: {items: [{id:..., name:...}]})
-            items = data.get(payload_key, [])
-            if items:
-                return items[0].get("name")
-            return None
-            
-        except Exception as e:
-            print(f"Error calling {service_url}: {e}")
-            return None
+    return await name_cache.get(
+        f"{upstream}:{institution_id}:{id_val}",
+        lambda: fetch_external_name(
+            institution_id, upstream, service_url, endpoint, payload_key, id_key, id_val, token
+        )
+    )
+
+async def fetch_external_name(
+    institution_id: str,
+    upstream: str,
+    service_url: str,
+    endpoint: str,
+    payload_key: str,
+    id_key: str,
+    id_val: str,
+    token: str
+):
+    payload = {payload_key: [{id_key: id_val}]}
+    try:
+        # Concurrent uploads from one institution ask about the same rooms and classes
+        resp = await coalesced_call(
+            f"validate.{upstream}", institution_id,
+            upstream, "POST",
+            f"{service_url}/{endpoint}",
+            idempotent=True,
+            json=payload,
+            headers={"Authorization": f"Bearer {token}", **accept_headers()}
+        )
+    except (httpx.HTTPError, CircuitOpenError) as e:
+        print(f"Error calling {service_url}: {e}")
+        raise HTTPException(status_code=503, detail=f"{upstream} unavailable")
+
+    # A 429 means the upstream is busy, not that the id is unknown
+    if resp.status_code >= 500 or resp.status_code == 429:
+        retry_after = resp.headers.get("retry-after")
+        raise HTTPException(
+            status_code=503, detail=f"{upstream} unavailable",
+            headers={"Retry-After": retry_after} if retry_after else None
+        )
+    if resp.status_code != 200:
+        return None
+    
+    data = decode(resp, ExistenceValidation)
+    if not data.valid:
+        return None
+    
+    # Extract name (structure: {items: [{id:..., name:...}]})
+    items = getattr(data, payload_key)
+    if items:
+        return items[0].name
+    return None
 
 # ---------- API ----------
 
@@ -104,17 +248,18 @@ async def create_schedules(
     token: str = Depends(get_raw_token),
     db: AsyncSession = Depends(get_db)
 ):
+    created = []
     for item in data.schedules:
         # A. Validate Room Existence
         room_name = await validate_external_id(
-            ROOM_SERVICE_URL, "rooms/validate-existence", "rooms", "id", item.room_id, token
+            institution_id, "room-service", ROOM_SERVICE_URL, "rooms/validate-existence", "rooms", "id", item.room_id, token
         )
         if not room_name:
             raise HTTPException(status_code=400, detail=f"Invalid Room ID: {item.room_id}")
 
         # B. Validate Class Existence
         class_name = await validate_external_id(
-            CLASS_SERVICE_URL, "classes/validate-existence", "classes", "id", item.class_id, token
+            institution_id, "class-service", CLASS_SERVICE_URL, "classes/validate-existence", "classes", "id", item.class_id, token
         )
         if not class_name:
             raise HTTPException(status_code=400, detail=f"Invalid Class ID: {item.class_id}")
@@ -150,35 +295,112 @@ async def create_schedules(
             end_time=item.end_time
         )
         db.add(new_schedule)
-    
+        created.append(new_schedule)
+
+    # Flush assigns the ids the change feed needs
+    await db.flush()
+    await record_changes(
+        db, institution_id, "schedule", "create",
+        [
+            {
+                "id": s.id,
+                "room_id": s.room_id,
+                "room_name": s.room_name,
+                "class_id": s.class_id,
+                "class_name": s.class_name,
+                "day": s.day,
+                "start_time": s.start_time,
+                "end_time": s.end_time
+            }
+            for s in created
+        ]
+    )
     await db.commit()
+    notify_changes()
     return CreateScheduleResponse(message="successful")
 
 # 2. GET SCHEDULES
+# Conditional: If-None-Match gets a 304 from the version counter alone
+# Internal: answers MessagePack to callers that accept it
 @app.get("/schedules", response_model=GetScheduleResponse)
 async def get_schedules(
     institution_id: str = Depends(get_institution_id),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db),
+    if_none_match: Optional[str] = Header(None),
+    accept: Optional[str] = Header(None)
 ):
+    etag = await resource_etag(db, institution_id, "schedule")
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+
+    # Fast path: column tuples straight to JSON, no model per row (fastjson.py)
     result = await db.execute(
-        select(Schedule).where(Schedule.institution_id == institution_id)
+        select(
+            Schedule.id,
+            Schedule.room_id,
+            Schedule.room_name,
+            Schedule.class_id,
+            Schedule.class_name,
+            Schedule.day,
+            Schedule.start_time,
+            Schedule.end_time,
+            # ISO text, so the fast path only carries str / int / None
+            func.to_char(Schedule.created_at, 'YYYY-MM-DD"T"HH24:MI:SS')
+        ).where(Schedule.institution_id == institution_id)
     )
-    schedules = result.scalars().all()
-    
-    return GetScheduleResponse(
-        schedules=[
-            ScheduleResponseItem(
-                id=s.id,
-                room_id=s.room_id,
-                room_name=s.room_name,
-                class_id=s.class_id,
-                class_name=s.class_name,
-                day=s.day,
-                start_time=s.start_time,
-                end_time=s.end_time
-            )
-            for s in schedules
-        ]
+    content = {"schedules": rows_to_dicts(SCHEDULE_FIELDS, result.all())}
+    return fast_response(content, accept, headers=cache_headers(etag))
+
+# 2b. UPCOMING SCHEDULES
+# Slots starting within [start_from, start_to] on day. Sync tokens see every
+# institution; attendance-service uses this to warm its caches before a lecture.
+# Internal: answers MessagePack to callers that accept it
+@app.get("/schedules/upcoming", response_model=UpcomingSchedulesResponse)
+async def get_upcoming_schedules(
+    day: int = Query(..., ge=1, le=7),
+    start_from: int = Query(..., ge=0, le=2359),
+    start_to: int = Query(..., ge=0, le=2359),
+    institution_id: Optional[str] = Depends(get_change_scope),
+    accept: Optional[str] = Header(None)
+):
+    query = select(Schedule).where(
+        Schedule.day == day,
+        Schedule.start_time >= start_from,
+        Schedule.start_time <= start_to
+    )
+    if institution_id is not None:
+        query = query.where(Schedule.institution_id == institution_id)
+        shards = [await router.shard_for(institution_id)]
+    else:
+        # Sync tokens see every institution, so every shard
+        shards = list(router.shards.values())
+
+    # Keyed by id: an institution mid-move has its rows on two shards
+    found = {}
+    for shard in shards:
+        async with shard.session(readonly=True) as db:
+            result = await db.execute(query)
+            found.update((s.id, s) for s in result.scalars().all())
+    schedules = sorted(found.values(), key=lambda s: s.start_time)
+
+    return negotiate(
+        UpcomingSchedulesResponse(
+            schedules=[
+                UpcomingScheduleItem(
+                    id=s.id,
+                    institution_id=s.institution_id,
+                    room_id=s.room_id,
+                    room_name=s.room_name,
+                    class_id=s.class_id,
+                    class_name=s.class_name,
+                    day=s.day,
+                    start_time=s.start_time,
+                    end_time=s.end_time
+                )
+                for s in schedules
+            ]
+        ),
+        accept
     )
 
 # 3. VALIDATE AVAILABILITY
@@ -186,7 +408,7 @@ async def get_schedules(
 async def validate_availability(
     data: ValidateAvailabilityRequest,
     institution_id: str = Depends(get_institution_id),
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     conflicts = []
     
@@ -214,3 +436,61 @@ async def validate_availability(
         return ValidateAvailabilityResponse(valid=False, conflicts=conflicts)
         
     return ValidateAvailabilityResponse(valid=True)
+
+# 4. CHANGE FEED
+# Incremental sync for consumers caching schedules: pass the last cursor as
+# since, and wait > 0 to long-poll until something changes.
+@app.get("/changes", response_model=ChangesResponse)
+async def get_changes(
+    since: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000),
+    wait: float = Query(0, ge=0, le=LONG_POLL_MAX),
+    institution_id: Optional[str] = Depends(get_change_scope),
+    db: AsyncSession = Depends(get_feed_db)
+):
+    changes = await wait_for_changes(db, institution_id, since, limit, wait)
+    return ChangesResponse(
+        changes=[serialize_change(c) for c in changes],
+        cursor=changes[-1].txid if changes else since
+    )
+
+# 5. UPSTREAM HEALTH
+# Circuit breaker state and call statistics per downstream service
+@app.get("/internal/upstreams", dependencies=[Depends(require_service)])
+async def get_upstreams():
+    return resilience.snapshot()
+
+# 6. REQUEST COALESCING
+# Per call site: calls made, upstream requests actually sent, and the ratio saved
+@app.get("/internal/coalescing", dependencies=[Depends(require_service)])
+async def get_coalescing():
+    return flights.snapshot()
+
+# 7. CACHES
+@app.get("/internal/caches", dependencies=[Depends(require_service)])
+async def get_caches():
+    return {"names": name_cache.snapshot()}
+
+# 8. DB POOL
+# Checkout wait and saturation of this process's connection pools, per shard
+@app.get("/internal/pool", dependencies=[Depends(require_service)])
+async def get_pool():
+    return router.stats()
+
+# 9. SHARDS
+# Shard names for consumers of the change feed, and where placements live
+@app.get("/internal/shards", dependencies=[Depends(require_service)])
+async def get_shards():
+    return {"shards": list(router.shards), "directory": router.directory.name}
+
+# 10. METRICS
+# Prometheus text format, per process; the /internal/* reports as time series
+register_collector(pool_metrics(router.stats))
+register_collector(admission_metrics)
+register_collector(upstream_metrics(resilience.snapshot))
+register_collector(coalescing_metrics(flights.snapshot))
+register_collector(cache_metrics(lambda: {"names": name_cache.snapshot()}))
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return metrics_response()
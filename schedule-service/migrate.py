@@ -0,0 +1,50 @@
+"""
+Schema migrations of schedule-service.
+
+    python migrate.py            apply pending migrations to every shard
+    python migrate.py --status   print the schema version of every shard
+
+Run before rolling out a build that adds a migration; pods only check the
+version at startup (see migrator.py).
+"""
+from db import Base, router
+# Registers the changes, resource_versions and sync_cursors tables
+import outbox
+import sync
+from migrator import Migration, create_tables, create_index, check_version, run_cli
+from shards import DirectoryBase
+
+MIGRATIONS = [
+    # The placement table is only read on the directory shard, but every
+    # shard gets one so any of them can become the directory
+    Migration(1, "baseline tables", [create_tables(Base.metadata, DirectoryBase.metadata)]),
+    Migration(2, "tenant-leading indexes", [
+        create_index("ix_schedules_institution_id_room_id_day", "schedules", ["institution_id", "room_id", "day"]),
+        create_index("ix_changes_institution_id_seq", "changes", ["institution_id", "seq"]),
+    ], transactional=False),
+    Migration(3, "resource versions for conditional GET", [create_tables(Base.metadata)]),
+    Migration(4, "schedule creation time for attendance reports", [
+        "ALTER TABLE schedules ADD COLUMN IF NOT EXISTS created_at TIMESTAMP",
+    ]),
+    # Feed cursors count writing transactions (outbox.py). Existing changes
+    # all get this migration's id, so consumers replay them once
+    Migration(5, "change feed ordered by transaction", [
+        "ALTER TABLE changes ADD COLUMN IF NOT EXISTS txid BIGINT NOT NULL DEFAULT (pg_current_xact_id()::text::bigint)",
+    ]),
+    Migration(6, "change feed transaction indexes", [
+        create_index("ix_changes_txid_seq", "changes", ["txid", "seq"]),
+        create_index("ix_changes_institution_id_txid_seq", "changes", ["institution_id", "txid", "seq"]),
+    ], transactional=False),
+    # room- and class-service feeds hand out transaction cursors now; follow
+    # them from the start (renames replay harmlessly). Roll out after them
+    Migration(7, "restart name sync on transaction cursors", ["DELETE FROM sync_cursors"]),
+]
+
+def targets() -> dict:
+    return {name: shard.engine for name, shard in router.shards.items()}
+
+async def check_schema():
+    await check_version(MIGRATIONS, targets())
+
+if __name__ == "__main__":
+    run_cli(MIGRATIONS, targets())
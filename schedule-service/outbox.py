@@ -0,0 +1,135 @@
+from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy import BigInteger, String, DateTime, Text, select, delete, text, literal_column
+from datetime import datetime, timedelta
+import asyncio
+import json
+import os
+
+from db import Base, router
+from versions import bump_versions
+
+# CONFIG
+OUTBOX_RETENTION_DAYS = int(os.getenv("OUTBOX_RETENTION_DAYS", "7"))
+# Writers on other replicas cannot wake our long-polls, so re-check this often
+LONG_POLL_INTERVAL = float(os.getenv("LONG_POLL_INTERVAL", "1.0"))
+LONG_POLL_MAX = 30.0
+
+# Transactions with a lower id have all ended: their changes are visible or
+# never will be. Feeds only hand out changes below it (see changes_since)
+COMMIT_HORIZON = literal_column("pg_snapshot_xmin(pg_current_snapshot())::text::bigint")
+
+class Change(Base):
+    __tablename__ = "changes"
+
+    seq: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=True)
+    # Id of the writing transaction; feed cursors count these, not seq
+    txid: Mapped[int] = mapped_column(
+        BigInteger, nullable=False, server_default=text("pg_current_xact_id()::text::bigint")
+    )
+    institution_id: Mapped[str] = mapped_column(String, nullable=False)
+    entity: Mapped[str] = mapped_column(String, nullable=False)
+    entity_id: Mapped[str] = mapped_column(String, nullable=False)
+    op: Mapped[str] = mapped_column(String, nullable=False)  # create / update
+    data: Mapped[str] = mapped_column(Text, nullable=False)  # JSON
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+# ---------- WRITE ----------
+async def record_changes(db, institution_id: str, entity: str, op: str, items: list[dict], id_key: str = "id"):
+    """
+    Add outbox rows for items to the caller's transaction and bump the
+    institution's version of entity (see versions.py). Writers take no
+    lock: rows carry their transaction's id, and readers wait for it to
+    fall below the commit horizon instead.
+    """
+    if not items:
+        return
+    db.add_all([
+        Change(
+            institution_id=institution_id,
+            entity=entity,
+            entity_id=str(item[id_key]),
+            op=op,
+            data=json.dumps(item)
+        )
+        for item in items
+    ])
+    await bump_versions(db, institution_id, entity)
+
+# Replaced on every notify; long-polls wait on the current one
+_changed = asyncio.Event()
+
+def notify_changes():
+    """Wake long-polls in this process. Call after the writing transaction commits."""
+    global _changed
+    _changed.set()
+    _changed = asyncio.Event()
+
+# ---------- READ ----------
+async def changes_since(db, institution_id, since: int, limit: int) -> list[Change]:
+    """
+    Changes of the transactions after cursor since, in transaction order,
+    whole transactions at a time: the last one is finished past limit. Only
+    transactions below the commit horizon are read, so a transaction still
+    running can never commit changes behind a cursor already handed out.
+    The next cursor is the txid of the last change.
+    """
+    query = select(Change).where(Change.txid > since, Change.txid < COMMIT_HORIZON)
+    if institution_id is not None:
+        query = query.where(Change.institution_id == institution_id)
+    result = await db.execute(query.order_by(Change.txid, Change.seq).limit(limit))
+    changes = result.scalars().all()
+    if len(changes) < limit:
+        return changes
+
+    last = changes[-1]
+    rest = select(Change).where(Change.txid == last.txid, Change.seq > last.seq)
+    if institution_id is not None:
+        rest = rest.where(Change.institution_id == institution_id)
+    result = await db.execute(rest.order_by(Change.seq))
+    return changes + result.scalars().all()
+
+async def wait_for_changes(db, institution_id, since: int, limit: int, wait: float) -> list[Change]:
+    """
+    Long-poll: return as soon as there is anything after since, or an empty
+    list once wait seconds have passed. institution_id None reads every tenant.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + min(wait, LONG_POLL_MAX)
+
+    while True:
+        changes = await changes_since(db, institution_id, since, limit)
+        remaining = deadline - loop.time()
+        if changes or remaining <= 0:
+            return changes
+
+        # Give the connection back to the pool while we sleep
+        await db.rollback()
+        try:
+            await asyncio.wait_for(_changed.wait(), min(remaining, LONG_POLL_INTERVAL))
+        except asyncio.TimeoutError:
+            pass
+
+def serialize_change(change: Change) -> dict:
+    return {
+        "seq": change.seq,
+        "institution_id": change.institution_id,
+        "entity": change.entity,
+        "entity_id": change.entity_id,
+        "op": change.op,
+        "data": json.loads(change.data),
+        "created_at": change.created_at
+    }
+
+# ---------- RETENTION ----------
+async def prune_changes_loop():
+    """Consumers further behind than OUTBOX_RETENTION_DAYS must re-fetch in full."""
+    while True:
+        cutoff = datetime.utcnow() - timedelta(days=OUTBOX_RETENTION_DAYS)
+        for shard in router.shards.values():
+            try:
+                async with shard.Session() as db:
+                    await db.execute(delete(Change).where(Change.created_at < cutoff))
+                    await db.commit()
+            except Exception as e:
+                print(f"Outbox prune error ({shard.name}): {e}")
+        await asyncio.sleep(3600)
@@ -1,5 +1,7 @@
 from pydantic import BaseModel
+import msgspec
 from typing import List, Optional
+from datetime import datetime
 
 # ---------- CREATE ----------
 class ScheduleCreateItem(BaseModel):
@@ -25,10 +27,21 @@ class ScheduleResponseItem(BaseModel):
     day: int
     start_time: int
     end_time: int
+    created_at: Optional[datetime] = None
+
+# Key order of fast-path rows (fastjson.py)
+SCHEDULE_FIELDS = tuple(ScheduleResponseItem.model_fields)
 
 class GetScheduleResponse(BaseModel):
     schedules: List[ScheduleResponseItem]
 
+# ---------- UPCOMING ----------
+class UpcomingScheduleItem(ScheduleResponseItem):
+    institution_id: str
+
+class UpcomingSchedulesResponse(BaseModel):
+    schedules: List[UpcomingScheduleItem]
+
 # ---------- VALIDATE AVAILABILITY ----------
 class ValidateAvailabilityItem(BaseModel):
     room_id: str
@@ -42,3 +55,29 @@ class ValidateAvailabilityRequest(BaseModel):
 class ValidateAvailabilityResponse(BaseModel):
     valid: bool
     conflicts: List[dict] = []
+
+# ---------- CHANGE FEED ----------
+class ChangeItem(BaseModel):
+    seq: int
+    institution_id: str
+    entity: str
+    entity_id: str
+    op: str
+    data: dict
+    created_at: datetime
+
+class ChangesResponse(BaseModel):
+    changes: List[ChangeItem]
+    cursor: int
+
+# ---------- UPSTREAM ANSWERS ----------
+# Decoded with wire.decode(); only the fields this service reads
+class NamedItem(msgspec.Struct):
+    id: str
+    name: Optional[str] = None
+
+class ExistenceValidation(msgspec.Struct):
+    """room-service and class-service validate-existence; each fills its own list."""
+    valid: bool
+    rooms: List[NamedItem] = []
+    classes: List[NamedItem] = []
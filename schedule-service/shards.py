@@ -0,0 +1,131 @@
+from contextlib import asynccontextmanager
+from datetime import datetime
+from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker, DeclarativeBase, Mapped, mapped_column
+from sqlalchemy import String, DateTime, select
+import json
+import os
+import time
+
+from engine import make_engine, pool_stats
+from replica import track_writes, prefer_primary, current_tenant
+
+# CONFIG
+# {"name": url, ...}. Unset: a single shard named "default" on DATABASE_URL
+DB_SHARDS = os.getenv("DB_SHARDS")
+# {"name": replica url, ...} for shards that have a read replica
+DB_SHARD_READ_URLS = os.getenv("DB_SHARD_READ_URLS")
+# Holds the placement table; tenants without a placement live here
+DB_DIRECTORY_SHARD = os.getenv("DB_DIRECTORY_SHARD")
+# How long a replica trusts a cached placement; the move tool waits this out
+SHARD_MAP_TTL = float(os.getenv("SHARD_MAP_TTL", "5"))
+
+DEFAULT_SHARD = "default"
+ACTIVE, MOVING = "active", "moving"
+
+class DirectoryBase(DeclarativeBase):
+    pass
+
+class TenantShard(DirectoryBase):
+    """Placement of an institution that does not live on the directory shard."""
+    __tablename__ = "tenant_shards"
+
+    institution_id: Mapped[str] = mapped_column(String, primary_key=True)
+    shard: Mapped[str] = mapped_column(String, nullable=False)
+    state: Mapped[str] = mapped_column(String, nullable=False, default=ACTIVE)
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class Shard:
+    def __init__(self, name: str, url: str, read_url: str = None):
+        self.name = name
+        self.engine = make_engine(url)
+        self.read_engine = make_engine(read_url) if read_url else self.engine
+        self.Session = sessionmaker(self.engine, class_=AsyncSession, expire_on_commit=False)
+        self.ReadSession = sessionmaker(self.read_engine, class_=AsyncSession, expire_on_commit=False)
+        track_writes(self.engine)
+
+    def session(self, readonly: bool = False) -> AsyncSession:
+        # Read-only work may use the replica unless the request must see its own writes
+        if readonly and not prefer_primary():
+            return self.ReadSession()
+        return self.Session()
+
+    def stats(self) -> dict:
+        stats = {"primary": pool_stats(self.engine)}
+        if self.read_engine is not self.engine:
+            stats["replica"] = pool_stats(self.read_engine)
+        return stats
+
+class ShardRouter:
+    """
+    Maps institution_id to the shard holding its rows. Placements are read
+    from the directory shard and cached for SHARD_MAP_TTL; institutions
+    without one live on the directory shard, so a single-shard deployment
+    never looks anything up. While move_tenant.py copies an institution its
+    state is "moving" and write sessions for it are refused with 503.
+    """
+
+    def __init__(self, database_url: str, read_url: str = None):
+        urls = json.loads(DB_SHARDS) if DB_SHARDS else {DEFAULT_SHARD: database_url}
+        read_urls = json.loads(DB_SHARD_READ_URLS) if DB_SHARD_READ_URLS else {}
+        if not DB_SHARDS and read_url:
+            read_urls = {DEFAULT_SHARD: read_url}
+
+        self.shards = {name: Shard(name, url, read_urls.get(name)) for name, url in urls.items()}
+        self.directory = self.shards[DB_DIRECTORY_SHARD or next(iter(urls))]
+        self.placements = {}
+
+    @property
+    def sharded(self) -> bool:
+        return len(self.shards) > 1
+
+    async def placement(self, institution_id: str, fresh: bool = False) -> tuple[str, str]:
+        """(shard name, state) of an institution."""
+        if not self.sharded or not institution_id:
+            return self.directory.name, ACTIVE
+
+        cached = self.placements.get(institution_id)
+        if cached and not fresh and cached[2] > time.monotonic():
+            return cached[0], cached[1]
+
+        async with self.directory.Session() as db:
+            row = (await db.execute(
+                select(TenantShard.shard, TenantShard.state)
+                .where(TenantShard.institution_id == institution_id)
+            )).first()
+        shard, state = (row.shard, row.state) if row else (self.directory.name, ACTIVE)
+        self.placements[institution_id] = (shard, state, time.monotonic() + SHARD_MAP_TTL)
+        return shard, state
+
+    async def shard_for(self, institution_id: str) -> Shard:
+        name, _ = await self.placement(institution_id)
+        return self.shards[name]
+
+    @asynccontextmanager
+    async def session(self, institution_id: str = None, readonly: bool = False, shard: str = None):
+        """
+        Session on the shard of institution_id (default: the tenant of the
+        current request, taken from its verified token by ReadYourWrites),
+        or on an explicitly named shard. Requests without a valid token get
+        the directory shard.
+        """
+        if shard is not None:
+            if shard not in self.shards:
+                raise HTTPException(status_code=404, detail=f"Unknown shard: {shard}")
+            target = self.shards[shard]
+        else:
+            name, state = await self.placement(institution_id or current_tenant())
+            if state == MOVING and not readonly:
+                raise HTTPException(
+                    status_code=503,
+                    detail="Institution is being moved, retry shortly",
+                    headers={"Retry-After": str(int(SHARD_MAP_TTL) + 1)}
+                )
+            target = self.shards[name]
+
+        async with target.session(readonly) as db:
+            yield db
+
+    def stats(self) -> dict:
+        return {name: shard.stats() for name, shard in self.shards.items()}
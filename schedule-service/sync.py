@@ -0,0 +1,170 @@
+from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy import BigInteger, String, select, update, bindparam, func
+from sqlalchemy.dialects.postgresql import insert
+import asyncio
+import os
+
+from db import Base, Schedule, router
+from versions import bump_versions
+from shards import MOVING
+from http_client import get_client
+
+# CONFIG
+SYNC_BATCH_SIZE = int(os.getenv("NAME_SYNC_BATCH_SIZE", "500"))
+SYNC_WAIT = float(os.getenv("NAME_SYNC_WAIT", "25"))
+SYNC_MAX_BACKOFF = 60.0
+
+class SyncCursor(Base):
+    __tablename__ = "sync_cursors"
+
+    source: Mapped[str] = mapped_column(String, primary_key=True)
+    cursor: Mapped[int] = mapped_column(BigInteger, nullable=False)
+
+# Cursors live on the directory shard, names on the shard of each institution
+async def load_cursor(source: str) -> int:
+    async with router.directory.Session() as db:
+        result = await db.execute(select(SyncCursor.cursor).where(SyncCursor.source == source))
+        return result.scalar_one_or_none() or 0
+
+async def save_cursor(db, source: str, cursor: int):
+    # Replicas run the same subscriber; never move a cursor backwards
+    stmt = insert(SyncCursor).values(source=source, cursor=cursor)
+    await db.execute(stmt.on_conflict_do_update(
+        index_elements=[SyncCursor.source],
+        set_={"cursor": func.greatest(SyncCursor.cursor, stmt.excluded.cursor)}
+    ))
+
+async def apply_names(db, institution_id: str, id_column: str, name_column: str, names: dict):
+    """
+    One executemany UPDATE per batch of one institution's ids. Leading with
+    institution_id keeps each statement on the tenant's index range; rows
+    already carrying the new name are skipped so a replayed feed does not
+    rewrite anything.
+    """
+    table = Schedule.__table__
+    stmt = (
+        update(table)
+        .where(table.c.institution_id == bindparam("b_institution"))
+        .where(table.c[id_column] == bindparam("b_id"))
+        .where(table.c[name_column].is_distinct_from(bindparam("b_name")))
+        .values({name_column: bindparam("b_name")})
+    )
+    items = list(names.items())
+    for offset in range(0, len(items), SYNC_BATCH_SIZE):
+        await db.execute(stmt, [
+            {"b_institution": institution_id, "b_id": entity_id, "b_name": name}
+            for entity_id, name in items[offset:offset + SYNC_BATCH_SIZE]
+        ])
+
+async def names_by_shard(changes: list[dict]) -> dict:
+    """
+    Group renames by the shard holding each institution's schedules, as
+    {shard: {institution_id: {entity_id: name}}}.
+    """
+    grouped = {}
+    for change in changes:
+        shard, state = await router.placement(change["institution_id"])
+        if state == MOVING:
+            # The move tool is copying this institution; retry the page once it is done
+            raise RuntimeError(f"institution {change['institution_id']} is being moved")
+        institutions = grouped.setdefault(shard, {})
+        institutions.setdefault(change["institution_id"], {})[change["entity_id"]] = change["data"]["name"]
+    return grouped
+
+async def upstream_shards(service_url: str, token: str) -> list:
+    """Shards of the upstream's change feed; [None] when it is not sharded."""
+    backoff = 1.0
+    while True:
+        try:
+            resp = await get_client().get(
+                f"{service_url}/internal/shards",
+                headers={"Authorization": f"Bearer {token}"}
+            )
+            if resp.status_code == 404:
+                return [None]
+            resp.raise_for_status()
+            body = resp.json()
+            # The directory shard keeps the unsuffixed cursor from before sharding
+            return [None if name == body["directory"] else name for name in body["shards"]]
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Shard discovery error ({service_url}): {e}")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, SYNC_MAX_BACKOFF)
+
+async def follow_service(
+    source: str,
+    service_url: str,
+    token: str,
+    entity: str,
+    id_column: str,
+    name_column: str,
+    name_cache=None
+):
+    """Run sync_names against every shard of the upstream's change feed."""
+    shards = await upstream_shards(service_url, token)
+    await asyncio.gather(*(
+        sync_names(source, service_url, token, entity, id_column, name_column, name_cache, shard)
+        for shard in shards
+    ))
+
+async def sync_names(
+    source: str,
+    service_url: str,
+    token: str,
+    entity: str,
+    id_column: str,
+    name_column: str,
+    name_cache=None,
+    shard: str = None
+):
+    """
+    Follow a service's change feed (one shard of it, when shard is given)
+    and copy renames of entity into the denormalized name column of
+    schedules, so reads never need a lookup. Renamed ids are dropped from
+    name_cache so new schedules pick them up.
+    """
+    cursor_key = f"{source}/{shard}" if shard else source
+    cursor = await load_cursor(cursor_key)
+    params = {"shard": shard} if shard else {}
+    backoff = 1.0
+
+    while True:
+        try:
+            resp = await get_client().get(
+                f"{service_url}/changes",
+                params={**params, "since": cursor, "limit": SYNC_BATCH_SIZE, "wait": SYNC_WAIT},
+                headers={"Authorization": f"Bearer {token}"},
+                timeout=SYNC_WAIT + 10
+            )
+            resp.raise_for_status()
+            body = resp.json()
+
+            # Last write per id wins within a page
+            changes = [c for c in body["changes"] if c["entity"] == entity]
+
+            if body["cursor"] != cursor:
+                # Names first: a crash before the cursor moves only replays the page
+                for shard_name, institutions in (await names_by_shard(changes)).items():
+                    async with router.shards[shard_name].Session() as db:
+                        for institution_id, names in institutions.items():
+                            await apply_names(db, institution_id, id_column, name_column, names)
+                            # Cached GET /schedules bodies carry the old name
+                            await bump_versions(db, institution_id, "schedule")
+                        await db.commit()
+                async with router.directory.Session() as db:
+                    await save_cursor(db, cursor_key, body["cursor"])
+                    await db.commit()
+                cursor = body["cursor"]
+
+            if name_cache is not None:
+                for change in changes:
+                    await name_cache.invalidate(f"{source}:{change['institution_id']}:{change['entity_id']}")
+            backoff = 1.0
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Name sync error ({cursor_key}): {e}")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, SYNC_MAX_BACKOFF)
@@ -0,0 +1,88 @@
+"""
+Tests run against real Postgres: TEST_DATABASE_URL names a server on which
+they may create and drop databases, otherwise pgserver (pip install
+pgserver) starts a throwaway one. Without either they are skipped.
+
+Handlers run with QUERY_COUNT_MODE=enforce against query_budgets.json, so
+a request over its route's budget fails the test. After an intended
+change, rewrite the budgets with
+
+    cd schedule-service && QUERY_COUNT_MODE=record python -m pytest tests
+"""
+import asyncio
+import importlib
+import os
+import sys
+import tempfile
+
+import pytest
+from jose import jwt
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVICE_DIR)
+
+SERVICE = "schedule-service"
+DATABASE = "schedule_test"
+BUDGET_FILE = os.path.join(SERVICE_DIR, "query_budgets.json")
+JWT_SECRET = "test-secret"
+
+@pytest.fixture(scope="session")
+def anyio_backend():
+    return "asyncio"
+
+@pytest.fixture(scope="session")
+def server_url():
+    url = os.getenv("TEST_DATABASE_URL")
+    if url:
+        yield url
+        return
+    try:
+        import pgserver
+    except ImportError:
+        pytest.skip("Set TEST_DATABASE_URL or pip install pgserver")
+    with tempfile.TemporaryDirectory() as data:
+        server = pgserver.get_server(data, cleanup_mode="stop")
+        yield f"postgresql+asyncpg://postgres:@/postgres?host={data}"
+        server.cleanup()
+
+def recreate_database(server_url: str, name: str) -> str:
+    """Drop and create database name on the server; its URL."""
+    async def run():
+        engine = create_async_engine(server_url, isolation_level="AUTOCOMMIT")
+        async with engine.connect() as conn:
+            await conn.execute(text(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)'))
+            await conn.execute(text(f'CREATE DATABASE "{name}"'))
+        await engine.dispose()
+
+    asyncio.run(run())
+    return make_url(server_url).set(database=name).render_as_string(hide_password=False)
+
+@pytest.fixture(scope="session")
+def service(server_url):
+    """The service's main module, configured for the test database before it is imported."""
+    os.environ["JWT_SECRET"] = JWT_SECRET
+    os.environ["DATABASE_URL"] = recreate_database(server_url, DATABASE)
+    os.environ.setdefault("QUERY_COUNT_MODE", "enforce")
+    os.environ["QUERY_BUDGET_FILE"] = BUDGET_FILE
+    return importlib.import_module("main")
+
+@pytest.fixture
+async def client(service):
+    """Client of the app on a migrated database; pools are closed after each test."""
+    import httpx
+    import migrate
+    from migrator import migrate_all
+
+    await migrate_all(migrate.MIGRATIONS, migrate.targets())
+    transport = httpx.ASGITransport(app=service.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
+    for shard in service.router.shards.values():
+        await shard.engine.dispose()
+
+def bearer(institution_id: str) -> dict:
+    token = jwt.encode({"sub": institution_id, "role": "admin"}, JWT_SECRET, algorithm="HS256")
+    return {"Authorization": f"Bearer {token}"}
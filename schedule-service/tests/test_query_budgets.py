@@ -0,0 +1,57 @@
+import json
+import os
+import uuid
+
+import httpx
+import pytest
+
+from conftest import SERVICE, BUDGET_FILE, bearer
+
+pytestmark = pytest.mark.anyio
+
+ROUTES = ["POST /schedules/create", "POST /schedules/validate-availability"]
+
+def test_budgets_are_committed():
+    if os.getenv("QUERY_COUNT_MODE") == "record":
+        pytest.skip("recording")
+    with open(BUDGET_FILE) as f:
+        budgets = json.load(f)[SERVICE]
+    assert set(ROUTES) <= set(budgets)
+
+def existence(request: httpx.Request) -> httpx.Response:
+    """room-service and class-service stand-in: every id exists, named after itself."""
+    body = json.loads(request.content)
+    key = "rooms" if "rooms" in body else "classes"
+    return httpx.Response(200, json={"valid": True, key: [{"id": i["id"], "name": f"name-{i['id']}"} for i in body[key]]})
+
+@pytest.fixture
+def upstreams(service, monkeypatch):
+    import http_client
+
+    monkeypatch.setattr(http_client, "_mounts", {})
+    monkeypatch.setattr(http_client, "_client", None)
+    for url in (service.ROOM_SERVICE_URL, service.CLASS_SERVICE_URL):
+        http_client.mount_transport(url, httpx.MockTransport(existence))
+    # JSON bodies, so the stand-in need not read MessagePack
+    monkeypatch.setattr(service, "accept_headers", lambda: {})
+    yield
+    http_client._client = None
+
+def slots(count: int) -> list:
+    return [{"room_id": f"room-{i}", "day": 1, "start_time": 800, "end_time": 900} for i in range(count)]
+
+@pytest.mark.parametrize("count", [1, 10])
+async def test_create_schedules(client, upstreams, count):
+    schedules = [dict(slot, class_id=f"class-{i}") for i, slot in enumerate(slots(count))]
+    resp = await client.post("/schedules/create", json={"schedules": schedules}, headers=bearer(str(uuid.uuid4())))
+    assert resp.status_code == 200, resp.text
+
+@pytest.mark.parametrize("count", [1, 10])
+async def test_validate_availability(client, count):
+    resp = await client.post(
+        "/schedules/validate-availability",
+        json={"schedules": slots(count)},
+        headers=bearer(str(uuid.uuid4()))
+    )
+    assert resp.status_code == 200, resp.text
+    assert resp.json()["valid"]
@@ -0,0 +1,32 @@
+from jose import jwt, JWTError
+
+# Where the first reader leaves (token, claims) on the ASGI scope, so the
+# middlewares and the handler's auth dependency share one decode
+SCOPE_KEY = "verified_claims"
+
+def bearer_token(scope) -> str:
+    """The request's bearer token, or "" without an Authorization header."""
+    for name, value in scope.get("headers", ()):
+        if name == b"authorization":
+            return value.decode("latin-1").partition(" ")[2]
+    return ""
+
+def verified_claims(scope, secret: str, algorithm: str = "HS256"):
+    """
+    Claims of the request's bearer token once its signature and expiry check
+    out, or None when it has no token or an invalid one. Admission control,
+    shard and replica routing and the handlers all ask; the JWT is decoded
+    by whichever asks first.
+    """
+    token = bearer_token(scope)
+    cached = scope.get(SCOPE_KEY)
+    if cached is not None and cached[0] == token:
+        return cached[1]
+    claims = None
+    if token:
+        try:
+            claims = jwt.decode(token, secret, algorithms=[algorithm])
+        except JWTError:
+            pass
+    scope[SCOPE_KEY] = (token, claims)
+    return claims